@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+''' Read c-cda documents straight out of zip, tar (optionally gzip, bzip2 or xz compressed), and single file gzip
+    archives without extracting them to disk.  Each document in an archive is described by an ArchiveMember whose
+    source_name is the archive path joined with the member's path inside the archive, so the member_document_suffix.xml
+    file name still identifies the document and any row can be traced back to its archive.
+    zip archives, uncompressed tar archives, and single file gzips are random access: any range of their members can
+    be read on its own, which lets separate workers each read a disjoint range.  Compressed tar archives can only be
+    read front to back, so their members are streamed in archive order by one reader.
+'''
+
+import os
+import gzip
+import zipfile
+import tarfile
+from itertools import groupby
+from collections import namedtuple
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+ZIP_SUFFIX = '.zip'
+GZIP_SUFFIX = '.gz'
+
+# archive is the archive file; member is the path inside it, None for a single file gzip; offset is where the
+# member's data starts in an uncompressed tar, None when the member cannot be read in place
+ArchiveMember = namedtuple('ArchiveMember', ['source_name', 'archive', 'member', 'offset', 'size'])
+
+def is_archive(path: str) -> bool:
+    ''' Return True if the given file name has a zip, tar, or gzip suffix
+    '''
+    return path.endswith((ZIP_SUFFIX, GZIP_SUFFIX, *TAR_SUFFIXES))
+
+
+def archive_members(archive_path: str, suffix: str) -> list[ArchiveMember]:
+    ''' Return the documents in the given archive whose file name ends with suffix, in archive order.  Listing a
+        compressed tar reads through the whole archive.
+    '''
+    if archive_path.endswith(ZIP_SUFFIX):
+        with zipfile.ZipFile(archive_path) as archive:
+            return [ArchiveMember(os.path.join(archive_path, info.filename), archive_path, info.filename, None, info.file_size)
+                    for info in archive.infolist() if not info.is_dir() and info.filename.endswith(suffix)]
+    if archive_path.endswith(TAR_SUFFIXES):
+        in_place = archive_path.endswith('.tar')
+        with tarfile.open(archive_path, 'r:' if in_place else 'r:*') as archive:
+            return [ArchiveMember(os.path.join(archive_path, info.name), archive_path, info.name,
+                                  info.offset_data if in_place else None, info.size)
+                    for info in archive if info.isfile() and info.name.endswith(suffix)]
+    if archive_path.endswith(GZIP_SUFFIX):
+        source_name = archive_path[:-len(GZIP_SUFFIX)]
+        return [ArchiveMember(source_name, archive_path, None, None, None)] if source_name.endswith(suffix) else []
+    raise ValueError(f'{archive_path} is not a supported archive')
+
+
+def is_random_access(member: ArchiveMember) -> bool:
+    ''' Return True if the given member can be read without reading the members before it
+    '''
+    return member.offset is not None or not member.archive.endswith(TAR_SUFFIXES)
+
+
+def read_members(members: list[ArchiveMember]):
+    ''' Yield (member, content bytes) for each of the given members, in order.  Each archive is opened once for a run
+        of consecutive members from it; members of a compressed tar must be in archive order.
+    '''
+    for archive_path, run in groupby(members, key=lambda member: member.archive):
+        run = list(run)
+        if archive_path.endswith(ZIP_SUFFIX):
+            with zipfile.ZipFile(archive_path) as archive:
+                for member in run:
+                    yield member, archive.read(member.member)
+        elif run[0].offset is not None:
+            with open(archive_path, 'rb') as fh:
+                for member in run:
+                    fh.seek(member.offset)
+                    yield member, fh.read(member.size)
+        elif archive_path.endswith(TAR_SUFFIXES):
+            wanted = {member.member: member for member in run}
+            with tarfile.open(archive_path, 'r|*') as archive:
+                for info in archive:
+                    member = wanted.pop(info.name, None)
+                    if member is not None:
+                        yield member, archive.extractfile(info).read()
+                        if not wanted:
+                            break
+            if wanted:
+                raise ValueError(f'{", ".join(wanted)} not found in {archive_path}')
+        else:
+            for member in run:
+                with gzip.open(archive_path, 'rb') as fh:
+                    yield member, fh.read()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+''' Parse throughput benchmark over synthetic c-cda documents.  Reports docs/sec, MB/sec, peak RSS, and the time spent
+    in each stage (xml parse, each extractor, csv write), and writes the results as json so runs can be compared across
+    commits with benchmarks/compare.py.  With --domains the named additional domains are extracted from the same parse
+    and timed together as the domains stage.  --input chooses how each document reaches the parser: bytes already in
+    memory, a file read as text (the original parse_raw_ccda_file path), a binary file streamed to the parser, or the
+    file mmapped as parse_raw_ccda_file now does.  The time to read the document is its own stage, and the Python
+    memory allocated to read and parse each document is measured with tracemalloc in a separate pass.
+    Run from the repository root:
+        python -m benchmarks.bench_parse --documents 500 --output results.json
+        python -m benchmarks.bench_parse --domains results,vitals,encounters,allergies,procedures
+        python -m benchmarks.bench_parse --input text --output text.json
+        python -m benchmarks.bench_parse --input mmap --output mmap.json
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+
+from parse_raw_ccda import HEADER_ELEMENTS, SECTION_ROOTS, extract_info_from_filename, _mapped_file
+from parsers import demographics
+from parsers import medications
+from parsers import problems
+from parsers.streaming import parse_ccda_sections
+from parsers.sections import build_section_index
+from parsers.domains import domains_named, section_roots_of
+from outputs import CsvOutput, domain_files_in
+from benchmarks.synthetic_ccda import generate_ccda, generate_ccda_file_name
+
+STAGES = ['read', 'xml_parse', 'demographics', 'medications', 'problems', 'domains', 'csv_write']
+INPUT_MODES = ['bytes', 'text', 'file', 'mmap']
+
+def run_benchmark(documents: list[tuple[str, bytes]], repeat: int = 3, domains: list[str] = (),
+                  input_mode: str = 'bytes') -> dict:
+    ''' Parse and write the given (file name, content) documents repeat times, with the given additional domains and
+        reading each document as input_mode, and return the stage times of the fastest run
+    '''
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as folder:
+            _write_documents(documents, folder, input_mode)
+            stages = _time_stages(documents, folder, domains, input_mode)
+        if best is None or sum(stages.values()) < sum(best.values()):
+            best = stages
+    return best
+
+
+def measure_allocations(documents: list[tuple[str, bytes]], input_mode: str = 'bytes') -> dict:
+    ''' Return the mean and largest peak of Python memory allocated while reading and parsing each document, in KB.
+        Content already in memory in bytes mode is not counted; an mmap is not a Python allocation.
+    '''
+    peaks = []
+    with tempfile.TemporaryDirectory() as folder:
+        _write_documents(documents, folder, input_mode)
+        tracemalloc.start()
+        try:
+            for file_name, content in documents:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                with _document_input(folder, file_name, content, input_mode) as source:
+                    parse_ccda_sections(source, HEADER_ELEMENTS, SECTION_ROOTS)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        finally:
+            tracemalloc.stop()
+    return {'alloc_per_doc_kb': sum(peaks) / len(peaks) / 1024, 'alloc_max_kb': max(peaks) / 1024}
+
+
+def _write_documents(documents: list[tuple[str, bytes]], folder: str, input_mode: str):
+    ''' write the documents to a documents folder under folder when they are read from files
+    '''
+    if input_mode == 'bytes':
+        return
+    os.makedirs(os.path.join(folder, 'documents'))
+    for file_name, content in documents:
+        with open(os.path.join(folder, 'documents', file_name), 'wb') as out_fh:
+            out_fh.write(content)
+
+
+@contextmanager
+def _document_input(folder: str, file_name: str, content: bytes, input_mode: str):
+    ''' give the parser input of one document as the given input mode reads it
+    '''
+    path = os.path.join(folder, 'documents', file_name)
+    if input_mode == 'bytes':
+        yield content
+    elif input_mode == 'text':
+        with open(path, encoding='utf-8') as fh:
+            yield fh.read()
+    elif input_mode == 'file':
+        with open(path, 'rb') as fh:
+            yield fh
+    else:
+        with _mapped_file(path) as mapped:
+            yield mapped
+
+
+def _time_stages(documents: list[tuple[str, bytes]], folder: str, domains: list[str] = (),
+                 input_mode: str = 'bytes') -> dict:
+    ''' run every document through each stage once, accumulating the time spent per stage
+    '''
+    stages = dict.fromkeys(STAGES, 0.0)
+    clock = time.perf_counter
+    extra = domains_named(list(domains))
+    section_roots = SECTION_ROOTS + section_roots_of(list(domains))
+    output = CsvOutput(os.path.join(folder, 'demographic_raw.csv'), os.path.join(folder, 'medication.csv'),
+                       os.path.join(folder, 'problem.csv'), domain_files=domain_files_in(folder, list(domains)))
+    for file_name, content in documents:
+        member_id, document_id = extract_info_from_filename(file_name)
+        start = clock()
+        with _document_input(folder, file_name, content, input_mode) as source:
+            read = clock()
+            ccda_dict = parse_ccda_sections(source, HEADER_ELEMENTS, section_roots)
+        sections = build_section_index(ccda_dict)
+        parsed = clock()
+        demographic_info = demographics.extract_demographic_information_from(ccda_dict, member_id, document_id)
+        demographic_done = clock()
+        medication_list = medications.extract_medication_information_from(ccda_dict, member_id, document_id, sections)
+        medication_done = clock()
+        problem_list = problems.extract_problem_information_from(ccda_dict, member_id, document_id, sections)
+        problem_done = clock()
+        domain_rows = {domain.name: domain.extract(sections, member_id, document_id) for domain in extra}
+        domains_done = clock()
+        output.write(demographic_info, medication_list, problem_list, domain_rows)
+        written = clock()
+        stages['read'] += read - start
+        stages['xml_parse'] += parsed - read
+        stages['demographics'] += demographic_done - parsed
+        stages['medications'] += medication_done - demographic_done
+        stages['problems'] += problem_done - medication_done
+        stages['domains'] += domains_done - problem_done
+        stages['csv_write'] += written - domains_done
+    start = clock()
+    output.close()
+    stages['csv_write'] += clock() - start
+    return stages
+
+
+def summarize(stages: dict, documents: list[tuple[str, bytes]], parameters: dict, allocations: dict = None) -> dict:
+    ''' Return the machine readable result record for a benchmark run
+    '''
+    seconds = sum(stages.values())
+    size = sum(len(content) for _, content in documents)
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'parameters': parameters,
+        'documents': len(documents),
+        'bytes': size,
+        'seconds': seconds,
+        'docs_per_sec': len(documents) / seconds,
+        'mb_per_sec': size / (1024 * 1024) / seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        **(allocations or {}),
+        'stages': stages,
+    }
+
+
+def peak_rss_mb() -> float:
+    ''' Return the peak resident set size of this process in MB
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _git_commit() -> str:
+    ''' return the current commit hash, or None outside a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark c-cda parsing over synthetic documents')
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--medications', type=int, default=20)
+    parser.add_argument('--problems', type=int, default=10)
+    parser.add_argument('--unrelated-entries', type=int, default=200)
+    parser.add_argument('--single-template', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--domains', type=lambda names: names.split(','), default=[],
+                        help='comma separated additional domains to extract')
+    parser.add_argument('--input', choices=INPUT_MODES, default='bytes',
+                        help='how documents reach the parser: in memory bytes (default), text, binary file, or mmap')
+    parser.add_argument('--output', help='json file to write the results to')
+    args = parser.parse_args()
+
+    PARAMETERS = {key: value for key, value in vars(args).items() if key != 'output'}
+    DOCUMENTS = [(generate_ccda_file_name(seed),
+                  generate_ccda(seed, args.medications, args.problems, args.unrelated_entries,
+                                args.single_template).encode('utf-8'))
+                 for seed in range(args.documents)]
+    RESULT = summarize(run_benchmark(DOCUMENTS, args.repeat, args.domains, args.input), DOCUMENTS, PARAMETERS,
+                       measure_allocations(DOCUMENTS, args.input))
+    print(json.dumps(RESULT, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out_fh:
+            json.dump(RESULT, out_fh, indent=2)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+''' Start up benchmark of the command line scripts.  Times, as fresh interpreters, a bare interpreter, the ccda.py
+    usage, the import of each script module, and the parse of synthetic documents both by one parse_raw_ccda.py process
+    per document and by a single ccda.py parse reading the document names from stdin.  Each is the fastest of --repeat
+    runs, and the results are written as json that benchmarks/compare.py reads, with docs_per_sec that of the stdin
+    parse.  A module that cannot be imported here, e.g. for a missing dependency, is reported as None.
+    Run from the repository root:
+        python -m benchmarks.bench_startup --documents 50 --output startup.json
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks.bench_parse import _git_commit
+from benchmarks.synthetic_ccda import generate_ccda, generate_ccda_file_name
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['parse_raw_ccda', 'bulk_parsing', 'downloader', 'process_files']
+OUTPUT_FILES = ['members.csv', 'medications.csv', 'problems.csv']
+
+def run_benchmark(documents: int, repeat: int = 5) -> dict:
+    ''' Return the fastest seconds of each start up measure over repeat runs, parsing the given number of documents
+    '''
+    stages = {'interpreter': _fastest(repeat, [sys.executable, '-c', 'pass']),
+              'usage': _fastest(repeat, [sys.executable, 'ccda.py'])}
+    for module in MODULES:
+        stages[f'import:{module}'] = _fastest(repeat, [sys.executable, '-c', f'import {module}'])
+    with tempfile.TemporaryDirectory() as folder:
+        sources = []
+        for seed in range(documents):
+            sources.append(os.path.join(folder, generate_ccda_file_name(seed)))
+            with open(sources[-1], 'w', encoding='utf-8') as out_fh:
+                out_fh.write(generate_ccda(seed))
+        outputs = [os.path.join(folder, name) for name in OUTPUT_FILES]
+        stages['parse_per_file'] = min(_parse_per_file(sources, outputs) for _ in range(repeat))
+        stages['parse_stdin'] = _fastest(repeat, [sys.executable, 'ccda.py', 'parse', '-', *outputs],
+                                         '\n'.join(sources))
+    return stages
+
+
+def summarize(stages: dict, documents: int, parameters: dict) -> dict:
+    ''' Return the machine readable result record for a benchmark run
+    '''
+    seconds = stages['parse_stdin']
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'parameters': parameters,
+        'documents': documents,
+        'seconds': seconds,
+        'docs_per_sec': documents / seconds,
+        'per_file_docs_per_sec': documents / stages['parse_per_file'],
+        'stages': stages,
+    }
+
+
+def _parse_per_file(sources: list[str], outputs: list[str]) -> float:
+    ''' seconds to parse each source with its own parse_raw_ccda.py process
+    '''
+    start = time.perf_counter()
+    for source in sources:
+        _run([sys.executable, 'parse_raw_ccda.py', source, *outputs])
+    return time.perf_counter() - start
+
+
+def _fastest(repeat: int, command: list[str], stdin: str = None) -> float:
+    ''' fastest seconds of repeat runs of command, or None if it fails
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if not _run(command, stdin):
+            return None
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _run(command: list[str], stdin: str = None) -> bool:
+    ''' run command from the repository root, reporting its error output if it fails
+    '''
+    result = subprocess.run(command, cwd=ROOT, input=stdin, capture_output=True, text=True)
+    if result.returncode != 0:
+        errors = result.stderr.strip().splitlines()
+        print(f'{" ".join(command[1:])} failed: {errors[-1] if errors else result.returncode}', file=sys.stderr)
+    return result.returncode == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the start up of the c-cda command line scripts')
+    parser.add_argument('--documents', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='json file to write the results to')
+    args = parser.parse_args()
+
+    PARAMETERS = {key: value for key, value in vars(args).items() if key != 'output'}
+    RESULT = summarize(run_benchmark(args.documents, args.repeat), args.documents, PARAMETERS)
+    print(json.dumps(RESULT, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out_fh:
+            json.dump(RESULT, out_fh, indent=2)
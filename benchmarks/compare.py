@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+''' Compare two result files written by benchmarks/bench_parse.py or benchmarks/bench_startup.py.  Prints each metric from
+    both runs with the ratio of the second to the first.
+        python -m benchmarks.compare before.json after.json
+'''
+
+import json
+import argparse
+
+METRICS = ['docs_per_sec', 'per_file_docs_per_sec', 'mb_per_sec', 'peak_rss_mb', 'alloc_per_doc_kb', 'seconds']
+
+def compare(baseline: dict, candidate: dict) -> list[tuple[str, float, float, float]]:
+    ''' Return (metric, baseline value, candidate value, candidate / baseline) for the top level metrics and each stage
+    '''
+    pairs = [(metric, baseline.get(metric), candidate.get(metric)) for metric in METRICS]
+    for stage in baseline.get('stages', {}):
+        pairs.append((f'stage:{stage}', baseline['stages'][stage], candidate.get('stages', {}).get(stage)))
+    return [(metric, old, new, new / old if old and new is not None else None) for metric, old, new in pairs]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding='utf-8') as fh:
+        BASELINE = json.load(fh)
+    with open(args.candidate, encoding='utf-8') as fh:
+        CANDIDATE = json.load(fh)
+    if BASELINE.get('parameters') != CANDIDATE.get('parameters'):
+        print('warning: runs used different parameters')
+    print(f"{'metric':<24}{BASELINE.get('commit') or 'baseline':>14}{CANDIDATE.get('commit') or 'candidate':>14}{'ratio':>10}")
+    for METRIC, OLD, NEW, RATIO in compare(BASELINE, CANDIDATE):
+        print(f"{METRIC:<24}{OLD if OLD is not None else '-':>14.6}{NEW if NEW is not None else '-':>14.6}"
+              f"{RATIO if RATIO is not None else '-':>10.3}")
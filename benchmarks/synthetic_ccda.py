@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+''' Deterministic generator of synthetic c-cda documents for benchmarking.  The same seed and parameters always produce
+    the same bytes.  Documents carry the header, recordTarget, medication and problem sections the parsers read, plus
+    results, vitals, and encounters sections of configurable size that the parsers are expected to skip.
+'''
+
+import os
+import random
+import argparse
+
+from parsers.ccda_segment_codes import SEGMENT_MAP
+
+UNRELATED_SECTIONS = ['results', 'vitals', 'encounters']
+
+def generate_ccda(seed: int, medications: int = 5, problems: int = 5, unrelated_entries: int = 20,
+                  single_template: bool = False) -> str:
+    ''' Return a synthetic c-cda document.  medications and problems give the number of entries in those sections; a
+        count of one produces the single dictionary shape rather than a list once parsed.  unrelated_entries is the
+        number of observations in each of the unrelated sections.  single_template uses one templateId per section.
+    '''
+    rnd = random.Random(seed)
+    body = [_section('results', single_template, 'Results', _observations(rnd, unrelated_entries)),
+            _section('medications', single_template, 'Medications',
+                     ''.join(_medication_entry(rnd, index) for index in range(medications))),
+            _section('vitals', single_template, 'Vital Signs', _observations(rnd, unrelated_entries)),
+            _section('problems', single_template, 'Problems',
+                     ''.join(_problem_entry(rnd, index) for index in range(problems))),
+            _section('encounters', single_template, 'Encounters', _observations(rnd, unrelated_entries))]
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<ClinicalDocument xmlns="urn:hl7-org:v3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:sdtc="urn:hl7-org:sdtc">
+<realmCode code="US"/>
+<typeId root="2.16.840.1.113883.1.3" extension="POCD_HD000040"/>
+<templateId root="{SEGMENT_MAP['document'][0]}"/>
+<templateId root="{SEGMENT_MAP['document'][0]}" extension="2015-08-01"/>
+<id root="2.16.840.1.113883.19.5" extension="{seed}"/>
+<code code="34133-9" codeSystem="2.16.840.1.113883.6.1" displayName="Summarization of Episode Note"/>
+<title>Continuity of Care Document</title>
+<effectiveTime value="{_timestamp(rnd, 2018, 2024)}"/>
+<recordTarget><patientRole>
+<id extension="{seed}" root="2.16.840.1.113883.19.5"/>
+<addr use="HP"><streetAddressLine>{rnd.randint(1, 9999)} Main St</streetAddressLine><city>Springfield</city><state>MA</state><postalCode>{rnd.randint(10000, 99999)}</postalCode><country>US</country></addr>
+<telecom value="tel:+1-555-{rnd.randint(1000, 9999)}" use="HP"/>
+<patient>
+<name use="L"><given>Given{seed}</given><given qualifier="CL">Middle</given><family>Family{seed}</family></name>
+<administrativeGenderCode code="{rnd.choice('FM')}" codeSystem="2.16.840.1.113883.5.1"/>
+<birthTime value="{rnd.randint(1930, 2015)}{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}"/>
+<maritalStatusCode code="{rnd.choice('MSDW')}" codeSystem="2.16.840.1.113883.5.2"/>
+<raceCode code="2106-3" codeSystem="2.16.840.1.113883.6.238"/>
+<sdtc:raceCode code="2108-9" codeSystem="2.16.840.1.113883.6.238"/>
+<ethnicGroupCode code="2186-5" codeSystem="2.16.840.1.113883.6.238"/>
+<languageCommunication><languageCode code="en"/></languageCommunication>
+</patient>
+<providerOrganization><name>Community Health &amp; Hospitals</name><telecom value="tel:+1-555-0100"/></providerOrganization>
+</patientRole></recordTarget>
+<author><time value="{_timestamp(rnd, 2018, 2024)}"/><assignedAuthor><id root="2.16.840.1.113883.4.6"/></assignedAuthor></author>
+<component><structuredBody>
+{''.join(body)}
+</structuredBody></component>
+</ClinicalDocument>
+'''
+
+
+def generate_ccda_file_name(seed: int) -> str:
+    ''' Return a file name for the generated document that follows the member_document_masked.xml structure
+    '''
+    return f'M{seed:08d}_D{seed:08d}_masked.xml'
+
+
+def _section(domain: str, single_template: bool, title: str, entries: str) -> str:
+    ''' return a structuredBody component for the given SEGMENT_MAP domain
+    '''
+    roots = SEGMENT_MAP[domain][:1] if single_template else SEGMENT_MAP[domain]
+    template_ids = ''.join(f'<templateId root="{root}"/>' for root in roots)
+    return (f'<component><section>{template_ids}<code code="00000-0" codeSystem="2.16.840.1.113883.6.1"/>'
+            f'<title>{title}</title><text><paragraph>{title} narrative</paragraph></text>{entries}</section></component>\n')
+
+
+def _medication_entry(rnd: random.Random, index: int) -> str:
+    ''' return a medication activity entry
+    '''
+    precondition = ''
+    if index % 3 == 0:
+        precondition = ('<precondition typeCode="PRCN"><criterion><code code="56018004" codeSystem="2.16.840.1.113883.6.96"/>'
+                        '</criterion></precondition>')
+    return f'''<entry typeCode="DRIV"><substanceAdministration classCode="SBADM" moodCode="INT">
+<templateId root="2.16.840.1.113883.10.20.22.4.16"/>
+<id root="{rnd.randint(1, 10 ** 9)}"/>
+<statusCode code="{rnd.choice(['active', 'completed'])}"/>
+<effectiveTime xsi:type="IVL_TS"><low value="{_timestamp(rnd, 2010, 2020)}"/><high value="{_timestamp(rnd, 2020, 2025)}"/></effectiveTime>
+<effectiveTime xsi:type="PIVL_TS" operator="A"><period value="12" unit="h"/></effectiveTime>
+<routeCode code="C38288" codeSystem="2.16.840.1.113883.3.26.1.1" codeSystemName="NCI Thesaurus" displayName="ORAL"/>
+<doseQuantity value="{rnd.randint(1, 4)}" unit="{rnd.choice(['mg', 'mL', '1'])}"/>
+<consumable><manufacturedProduct classCode="MANU"><manufacturedMaterial>
+<code code="{rnd.randint(100000, 999999)}" codeSystem="2.16.840.1.113883.6.88"><originalText>Product {index}</originalText><translation code="{rnd.randint(10000, 99999)}" codeSystem="2.16.840.1.113883.6.69" codeSystemName="NDC"/></code>
+</manufacturedMaterial></manufacturedProduct></consumable>
+{precondition}
+</substanceAdministration></entry>
+'''
+
+
+def _problem_entry(rnd: random.Random, index: int) -> str:
+    ''' return a problem concern act entry
+    '''
+    translation = ''
+    if index % 2 == 0:
+        translation = f'<translation code="E{rnd.randint(10, 99)}.{rnd.randint(0, 9)}" codeSystem="2.16.840.1.113883.6.90" codeSystemName="ICD10CM"/>'
+    return f'''<entry typeCode="DRIV"><act classCode="ACT" moodCode="EVN">
+<templateId root="2.16.840.1.113883.10.20.22.4.3"/>
+<id root="{rnd.randint(1, 10 ** 9)}"/>
+<code code="CONC" codeSystem="2.16.840.1.113883.5.6" codeSystemName="HL7ActClass"/>
+<statusCode code="{rnd.choice(['active', 'completed'])}"/>
+<effectiveTime><low value="{_timestamp(rnd, 2005, 2020)}"/></effectiveTime>
+<entryRelationship typeCode="SUBJ"><observation classCode="OBS" moodCode="EVN">
+<templateId root="2.16.840.1.113883.10.20.22.4.4"/>
+<code code="{rnd.randint(10 ** 7, 10 ** 8)}" codeSystem="2.16.840.1.113883.6.96" codeSystemName="SNOMED CT">{translation}</code>
+<value xsi:type="CD" code="{rnd.randint(10 ** 7, 10 ** 8)}" codeSystem="2.16.840.1.113883.6.96"/>
+</observation></entryRelationship>
+</act></entry>
+'''
+
+
+def _observations(rnd: random.Random, count: int) -> str:
+    ''' return count result style observation entries for an unrelated section
+    '''
+    return ''.join(f'''<entry typeCode="DRIV"><organizer classCode="CLUSTER" moodCode="EVN"><statusCode code="completed"/>
+<component><observation classCode="OBS" moodCode="EVN"><templateId root="2.16.840.1.113883.10.20.22.4.2"/>
+<code code="{rnd.randint(1000, 99999)}-{rnd.randint(0, 9)}" codeSystem="2.16.840.1.113883.6.1" displayName="Observation {index}"/>
+<effectiveTime value="{_timestamp(rnd, 2015, 2024)}"/>
+<value xsi:type="PQ" value="{rnd.uniform(0, 500):.2f}" unit="mg/dL"/>
+<referenceRange><observationRange><text>normal range for observation {index}</text></observationRange></referenceRange>
+</observation></component></organizer></entry>
+''' for index in range(count))
+
+
+def _timestamp(rnd: random.Random, first_year: int, last_year: int) -> str:
+    ''' return an hl7 timestamp, mixing day and second precision with and without timezone offsets
+    '''
+    date = f'{rnd.randint(first_year, last_year)}{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}'
+    shape = rnd.randint(0, 2)
+    if shape == 0:
+        return date
+    time = f'{rnd.randint(0, 23):02d}{rnd.randint(0, 59):02d}{rnd.randint(0, 59):02d}'
+    return date + time if shape == 1 else f'{date}{time}-0500'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic c-cda documents to a folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--medications', type=int, default=5)
+    parser.add_argument('--problems', type=int, default=5)
+    parser.add_argument('--unrelated-entries', type=int, default=20)
+    parser.add_argument('--single-template', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    for seed in range(args.seed, args.seed + args.documents):
+        with open(os.path.join(args.output_folder, generate_ccda_file_name(seed)), 'w', encoding='utf-8') as out_fh:
+            out_fh.write(generate_ccda(seed, args.medications, args.problems, args.unrelated_entries, args.single_template))
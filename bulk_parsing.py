@@ -1,33 +1,214 @@
 #!/usr/bin/env python
 ''' Parse each raw ccda xml file in the given folder into the contained demographic, medication, and problem
     domains. Results will be written to demographic_raw.csv, medicaion.csv, and problem.csv files in the local
-    folder or the output_folder if one is given
+    folder or the output_folder if one is given.  With --workers N the documents are parsed by a pool of N
+    processes while this process remains the only writer, so rows are appended in the same order as a serial run.
+    Completed documents are recorded in manifest.sqlite in the output folder; rerunning into the same folder skips
+    them and picks up from the first document that was not completed.  With --metrics FILE per document stage timings
+    and row counts are collected and a summary with percentiles and the slowest documents is written to FILE.
+    With --output-format sqlite the rows are loaded into indexed tables of ccda.sqlite instead of the csv files, and
+    --upsert-members keeps one demographic row per member.
+    With --tolerant a document that fails is recorded, with the stage it failed in and a digest of its traceback, to
+    quarantine/report.jsonl in the output folder and moved into that folder, and the run continues; a summary of the
+    documents that succeeded and failed is written at the end.
+    zip, tar, tar.gz, and single document gzip archives in the source folder, or given in its place, are read without
+    being extracted; each document's source is the archive path joined with its path inside the archive.
+    With --member-index the latest demographic row of each member is kept in member_index.sqlite as documents are
+    written and members_current.csv is written from it at the end of the run.  --domains adds the named domains, e.g.
+    allergies,results,vitals, to the same parse of each document and writes their rows to a csv file per domain.
 '''
 
 import os
-import sys
+import argparse
 import logging
+from itertools import chain, groupby
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from parse_raw_ccda import parse_raw_ccda_file, parse_raw_ccda_text, extract_raw_ccda_file, extract_raw_ccda_text, \
+    write_raw_ccda_rows
+from archives import ArchiveMember, is_archive, is_random_access, archive_members, read_members
+from pipeline import ordered_map
+from outputs import CSV_FORMAT, add_output_arguments, check_output_arguments, open_output, restored_files_in
+from manifest import Manifest, MANIFEST_FILE
+from metrics import MetricsSink
+from quarantine import Quarantine, DocumentFailure, DocumentFailed, failure_of, isolated, worker_task
+from member_index import MemberIndex, IndexedOutput
+from runs import run_sinks
+
+DOCUMENT_SUFFIX = '_masked.xml'
+
+def bulk_parse_folder(source_folder: str, output_folder: str, workers: int = 1, metrics: MetricsSink = None,
+                      output_format: str = CSV_FORMAT, upsert_members: bool = False, quarantine: Quarantine = None,
+                      shards: int = None, rows_per_shard: int = None, compress: bool = False,
+                      member_index: MemberIndex = None, domains: list[str] = None) -> None:
+    ''' Parse each raw ccda xml file in the given folder, appending results to the domain csv files in output_folder,
+        or to the database there with the sqlite output_format.  Documents inside zip, tar, and gzip archives in the
+        folder, or in the archive given as source_folder, are read from the archive without extracting it.  When
+        workers is greater than one the parsing is spread over a process pool and the rows are written by this
+        process in listing order.  Per document measurements are recorded to metrics if given.
+        With a quarantine the run is tolerant: a document that fails is recorded there, a loose file is moved into the
+        quarantine folder, and the run continues with the next document.
+        With shards or rows_per_shard the csv output is split into shard files, gzip compressed with compress, and
+        listed in shards.json.  With a member_index the demographic row of each document written is applied to it.
+        The rows of the additional domains named in domains are extracted in the same parse and written to their own
+        csv files, shards, or tables.
+    '''
+    source_files, members = _documents_in(source_folder, quarantine)
+
+    with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+        sharded = shards is not None or rows_per_shard is not None
+        manifest.restore(restored_files_in(output_folder, output_format, sharded, domains or []))
+        source_files = [source_file for source_file in source_files if not manifest.is_complete(source_file)]
+        members = [member for member in members if not manifest.is_complete(member.source_name)]
+        on_flush = manifest.checkpoint if member_index is None else member_index.checkpointed(manifest.checkpoint)
+        with open_output(output_format, output_folder, on_flush, upsert_members, shards, rows_per_shard,
+                         compress, domains) as output:
+            if member_index is not None:
+                output = IndexedOutput(output, member_index)
+            if workers <= 1:
+                for source_file in source_files:
+                    with isolated(quarantine, source_file, 'read', source_file, metrics), manifest.track(source_file):
+                        parse_raw_ccda_file(source_file, output=output, metrics=metrics, domains=domains)
+                for member, content in _read(members, quarantine is not None):
+                    source_name = member.source_name
+                    with isolated(quarantine, source_name, 'read', metrics=metrics), manifest.track(source_name):
+                        if isinstance(content, DocumentFailure):
+                            raise DocumentFailed(content)
+                        parse_raw_ccda_text(content, source_name, output=output, metrics=metrics, domains=domains)
+                return
+
+            tolerant = quarantine is not None
+            chunksize = max(1, min(64, (len(source_files) + len(members)) // (workers * 4)))
+            extract = worker_task(partial(extract_raw_ccda_file, domains=domains), 'read', tolerant, metrics is not None)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # loose files go to the workers in chunks, at most 2 * workers chunks in flight as for archive ranges
+                chunks = (source_files[start:start + chunksize] for start in range(0, len(source_files), chunksize))
+                files = ordered_map(executor, partial(_extract_files, extract), chunks, 2 * workers)
+                results = chain(chain.from_iterable(files),
+                                _extract_members(executor, members, workers, chunksize, metrics is not None, tolerant,
+                                                 domains))
+                sources = chain(((source_file, source_file) for source_file in source_files),
+                                ((member.source_name, None) for member in members))
+                for source_name, source_file in sources:
+                    # failures returned by the workers are raised here so the manifest and quarantine both see them
+                    with isolated(quarantine, source_name, 'write', source_file, metrics), manifest.track(source_name):
+                        rows = next(results)
+                        if metrics is not None:
+                            rows, values = rows
+                            metrics.record_all(source_name, values)
+                        if isinstance(rows, DocumentFailure):
+                            raise DocumentFailed(rows)
+                        write_raw_ccda_rows(output, rows, source_name, metrics)
+                    logging.info('Done parsing %s', source_name)
+
+def _documents_in(source: str, quarantine: Quarantine = None) -> tuple[list[str], list[ArchiveMember]]:
+    ''' return the loose document files in the given folder and the documents inside the archives in it, or only the
+        documents of source if it is itself an archive.  An archive that cannot be listed is quarantined if a
+        quarantine is given.
+    '''
+    if os.path.isfile(source):
+        return [], archive_members(source, DOCUMENT_SUFFIX)
+    source_files, members = [], []
+    for file in os.listdir(source):
+        if file.endswith(DOCUMENT_SUFFIX):
+            source_files.append(os.path.join(source, file))
+        elif is_archive(file):
+            archive = os.path.join(source, file)
+            # a listing failure is quarantined, but a listed archive is not a document and is not counted a success
+            try:
+                members.extend(archive_members(archive, DOCUMENT_SUFFIX))
+            except Exception as oops:
+                if quarantine is None:
+                    raise
+                quarantine.add(archive, oops, 'read', archive)
+    return source_files, members
+
+
+def _extract_members(executor, members: list[ArchiveMember], workers: int, chunksize: int, measure: bool,
+                     tolerant: bool = False, domains: list[str] = None):
+    ''' yield the rows of each archive member in order.  Random access archives are split into ranges of chunksize
+        members that each worker reads for itself; compressed tars are streamed here and their documents handed to the
+        workers.  With measure each result is paired with its recorded metric values, and when tolerant a failed
+        document yields its DocumentFailure.  The additional domains named in domains are extracted as well.
+    '''
+    window = 2 * workers
+    for random_access, run in groupby(members, key=is_random_access):
+        run = list(run)
+        if random_access:
+            ranges = [run[start:start + chunksize] for start in range(0, len(run), chunksize)]
+            extract_range = partial(_extract_range, measure=measure, tolerant=tolerant, domains=domains)
+            for rows in ordered_map(executor, extract_range, ranges, window):
+                yield from rows
+        else:
+            extract = worker_task(partial(_extract_content, domains=domains), 'read', tolerant, measure)
+            yield from ordered_map(executor, extract, _read(run, tolerant), window * chunksize)
+
+
+def _extract_files(extract, source_files: list[str]) -> list:
+    ''' parse a chunk of loose document files in a worker process
+    '''
+    return [extract(source_file) for source_file in source_files]
+
+
+def _extract_range(members: list[ArchiveMember], measure: bool = False, tolerant: bool = False,
+                   domains: list[str] = None) -> list:
+    ''' read and parse a range of archive members in a worker process
+    '''
+    extract = worker_task(partial(_extract_content, domains=domains), 'read', tolerant, measure)
+    return [extract(read) for read in _read(members, tolerant)]
+
+
+def _read(members: list[ArchiveMember], tolerant: bool):
+    ''' yield (member, content) for each of the given members.  When tolerant and the archive cannot be read, the
+        members that were not read are yielded with the DocumentFailure in place of their content.
+    '''
+    if not tolerant:
+        yield from read_members(members)
+        return
+    done = 0
+    try:
+        for read in read_members(members):
+            done += 1
+            yield read
+    except Exception as oops:
+        failure = failure_of(oops, 'read')
+        for member in members[done:]:
+            yield member, failure
+
+
+def _extract_content(read: tuple[ArchiveMember, bytes], metrics: MetricsSink = None, domains: list[str] = None):
+    ''' parse the content of an archive member read by the parent process, passing on the failure of one that could
+        not be read
+    '''
+    member, content = read
+    if isinstance(content, DocumentFailure):
+        return content
+    return extract_raw_ccda_text(content, member.source_name, metrics, domains)
+
+
+def main(argv: list[str] = None, prog: str = None):
+    ''' Parse a folder from the command line, as this script or ccda.py bulk
+    '''
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description='Parse each raw ccda xml file in the given folder into domain csv files')
+    parser.add_argument('xml_source_folder', help='folder of xml files and archives, or a single zip, tar, or gzip archive')
+    parser.add_argument('output_folder', nargs='?', default='.')
+    parser.add_argument('--workers', type=int, default=1, help='number of parsing processes (default 1, serial)')
+    add_output_arguments(parser)
+    args = parser.parse_args(argv)
+    check_output_arguments(parser, args)
+
+    source = args.xml_source_folder
+    if not os.path.exists(source):
+        raise ValueError(f'{source} does not exist')
+    output_folder = args.output_folder
+    os.makedirs(output_folder, exist_ok=True)
+
+    with run_sinks(args, output_folder) as sinks:
+        bulk_parse_folder(source, output_folder, args.workers, sinks.metrics, args.output_format, args.upsert_members,
+                          sinks.quarantine, args.shards, args.shard_rows, args.gzip, sinks.member_index, args.domains)
 
-from parse_raw_ccda import parse_raw_ccda_file
 
 if __name__ == '__main__':
-    if len(sys.argv) not in (2, 3):
-        logging.warning('USAGE: %s xml_source_folder [output_folder]', sys.argv[0])
-        sys.exit(0)
-
-    SOURCE = sys.argv[1]
-    if not os.path.exists(SOURCE):
-        raise ValueError(f'{SOURCE} does not exist')
-    OUTPUT_FOLDER = '.'
-    if len(sys.argv) == 3:
-        OUTPUT_FOLDER = sys.argv[2]
-        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-    DEMOGRAPHIC_FILE = 'demographic_raw.csv'
-    MEDICATION_FILE = 'medication.csv'
-    PROBLEM_FILE = 'problem.csv'
-
-    for file in os.listdir(SOURCE):
-        if file.endswith('_masked.xml'):
-            source_file = os.path.join(SOURCE, file)
-            parse_raw_ccda_file(source_file, os.path.join(OUTPUT_FOLDER, DEMOGRAPHIC_FILE),
-                                os.path.join(OUTPUT_FOLDER, MEDICATION_FILE), os.path.join(OUTPUT_FOLDER, PROBLEM_FILE))
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+''' One command line for the c-cda scripts, with a subcommand for each:
+        ccda.py parse xml_ccda_source_file members_file medications_file problems_file     as parse_raw_ccda.py
+        ccda.py bulk xml_source_folder [output_folder] [options]                            as bulk_parsing.py
+        ccda.py fetch url_file [output_folder] [options]                                    as downloader.py
+        ccda.py process url_file [output_folder] [options]                                  as process_files.py process
+    The arguments after the subcommand are those of the script it runs, and ccda.py SUBCOMMAND -h lists them.  Only the
+    module of the chosen subcommand is imported, once it is known, so the usage costs no imports and a fetch imports
+    requests but none of the parsers; process imports requests and the xml parse only once its arguments are parsed.
+    ccda.py parse - members_file medications_file problems_file reads the names of the documents from stdin, one per
+    line, so one process parses them all.
+'''
+
+import os
+import sys
+import importlib
+
+# subcommand -> module whose main runs it, keyword arguments for that main, and a summary for the usage
+COMMANDS = {
+    'parse': ('parse_raw_ccda', {}, 'parse a c-cda xml file, or - for a list of files on stdin, into three csv files'),
+    'bulk': ('bulk_parsing', {}, 'parse a folder or archive of c-cda xml files into domain csv files'),
+    'fetch': ('downloader', {}, 'download the documents at the signed urls in a file into a cache folder'),
+    'process': ('process_files', {'option': 'process'}, 'download and parse the documents at the signed urls in a file'),
+}
+
+def usage(prog: str) -> str:
+    ''' Return the usage message listing the subcommands
+    '''
+    lines = [f'usage: {prog} {{{",".join(COMMANDS)}}} ...', '', 'subcommands:']
+    lines.extend(f'  {name:<10}{summary}' for name, (_, _, summary) in COMMANDS.items())
+    lines.append(f'\nrun {prog} SUBCOMMAND -h for the arguments of each')
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] = None):
+    ''' Run the subcommand named by the first argument with the rest of the arguments
+    '''
+    argv = sys.argv[1:] if argv is None else argv
+    prog = os.path.basename(sys.argv[0])
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage(prog))
+        return
+    if argv[0] not in COMMANDS:
+        print(usage(prog), file=sys.stderr)
+        sys.exit(f'{prog}: unknown subcommand {argv[0]}')
+
+    module, options, _ = COMMANDS[argv[0]]
+    importlib.import_module(module).main(argv[1:], prog=f'{prog} {argv[0]}', **options)
+
+
+if __name__ == '__main__':
+    main()
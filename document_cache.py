@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+''' Local cache of downloaded c-cda documents.  Documents are stored under their own file name in the cache folder, as
+    the cache option always has, and an index in the same folder records the sha256 and size of each one together with
+    when it was last used.  An entry is only served if the file is still present and its content hash matches, so a
+    partial or altered file is fetched again.  With max_bytes set, the least recently used documents are evicted once
+    the cache grows past the cap.
+'''
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+INDEX_FILE = '.cache_index.sqlite'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class DocumentCache:
+    ''' Content verified, size capped document cache.  Safe to share between fetch threads.
+    '''
+    def __init__(self, folder: str, max_bytes: int = None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(folder, INDEX_FILE), check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, '
+                                    'last_used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS documents_last_used ON documents (last_used)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        ''' Close the cache index
+        '''
+        self.connection.close()
+
+    def path_for(self, name: str) -> str:
+        ''' Return the cache location of the document with the given name, whether or not it is cached
+        '''
+        return os.path.join(self.folder, name)
+
+    def get(self, name: str) -> str:
+        ''' Return the path of the cached document with the given name if a valid entry exists, otherwise None.
+            Entries whose file is missing or no longer matches the recorded size and hash are dropped.
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT sha256, size FROM documents WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        path = self.path_for(name)
+        sha256, size = row
+        if not os.path.exists(path) or os.path.getsize(path) != size or file_sha256(path) != sha256:
+            logging.warning('Cached %s is missing or does not match its recorded hash', name)
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM documents WHERE name = ?', (name,))
+            return None
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE documents SET last_used = ? WHERE name = ?', (time.time(), name))
+        return path
+
+    def add(self, name: str, sha256: str = None):
+        ''' Record the document already written to path_for(name), hashing it unless its sha256 is given, then evict
+            least recently used documents if the cache is over its cap.
+        '''
+        path = self.path_for(name)
+        if sha256 is None:
+            sha256 = file_sha256(path)
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                                    (name, sha256, os.path.getsize(path), time.time()))
+            if self.max_bytes is not None:
+                self._evict(name)
+
+    def _evict(self, keep: str):
+        ''' remove least recently used documents, other than keep, until the cache fits within max_bytes
+        '''
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM documents').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for name, size in self.connection.execute('SELECT name, size FROM documents WHERE name != ? ORDER BY last_used',
+                                                  (keep,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            logging.info('Evicting %s from the document cache', name)
+            self.connection.execute('DELETE FROM documents WHERE name = ?', (name,))
+            try:
+                os.remove(self.path_for(name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def file_sha256(path: str) -> str:
+    ''' Return the hex sha256 of the given file
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+''' Concurrent retrieval of c-cda documents from signed URLs.  A single requests Session with a connection pool sized
+    to the concurrency limit is shared by a pool of fetch threads, so connections are kept alive and reused across
+    URLs instead of paying a new TCP and TLS handshake for every document.  Results are yielded in URL order.
+    A download that fails with a connection error, a timeout, or a transient status such as a 503 SlowDown is retried
+    after a bounded exponential backoff with full jitter, so one transient error does not end a large pull and the
+    retries of many threads do not arrive at the origin together.  A signed url whose Expires time has passed fails
+    at once with UrlExpired instead of being retried.
+    Run as a script, or as ccda.py fetch, the documents at the urls in a file are downloaded into a cache folder without
+    importing any of the parsers.  requests itself is imported when the first session is created, so the download
+    options and helpers can be imported, e.g. for the usage of process_files.py, without it.
+'''
+
+import os
+import argparse
+import time
+import random
+import hashlib
+import logging
+from itertools import count
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from collections import namedtuple
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import ordered_map
+from metrics import MetricsSink
+from document_cache import DocumentCache
+
+if TYPE_CHECKING:
+    import requests
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 5
+DEFAULT_TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+CHUNK_SIZE = 64 * 1024
+
+# statuses worth another attempt: request timeout, too many requests, and the 5xx errors S3 returns when it is busy
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+# retries is the number of attempts after the first; the n-th retry waits a random time up to backoff * 2 ** n
+# seconds, never more than max_backoff
+RetryPolicy = namedtuple('RetryPolicy', ['retries', 'backoff', 'max_backoff'])
+DEFAULT_RETRY = RetryPolicy(DEFAULT_RETRIES, DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF)
+NO_RETRY = RetryPolicy(0, 0, 0)
+
+class DownloadFailed(RuntimeError):
+    ''' Raised when a url answers with a status other than 200
+    '''
+    def __init__(self, url: str, status: int, retry_after: float = None):
+        super().__init__(f'Download Failed {status} for {url}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class UrlExpired(RuntimeError):
+    ''' Raised instead of downloading, or retrying, a signed url whose Expires time has passed
+    '''
+    def __init__(self, url: str, expires: float):
+        super().__init__(f'Signed url expired at {datetime.fromtimestamp(expires, timezone.utc).isoformat()} '
+                         f'for {file_name_from(url)}')
+        self.expires = expires
+
+
+def read_urls_from(url_file: str) -> list[str]:
+    ''' Return the signed urls listed in the given file, one per line after a header line
+    '''
+    with open(url_file, encoding='utf-8') as fh:
+        header = next(fh) #discard header
+        if header.startswith('http'):
+            raise ValueError(f'header not found in {url_file}')
+        return [line.strip() for line in fh if line.strip()]
+
+
+def file_name_from(url: str) -> str:
+    ''' Return the document file name of the given signed url, the last segment of its path whatever query string
+        signature form it carries
+    '''
+    return os.path.basename(urlsplit(url).path)
+
+
+def url_expiry(url: str) -> float:
+    ''' Return the time, in seconds since the epoch, after which the given signed url is no longer valid, or None if
+        the url does not say.  Both the Expires parameter of query string authentication and the X-Amz-Date and
+        X-Amz-Expires parameters of signature version 4 are understood.
+    '''
+    query = parse_qs(urlsplit(url).query)
+    try:
+        if 'Expires' in query:
+            return float(query['Expires'][0])
+        if 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+            signed = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return signed.timestamp() + float(query['X-Amz-Expires'][0])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff_delay(retry: RetryPolicy, attempt: int, retry_after: float = None) -> float:
+    ''' Return the seconds to wait before retrying after the given failed attempt, counting from 0.  The delay is drawn
+        uniformly up to backoff * 2 ** attempt, capped at max_backoff, so threads that failed together retry apart.  A
+        longer Retry-After from the server is honoured up to max_backoff.
+    '''
+    delay = random.uniform(0, min(retry.max_backoff, retry.backoff * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, retry.max_backoff))
+    return delay
+
+
+def create_session(concurrency: int = DEFAULT_CONCURRENCY) -> 'requests.Session':
+    ''' Return a session whose connection pool can keep one connection alive per fetch thread
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_content(session: 'requests.Session', url: str, timeout=DEFAULT_TIMEOUT, metrics: MetricsSink = None,
+                  retry: RetryPolicy = DEFAULT_RETRY) -> bytes:
+    ''' Return the raw bytes of the given url, for the xml parser to decode from the document's own xml declaration
+        rather than from the response headers.  timeout is seconds or a (connect, read) pair.  Transient failures are
+        retried according to retry; raises once they are exhausted, if the content cannot be downloaded, or with
+        UrlExpired if the signed url has expired.  If a metrics sink is given the download time, size, and number of
+        retries are recorded against the document file name.
+    '''
+    logging.info('Downloading %s', file_name_from(url))
+    start = time.perf_counter()
+
+    def attempt():
+        response = session.get(url, timeout=timeout)
+        _raise_for_status(url, response)
+        return response
+    response, retries = _with_retries(url, attempt, retry)
+    if metrics is not None:
+        metrics.record_all(file_name_from(url), {'download_seconds': time.perf_counter() - start,
+                                                 'download_bytes': len(response.content), 'download_retries': retries})
+    return response.content
+
+
+def fetch_to_file(session: 'requests.Session', url: str, output_file: str, timeout=DEFAULT_TIMEOUT,
+                  metrics: MetricsSink = None, retry: RetryPolicy = DEFAULT_RETRY) -> str:
+    ''' Stream the content of the given url to output_file in chunks and return the hex sha256 of the content.
+        The body is written to a temporary file that replaces output_file only once complete, so an interrupted
+        download never leaves a truncated document behind, and a retried download starts the temporary file over.
+        The temporary file is removed if the download fails for good.
+        timeout and retry are as for fetch_content.  If a metrics sink is given the download time, size, and number of
+        retries are recorded against the document file name.
+    '''
+    logging.info('Downloading %s to %s', file_name_from(url), output_file)
+    partial_file = output_file + '.part'
+    start = time.perf_counter()
+
+    def attempt():
+        size = 0
+        with session.get(url, timeout=timeout, stream=True) as response:
+            _raise_for_status(url, response)
+            digest = hashlib.sha256()
+            with open(partial_file, 'wb') as out_fh:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    out_fh.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        return digest, size
+    try:
+        (digest, size), retries = _with_retries(url, attempt, retry)
+    except Exception:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+    os.replace(partial_file, output_file)
+    if metrics is not None:
+        metrics.record_all(file_name_from(url), {'download_seconds': time.perf_counter() - start, 'download_bytes': size,
+                                                 'download_retries': retries})
+    return digest.hexdigest()
+
+
+def _raise_for_status(url: str, response: 'requests.Response'):
+    ''' raise DownloadFailed, with any Retry-After seconds the server sent, unless the response is a 200
+    '''
+    if response.status_code != 200:
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        raise DownloadFailed(url, response.status_code, retry_after)
+
+
+def _with_retries(url: str, attempt, retry: RetryPolicy):
+    ''' return (attempt(), number of retries), calling attempt again after a backoff while it fails with a connection
+        error, a timeout, or a retryable status, at most retry.retries more times.  Raises UrlExpired rather than
+        making an attempt once the url has expired, or waiting for one past the expiry.
+    '''
+    expires = url_expiry(url)
+    retry_errors = _retry_errors()
+    for retries in count():
+        if expires is not None and time.time() >= expires:
+            raise UrlExpired(url, expires)
+        try:
+            return attempt(), retries
+        except (DownloadFailed, *retry_errors) as oops:
+            retryable = not isinstance(oops, DownloadFailed) or oops.status in RETRY_STATUSES
+            if not retryable or retries >= retry.retries:
+                logging.error('Download failed for %s after %d attempts: %s', file_name_from(url), retries + 1, oops)
+                raise
+            delay = backoff_delay(retry, retries, getattr(oops, 'retry_after', None))
+            if expires is not None and time.time() + delay >= expires:
+                raise UrlExpired(url, expires) from oops
+            logging.warning('Retrying %s in %.2fs after %s', file_name_from(url), delay, oops)
+            time.sleep(delay)
+
+
+def _retry_errors() -> tuple:
+    ''' the requests exceptions worth another attempt: connection errors, timeouts, and bodies cut off mid transfer
+    '''
+    import requests
+    return requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError
+
+
+def fetch_all(urls: list[str], fetch, concurrency: int = DEFAULT_CONCURRENCY):
+    ''' Apply fetch(url) to each url on a pool of concurrency threads and yield the results in url order.
+        At most twice concurrency results are held at once.  The first failure is raised when its result is reached.
+    '''
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        yield from ordered_map(executor, fetch, urls, 2 * concurrency)
+
+
+def download_all_files_in(url_file: str, output_folder: str, concurrency: int = DEFAULT_CONCURRENCY,
+                          max_cache_bytes: int = None, timeout=DEFAULT_TIMEOUT, retry: RetryPolicy = DEFAULT_RETRY) -> None:
+    ''' Get the contents of all files from the AWS URLs in the given file.  The contents of each URL will be written to
+        a file of the same name in the local folder or output_folder if given.  Files already cached there with a
+        matching content hash are not downloaded again.
+    '''
+    urls = read_urls_from(url_file)
+    with create_session(concurrency) as session, DocumentCache(output_folder, max_cache_bytes) as cache:
+        def fetch(url):
+            name = file_name_from(url)
+            if cache.get(name) is not None:
+                logging.info('Using cached %s', name)
+                return
+            cache.add(name, fetch_to_file(session, url, cache.path_for(name), timeout, retry=retry))
+        for _ in fetch_all(urls, fetch, concurrency):
+            pass
+
+
+def add_download_arguments(parser: argparse.ArgumentParser):
+    ''' Add the options controlling concurrency, the cache size, timeouts, and retries to the given command line parser
+    '''
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'number of concurrent downloads (default {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--cache-max-mb', type=float, help='evict least recently used cached documents beyond this size')
+    parser.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help=f'seconds to wait for a connection (default {DEFAULT_CONNECT_TIMEOUT})')
+    parser.add_argument('--read-timeout', type=float, default=DEFAULT_READ_TIMEOUT,
+                        help=f'seconds to wait between bytes of a response (default {DEFAULT_READ_TIMEOUT})')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f'retries of a failed download, 0 to fail at once (default {DEFAULT_RETRIES})')
+    parser.add_argument('--backoff', type=float, default=DEFAULT_BACKOFF,
+                        help=f'base seconds of the jittered exponential backoff between retries (default {DEFAULT_BACKOFF})')
+    parser.add_argument('--max-backoff', type=float, default=DEFAULT_MAX_BACKOFF,
+                        help=f'longest wait between retries (default {DEFAULT_MAX_BACKOFF})')
+
+
+def download_options(args: argparse.Namespace) -> tuple[int, tuple[float, float], RetryPolicy]:
+    ''' Return the largest cache size in bytes, or None, the (connect, read) timeout, and the retry policy given by
+        the options of add_download_arguments
+    '''
+    max_cache_bytes = None if args.cache_max_mb is None else int(args.cache_max_mb * 1024 * 1024)
+    retry = RetryPolicy(args.retries, args.backoff, args.max_backoff)
+    return max_cache_bytes, (args.connect_timeout, args.read_timeout), retry
+
+
+def main(argv: list[str] = None, prog: str = None):
+    ''' Download the documents at the signed urls in a file from the command line, as this script or ccda.py fetch
+    '''
+    parser = argparse.ArgumentParser(prog=prog, description='Download the c-cda documents at the given signed urls '
+                                                            'into a cache folder')
+    parser.add_argument('url_file')
+    parser.add_argument('output_folder', nargs='?', default='.')
+    add_download_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.url_file):
+        raise ValueError(f'{args.url_file} does not exist')
+    os.makedirs(args.output_folder, exist_ok=True)
+    download_all_files_in(args.url_file, args.output_folder, args.concurrency, *download_options(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+''' Durable record of the documents a bulk run has already written, so an interrupted or failed run can be restarted
+    without re-parsing or re-appending the documents that were completed.  Documents are keyed by the member_id and
+    document_id in their file name.  A document only becomes complete once the output holding its rows has been
+    flushed to disk, at which point the size of every output file is recorded as a checkpoint.  On restart the output
+    files are truncated back to the last checkpoint, dropping any rows written after it, before appending resumes.
+'''
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+from parse_raw_ccda import extract_info_from_filename
+
+MANIFEST_FILE = 'manifest.sqlite'
+
+STATUS_COMPLETE = 'complete'
+STATUS_FAILED = 'failed'
+
+class Manifest:
+    ''' SQLite backed document manifest.  Call restore() with the output files before opening them, add() before each
+        document is handed to the output, and checkpoint() from the output's flush.
+    '''
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self.folder = os.path.dirname(os.path.abspath(manifest_file))
+        self.pending = []
+        self.connection = sqlite3.connect(manifest_file)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS documents (member_id TEXT, document_id TEXT, source TEXT, '
+                                    'status TEXT, error TEXT, updated REAL, PRIMARY KEY (member_id, document_id))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS checkpoints (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                    'offsets TEXT, created REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        ''' Close the manifest.  Documents added since the last checkpoint are not recorded as complete.
+        '''
+        self.connection.close()
+
+    def is_complete(self, source_name: str) -> bool:
+        ''' Return True if the document with the given file name was completed by an earlier checkpoint
+        '''
+        member_id, document_id = _key_of(source_name)
+        row = self.connection.execute('SELECT status FROM documents WHERE member_id = ? AND document_id = ?',
+                                      (member_id, document_id)).fetchone()
+        return row is not None and row[0] == STATUS_COMPLETE
+
+    def add(self, source_name: str):
+        ''' Note that the rows of the given document are handed to the output.  It is recorded as complete at the
+            next checkpoint.
+        '''
+        self.pending.append(source_name)
+
+    @contextmanager
+    def track(self, source_name: str):
+        ''' Context that adds the given document for its block, which hands its rows to the output, and records it as
+            failed if the block raises.  The document is added first because the write that completes a batch
+            checkpoints it along with the batch; a document checkpointed before the block raised stays complete.
+        '''
+        self.add(source_name)
+        try:
+            yield
+        except Exception as oops:
+            if source_name in self.pending:
+                self.pending.remove(source_name)
+                self.fail(source_name, repr(oops))
+            raise
+
+    def fail(self, source_name: str, error: str):
+        ''' Record that the given document failed so that it is retried by the next run
+        '''
+        member_id, document_id = _key_of(source_name)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)',
+                                    (member_id, document_id, source_name, STATUS_FAILED, error, time.time()))
+
+    def checkpoint(self, offsets: dict[str, int]):
+        ''' Record the given output file sizes and mark every document added since the last checkpoint complete,
+            in one transaction.  offsets must describe output that is already on disk.
+        '''
+        now = time.time()
+        rows = [(*_key_of(name), name, STATUS_COMPLETE, None, now) for name in self.pending]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.connection.execute('INSERT INTO checkpoints (offsets, created) VALUES (?, ?)',
+                                    (json.dumps({self._key(name): size for name, size in offsets.items()}), now))
+        self.pending = []
+
+    def restore(self, output_files: list[str]):
+        ''' Truncate the given output files to the sizes recorded by the last checkpoint, discarding rows of documents
+            that were never completed.  If there is no checkpoint yet, the current sizes become the first one.
+        '''
+        row = self.connection.execute('SELECT offsets FROM checkpoints ORDER BY id DESC LIMIT 1').fetchone()
+        if row is None:
+            self.checkpoint({name: os.path.getsize(name) for name in output_files if os.path.exists(name)})
+            return
+        offsets = json.loads(row[0])
+        for name in output_files:
+            if not os.path.exists(name):
+                continue
+            offset = offsets.get(self._key(name))
+            if offset is None:
+                logging.warning('Removing %s, it was created after the last completed checkpoint', name)
+                os.remove(name)
+            elif os.path.getsize(name) > offset:
+                logging.warning('Truncating %s to %d bytes from the last completed checkpoint', name, offset)
+                with open(name, 'r+b') as fh:
+                    fh.truncate(offset)
+
+    def summary(self) -> dict[str, int]:
+        ''' Return the number of documents in each status
+        '''
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM documents GROUP BY status').fetchall())
+
+    def _key(self, name: str) -> str:
+        ''' output files are recorded relative to the manifest folder so the run folder can be moved
+        '''
+        return os.path.relpath(os.path.abspath(name), self.folder)
+
+
+def _key_of(source_name: str) -> tuple[str, str]:
+    ''' return the (member_id, document_id) key of the given document, falling back to the whole name for names that
+        do not follow the member_document_suffix.xml structure
+    '''
+    try:
+        return extract_info_from_filename(source_name)
+    except ValueError:
+        return source_name, ''
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+''' On-disk index of the current demographic record of each member, updated as documents are written so a run ends
+    with one row per MemberID instead of one per document.  The index is a SQLite database keyed by MemberID that holds
+    the row of the member's latest document by Effective date; a document with the same Effective date as the current
+    row replaces it, as SqliteOutput does with upsert_members.  With track_changes each document that replaces the
+    current row also records the fields that differ from it, so the history of a member is kept without its repeated
+    values.  Rows are buffered for batch_size documents and applied in one transaction, so memory stays bounded however
+    many members the run has.
+    Applying a document twice leaves the index unchanged, so documents replayed after an interrupted run are harmless.
+'''
+
+import os
+import csv
+import sqlite3
+
+from parsers.demographics import DEMOGRAPHIC_HEADER, MEMBER_ID_SLOT, SOURCE_DOCUMENT_SLOT
+from outputs import DEFAULT_BATCH_SIZE, BUFFER_SIZE, OutputSink
+
+MEMBER_INDEX_FILE = 'member_index.sqlite'
+CURRENT_MEMBERS_FILE = 'members_current.csv'
+MEMBER_CHANGES_FILE = 'member_changes.csv'
+
+CURRENT_TABLE = 'current_members'
+CHANGES_TABLE = 'member_changes'
+CHANGES_HEADER = ['MemberID', 'SourceDocument', 'Effective', 'Field', 'Value']
+EFFECTIVE_SLOT = DEMOGRAPHIC_HEADER.index('Effective')
+# fields that identify a document rather than describe the member, never recorded as changes
+KEY_SLOTS = {MEMBER_ID_SLOT, SOURCE_DOCUMENT_SLOT, EFFECTIVE_SLOT}
+
+class MemberIndex:
+    ''' SQLite backed index of the latest demographic row of each member.  Pass each demographic row to add(), or wrap
+        an output with IndexedOutput, and call close() so that the last batch is applied.
+    '''
+    def __init__(self, index_file: str, track_changes: bool = False, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.index_file = index_file
+        self.track_changes = track_changes
+        self.batch_size = batch_size
+        self.pending = []
+        self.connection = sqlite3.connect(index_file)
+        try:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            with self.connection:
+                columns = [row[1] for row in self.connection.execute(f'PRAGMA table_info({CURRENT_TABLE})')]
+                if columns and columns != DEMOGRAPHIC_HEADER:
+                    raise ValueError(f'{CURRENT_TABLE} in {index_file} does not match expected schema')
+                definitions = ', '.join(f'"{column}" TEXT' for column in DEMOGRAPHIC_HEADER)
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS {CURRENT_TABLE} ({definitions}, '
+                                        f'PRIMARY KEY (MemberID))')
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (MemberID TEXT, SourceDocument TEXT, '
+                                        f'Effective TEXT, Field TEXT, Value TEXT, '
+                                        f'PRIMARY KEY (MemberID, SourceDocument, Field))')
+        except:
+            self.connection.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, demographic_info: list):
+        ''' Buffer the demographic row of one document, applying the batch once batch_size rows are pending
+        '''
+        self.pending.append(demographic_info)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        ''' Apply the buffered rows in one transaction.  Each row replaces the current row of its member unless that
+            row has a later Effective date.
+        '''
+        if not self.pending:
+            return
+        current = {}
+        for member_id in {row[MEMBER_ID_SLOT] for row in self.pending}:
+            row = self.connection.execute(f'SELECT * FROM {CURRENT_TABLE} WHERE MemberID = ?', (member_id,)).fetchone()
+            if row is not None:
+                current[member_id] = row
+        updated, changes = {}, []
+        for row in self.pending:
+            row = [_text(value) for value in row]
+            member_id = row[MEMBER_ID_SLOT]
+            previous = current.get(member_id)
+            if previous is not None and not _supersedes(row, previous):
+                continue
+            if self.track_changes:
+                changes.extend((member_id, row[SOURCE_DOCUMENT_SLOT], row[EFFECTIVE_SLOT], DEMOGRAPHIC_HEADER[slot], value)
+                               for slot, value in enumerate(row) if slot not in KEY_SLOTS
+                               and value != (None if previous is None else previous[slot]))
+            current[member_id] = updated[member_id] = row
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO {CURRENT_TABLE} VALUES '
+                                        f'({", ".join("?" * len(DEMOGRAPHIC_HEADER))})', updated.values())
+            self.connection.executemany(f'INSERT OR REPLACE INTO {CHANGES_TABLE} VALUES (?, ?, ?, ?, ?)', changes)
+        self.pending = []
+
+    def checkpointed(self, on_flush):
+        ''' Return an on_flush callback for an output that applies the buffered rows before calling on_flush, so every
+            document a Manifest checkpoints is already in the index
+        '''
+        def flushed(offsets: dict[str, int]):
+            self.flush()
+            on_flush(offsets)
+        return flushed
+
+    def current(self, member_id: str) -> list:
+        ''' Return the current demographic row of the given member, or None if the member has not been seen
+        '''
+        self.flush()
+        row = self.connection.execute(f'SELECT * FROM {CURRENT_TABLE} WHERE MemberID = ?', (member_id,)).fetchone()
+        return None if row is None else list(row)
+
+    def write_current(self, csv_file: str):
+        ''' Write the current row of every member, in MemberID order, to the given csv file, replacing it
+        '''
+        self.flush()
+        self._export(csv_file, DEMOGRAPHIC_HEADER, f'SELECT * FROM {CURRENT_TABLE} ORDER BY MemberID')
+
+    def write_changes(self, csv_file: str):
+        ''' Write the recorded field changes of every member, in MemberID and Effective order, to the given csv file
+        '''
+        self.flush()
+        self._export(csv_file, CHANGES_HEADER, f'SELECT * FROM {CHANGES_TABLE} ORDER BY MemberID, Effective, SourceDocument')
+
+    def close(self):
+        ''' Apply any buffered rows and close the index
+        '''
+        if self.connection is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def _export(self, csv_file: str, header: list[str], query: str):
+        ''' stream the rows of the given query to csv_file through a temporary file
+        '''
+        with open(csv_file + '.part', 'w', encoding='utf-8', newline='', buffering=BUFFER_SIZE) as out_fh:
+            writer = csv.writer(out_fh)
+            writer.writerow(header)
+            writer.writerows(self.connection.execute(query))
+        os.replace(csv_file + '.part', csv_file)
+
+
+class IndexedOutput(OutputSink):
+    ''' Pass each document to output and its demographic row to a MemberIndex.  Open output with the index's
+        checkpointed() callback so the index is applied before each checkpoint.
+    '''
+    def __init__(self, output: OutputSink, member_index: MemberIndex):
+        self.output = output
+        self.member_index = member_index
+        self.output_files = output.output_files
+
+    def write(self, demographic_info: list, medication_list: list, problem_list: list, domain_rows: dict = None):
+        self.member_index.add(demographic_info)
+        self.output.write(demographic_info, medication_list, problem_list, domain_rows)
+
+    def flush(self):
+        self.member_index.flush()
+        self.output.flush()
+
+    def offsets(self) -> dict[str, int]:
+        return self.output.offsets()
+
+    def close(self):
+        try:
+            self.output.close()
+        finally:
+            self.member_index.flush()
+
+
+def _supersedes(row: list, previous) -> bool:
+    ''' True if row, not older than the previous row of its member, becomes the current row
+    '''
+    effective, previous_effective = row[EFFECTIVE_SLOT], previous[EFFECTIVE_SLOT]
+    return previous_effective is None or (effective is not None and effective >= previous_effective)
+
+
+def _text(value) -> str:
+    ''' the value as stored in the index
+    '''
+    return None if value is None else str(value)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+''' Opt-in per-document instrumentation.  Parsing, downloading, and writing functions accept an optional metrics sink
+    and, when one is given, record named values for each document: *_seconds timings for the download, xml parse,
+    each extractor and the csv write, plus download_bytes, document_bytes and row counts.  When no sink is given the
+    only cost is a None check per document.
+    RecordingMetrics aggregates the values of a whole run into percentiles and keeps the slowest documents so the
+    p99 outliers can be found; DocumentMetrics collects one document's values inside a worker process so they can be
+    sent back to the parent with the parsed rows.
+'''
+
+import json
+import heapq
+import logging
+import threading
+from array import array
+
+SLOWEST_DOCUMENTS = 20
+
+class MetricsSink:
+    ''' Interface for metrics sinks.  The base implementation discards everything.
+    '''
+    def record(self, document: str, name: str, value: float):
+        ''' Record a value for the given document, adding to any value already recorded under the same name
+        '''
+
+    def record_all(self, document: str, values: dict[str, float]):
+        ''' Record several values for the given document
+        '''
+        for name, value in values.items():
+            self.record(document, name, value)
+
+    def end(self, document: str, failed: bool = False):
+        ''' Mark the given document as finished, or as failed after whatever values it recorded
+        '''
+
+    def summary(self) -> dict:
+        ''' Return the aggregate summary of the recorded values
+        '''
+        return {}
+
+
+class DocumentMetrics(MetricsSink):
+    ''' Collect the values recorded for a single document
+    '''
+    def __init__(self):
+        self.values = {}
+
+    def record(self, document: str, name: str, value: float):
+        self.values[name] = self.values.get(name, 0) + value
+
+
+class RecordingMetrics(MetricsSink):
+    ''' Aggregate the values of every finished document.  Values are kept in compact arrays per name, so memory grows
+        by a few bytes per value rather than per document dictionary.  Safe to share between threads.
+    '''
+    def __init__(self, slowest: int = SLOWEST_DOCUMENTS):
+        self.lock = threading.Lock()
+        self.current = {}
+        self.values = {}
+        self.documents = 0
+        self.failed = 0
+        self.slowest_count = slowest
+        self.slowest = []
+
+    def record(self, document: str, name: str, value: float):
+        with self.lock:
+            values = self.current.setdefault(document, {})
+            values[name] = values.get(name, 0) + value
+
+    def end(self, document: str, failed: bool = False):
+        with self.lock:
+            if failed and document not in self.current:
+                # nothing recorded, or the document was already ended before failing
+                return
+            values = self.current.pop(document, {})
+            self.documents += 1
+            self.failed += failed
+            for name, value in values.items():
+                self.values.setdefault(name, array('d')).append(value)
+            total = sum(value for name, value in values.items() if name.endswith('_seconds'))
+            entry = (total, document, failed, values)
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, entry)
+            elif total > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def summary(self) -> dict:
+        ''' Return count, total, mean, p50, p95, p99 and max for each recorded name along with the slowest documents.
+            Documents that failed count with the values they recorded before failing.
+        '''
+        with self.lock:
+            summary = {'documents': self.documents, 'failed': self.failed, 'metrics': {}, 'slowest': []}
+            for name, values in sorted(self.values.items()):
+                ordered = sorted(values)
+                summary['metrics'][name] = {
+                    'count': len(ordered),
+                    'total': sum(ordered),
+                    'mean': sum(ordered) / len(ordered),
+                    'p50': _percentile(ordered, 50),
+                    'p95': _percentile(ordered, 95),
+                    'p99': _percentile(ordered, 99),
+                    'max': ordered[-1],
+                }
+            for total, document, failed, values in sorted(self.slowest, key=lambda entry: entry[:2], reverse=True):
+                summary['slowest'].append({'document': document, 'total_seconds': total, 'failed': failed,
+                                           'values': values})
+        return summary
+
+    def write_summary(self, summary_file: str):
+        ''' Write the summary as json to the given file and log the per stage totals
+        '''
+        summary = self.summary()
+        with open(summary_file, 'w', encoding='utf-8') as out_fh:
+            json.dump(summary, out_fh, indent=2)
+        logging.info('Metrics for %d documents written to %s', summary['documents'], summary_file)
+        for name, stats in summary['metrics'].items():
+            logging.info('%s total %.3f p50 %.4f p99 %.4f max %.4f', name, stats['total'], stats['p50'], stats['p99'],
+                         stats['max'])
+
+
+def measured(fn, *args):
+    ''' Call fn(*args, metrics=sink) with a fresh DocumentMetrics sink and return the result with the recorded values.
+        Used to run an instrumented function in a worker process, where the parent's sink is not reachable.
+    '''
+    sink = DocumentMetrics()
+    return fn(*args, metrics=sink), sink.values
+
+
+def _percentile(ordered: list[float], percent: int) -> float:
+    ''' nearest rank percentile of the given sorted values
+    '''
+    rank = max(0, -(-len(ordered) * percent // 100) - 1)
+    return ordered[rank]
@@ -0,0 +1,548 @@
+#!/usr/bin/env python
+''' Output sinks for parsed c-cda rows.  Every sink takes the demographic row, medication rows, and problem rows of one
+    document at a time and writes them in batches of batch_size documents.  An optional on_flush callback receives the
+    size of each output file once a batch is on disk, which is what a Manifest checkpoints.
+    CsvOutput keeps the demographic, medication, and problem csv files open for the length of a run and validates each
+    header once when the file is opened.  SqliteOutput loads the rows into members, medications, and problems tables
+    of one database, indexed on MemberID and SourceDocument, with one executemany per table and batch.  Each batch
+    first deletes any rows already stored for its documents, so a document replayed after an interrupted run replaces
+    its rows rather than duplicating them.  With upsert_members the members table keeps one row per MemberID, the one
+    with the latest Effective date.
+    ShardedOutput partitions each domain into numbered csv shard files, either by a stable hash of MemberID, which puts
+    all of a member's rows in the same shard of every domain, or into consecutive shards of about rows_per_shard rows.
+    Shards can be gzip compressed; each flush appends one complete gzip member per shard, so a checkpointed size is
+    always a valid end of file.  shards.json lists every shard with its row count, size, and the schema of its domain.
+    Every sink can also be opened for additional domains from parsers/domains.py; their rows are written to a csv
+    file, table, or shards named after the domain, e.g. allergies.csv or the allergies table.
+'''
+
+import io
+import os
+import re
+import csv
+import gzip
+import json
+import zlib
+import sqlite3
+import argparse
+from collections import defaultdict
+
+from parsers.demographics import DEMOGRAPHIC_HEADER, MEMBER_ID_SLOT, SOURCE_DOCUMENT_SLOT
+from parsers.medications import MEDICATION_HEADER
+from parsers.problems import PROBLEM_HEADER
+from parsers.domains import ADDITIONAL_DOMAINS, domains_named
+
+DEFAULT_BATCH_SIZE = 100
+BUFFER_SIZE = 1024 * 1024
+
+CSV_FORMAT = 'csv'
+SQLITE_FORMAT = 'sqlite'
+OUTPUT_FORMATS = [CSV_FORMAT, SQLITE_FORMAT]
+
+DEMOGRAPHIC_FILE = 'demographic_raw.csv'
+MEDICATION_FILE = 'medication.csv'
+PROBLEM_FILE = 'problem.csv'
+DATABASE_FILE = 'ccda.sqlite'
+SHARD_MANIFEST_FILE = 'shards.json'
+SHARD_SUFFIX = '.csv'
+GZIP_SUFFIX = '.gz'
+GZIP_LEVEL = 6
+
+MEMBER_TABLE = 'members'
+MEDICATION_TABLE = 'medications'
+PROBLEM_TABLE = 'problems'
+INDEXED_COLUMNS = ['MemberID', 'SourceDocument']
+SHARDED_DOMAINS = [(DEMOGRAPHIC_FILE, DEMOGRAPHIC_HEADER), (MEDICATION_FILE, MEDICATION_HEADER),
+                   (PROBLEM_FILE, PROBLEM_HEADER)]
+
+class OutputSink:
+    ''' Interface for output sinks.  Use as a context manager or call close() so that the last batch is flushed.
+        output_files lists the files a Manifest truncates back to its last checkpoint before a rerun.
+    '''
+    output_files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, demographic_info: list, medication_list: list, problem_list: list, domain_rows: dict = None):
+        ''' Buffer the rows of one document, flushing once batch_size documents are pending.  domain_rows holds the
+            rows of the additional domains the sink was opened for, keyed by domain.
+        '''
+        raise NotImplementedError
+
+    def flush(self):
+        ''' Write all buffered rows through to the output, calling on_flush once they are on disk
+        '''
+        raise NotImplementedError
+
+    def offsets(self) -> dict[str, int]:
+        ''' Return the size on disk of each file in output_files
+        '''
+        return {}
+
+    def close(self):
+        ''' Flush and close the output
+        '''
+
+
+class CsvOutput(OutputSink):
+    ''' Append parsed rows to the members, medications, and problems csv files, and the rows of additional domains to
+        the csv file given for each in domain_files.
+    '''
+    def __init__(self, members_file: str, medications_file: str, problems_file: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 on_flush=None, domain_files: dict[str, str] = None):
+        domain_files = domain_files or {}
+        self.output_files = [members_file, medications_file, problems_file, *domain_files.values()]
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.pending = 0
+        self.handles = []
+        try:
+            self.members = self._open(members_file, DEMOGRAPHIC_HEADER)
+            self.medications = self._open(medications_file, MEDICATION_HEADER)
+            self.problems = self._open(problems_file, PROBLEM_HEADER)
+            self.domains = {domain.name: self._open(domain_files[domain.name], domain.header)
+                            for domain in domains_named(list(domain_files))}
+        except:
+            self.close()
+            raise
+
+    def write(self, demographic_info: list, medication_list: list, problem_list: list, domain_rows: dict = None):
+        self.members.writerow(demographic_info)
+        self.medications.writerows(medication_list)
+        self.problems.writerows(problem_list)
+        if domain_rows:
+            for name, rows in domain_rows.items():
+                self.domains[name].writerows(rows)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        ''' Write all buffered rows through to the files.  With an on_flush callback the files are also synced to disk
+            and their sizes passed to the callback.
+        '''
+        for out_fh in self.handles:
+            out_fh.flush()
+            if self.on_flush is not None:
+                os.fsync(out_fh.fileno())
+        if self.on_flush is not None:
+            self.on_flush(self.offsets())
+        self.pending = 0
+
+    def offsets(self) -> dict[str, int]:
+        return {out_fh.name: os.fstat(out_fh.fileno()).st_size for out_fh in self.handles}
+
+    def close(self):
+        if self.handles and self.pending:
+            self.flush()
+        for out_fh in self.handles:
+            out_fh.close()
+        self.handles = []
+        self.pending = 0
+
+    def _open(self, filename: str, expected_header: list[str]):
+        ''' open the given file for append and return a csv writer for it, checking or writing the header first
+        '''
+        initialize_output_file(filename, expected_header)
+        out_fh = open(filename, 'a', encoding='utf-8', buffering=BUFFER_SIZE)
+        self.handles.append(out_fh)
+        return csv.writer(out_fh)
+
+
+class SqliteOutput(OutputSink):
+    ''' Load parsed rows into the members, medications, and problems tables of the given database file, and the rows
+        of each of the additional domains into a table named after the domain.  Tables and indexes are created on first
+        use; an existing table must have the columns of the matching header.
+    '''
+    def __init__(self, database_file: str, batch_size: int = DEFAULT_BATCH_SIZE, on_flush=None, upsert_members: bool = False,
+                 domains: list[str] = None):
+        self.database_file = database_file
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.upsert_members = upsert_members
+        self.members = []
+        self.medications = []
+        self.problems = []
+        self.documents = []
+        self.domains = {domain.name: domain.header for domain in domains_named(domains or [])}
+        self.domain_rows = {name: [] for name in self.domains}
+        self.connection = sqlite3.connect(database_file)
+        try:
+            # with on_flush every committed batch is synced before the callback, as CsvOutput does with fsync
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(f'PRAGMA synchronous={"FULL" if on_flush is not None else "NORMAL"}')
+            with self.connection:
+                self._create(MEMBER_TABLE, DEMOGRAPHIC_HEADER)
+                self._create(MEDICATION_TABLE, MEDICATION_HEADER)
+                self._create(PROBLEM_TABLE, PROBLEM_HEADER)
+                for table, header in self.domains.items():
+                    self._create(table, header)
+                if upsert_members:
+                    self.connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {MEMBER_TABLE}_member_unique '
+                                            f'ON {MEMBER_TABLE} (MemberID)')
+        except:
+            self.connection.close()
+            raise
+        self.insert_member = _insert_statement(MEMBER_TABLE, DEMOGRAPHIC_HEADER)
+        if upsert_members:
+            updates = ', '.join(f'"{column}" = excluded."{column}"' for column in DEMOGRAPHIC_HEADER)
+            self.insert_member += (f' ON CONFLICT (MemberID) DO UPDATE SET {updates} WHERE {MEMBER_TABLE}.Effective IS NULL '
+                                   f'OR excluded.Effective >= {MEMBER_TABLE}.Effective')
+        self.insert_medication = _insert_statement(MEDICATION_TABLE, MEDICATION_HEADER)
+        self.insert_problem = _insert_statement(PROBLEM_TABLE, PROBLEM_HEADER)
+
+    def write(self, demographic_info: list, medication_list: list, problem_list: list, domain_rows: dict = None):
+        self.members.append(demographic_info)
+        self.medications.extend(medication_list)
+        self.problems.extend(problem_list)
+        if domain_rows:
+            for name, rows in domain_rows.items():
+                self.domain_rows[name].extend(rows)
+        self.documents.append((demographic_info[MEMBER_ID_SLOT], demographic_info[SOURCE_DOCUMENT_SLOT]))
+        if len(self.documents) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        ''' Insert the buffered rows in one transaction, replacing the rows of any document already stored
+        '''
+        replaced = [MEDICATION_TABLE, PROBLEM_TABLE] if self.upsert_members else [MEMBER_TABLE, MEDICATION_TABLE, PROBLEM_TABLE]
+        replaced.extend(self.domains)
+        with self.connection:
+            for table in replaced:
+                self.connection.executemany(f'DELETE FROM {table} WHERE MemberID = ? AND SourceDocument = ?', self.documents)
+            self.connection.executemany(self.insert_member, self.members)
+            self.connection.executemany(self.insert_medication, self.medications)
+            self.connection.executemany(self.insert_problem, self.problems)
+            for table, rows in self.domain_rows.items():
+                self.connection.executemany(_insert_statement(table, self.domains[table]), rows)
+        self.members, self.medications, self.problems, self.documents = [], [], [], []
+        self.domain_rows = {name: [] for name in self.domains}
+        if self.on_flush is not None:
+            self.on_flush(self.offsets())
+
+    def close(self):
+        if self.connection is None:
+            return
+        if self.documents:
+            self.flush()
+        self.connection.close()
+        self.connection = None
+
+    def _create(self, table: str, header: list[str]):
+        ''' create the given table and its indexes if it does not already exist or verify that it has the expected schema
+        '''
+        columns = [row[1] for row in self.connection.execute(f'PRAGMA table_info({table})')]
+        if columns and columns != header:
+            raise ValueError(f'{table} in {self.database_file} does not match expected schema')
+        if not columns:
+            definitions = ', '.join(f'"{column}" TEXT' for column in header)
+            self.connection.execute(f'CREATE TABLE {table} ({definitions})')
+        for column in INDEXED_COLUMNS:
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})')
+
+
+class ShardedOutput(OutputSink):
+    ''' Write parsed rows to shard files in output_folder, named after the domain csv file with the shard number, e.g.
+        medication-00003.csv or medication-00003.csv.gz when compressed.  Give either shards, to place each member in
+        shard crc32(MemberID) % shards, or rows_per_shard, to start the next shard once a shard holds that many rows.
+        A document's rows are never split across shards.  Existing shards are appended to; their sharding and schema
+        must match.  The additional domains named in domains are sharded the same way.
+    '''
+    def __init__(self, output_folder: str, shards: int = None, rows_per_shard: int = None, compress: bool = False,
+                 batch_size: int = DEFAULT_BATCH_SIZE, on_flush=None, domains: list[str] = None):
+        if (shards is None) == (rows_per_shard is None):
+            raise ValueError('give either shards or rows_per_shard')
+        if (shards or rows_per_shard) < 1:
+            raise ValueError('shards and rows_per_shard must be positive')
+        self.output_folder = output_folder
+        self.shards = shards
+        self.rows_per_shard = rows_per_shard
+        self.compress = compress
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.pending = 0
+        self.manifest_file = os.path.join(output_folder, SHARD_MANIFEST_FILE)
+        recorded = self._read_manifest()
+        sharded = SHARDED_DOMAINS + [(domain.name + SHARD_SUFFIX, domain.header) for domain in domains_named(domains or [])]
+        self.domains = [_DomainShards(output_folder, name, header, compress, recorded.get(_domain_of(name), {}))
+                        for name, header in sharded]
+        self.additional = {domain.domain: domain for domain in self.domains[len(SHARDED_DOMAINS):]}
+
+    @property
+    def output_files(self) -> list[str]:
+        return [path for domain in self.domains for path in domain.paths()]
+
+    def write(self, demographic_info: list, medication_list: list, problem_list: list, domain_rows: dict = None):
+        shard = None if self.shards is None else zlib.crc32(demographic_info[MEMBER_ID_SLOT].encode('utf-8')) % self.shards
+        written = list(zip(self.domains, ([demographic_info], medication_list, problem_list)))
+        if domain_rows:
+            written.extend((self.additional[name], rows) for name, rows in domain_rows.items())
+        for domain, rows in written:
+            if rows:
+                domain.add(rows, shard if shard is not None else domain.next_shard(self.rows_per_shard))
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        ''' Append the buffered rows of each shard to its file, then record the shards in shards.json.  With an
+            on_flush callback the shard files are synced to disk and their sizes passed to the callback.
+        '''
+        for domain in self.domains:
+            domain.flush(self.compress, self.on_flush is not None)
+        self._write_manifest()
+        if self.on_flush is not None:
+            self.on_flush(self.offsets())
+        self.pending = 0
+
+    def offsets(self) -> dict[str, int]:
+        return {path: size for domain in self.domains for path, size in domain.sizes().items()}
+
+    def close(self):
+        if self.pending:
+            self.flush()
+        self.pending = 0
+
+    def _read_manifest(self) -> dict:
+        ''' return the shards recorded by an earlier run by domain, checking that its sharding matches this one
+        '''
+        if not os.path.exists(self.manifest_file):
+            return {}
+        with open(self.manifest_file, encoding='utf-8') as fh:
+            manifest = json.load(fh)
+        if (manifest['shards'], manifest['rows_per_shard'], manifest['compression']) != self._sharding():
+            raise ValueError(f'{self.output_folder} is sharded {manifest["shards"]} shards, {manifest["rows_per_shard"]} '
+                             f'rows per shard, {manifest["compression"]} compression; cannot append differently')
+        return {name: {entry['file']: entry for entry in domain['files']} for name, domain in manifest['domains'].items()}
+
+    def _write_manifest(self):
+        ''' replace shards.json with the current shards of every domain
+        '''
+        shards, rows_per_shard, compression = self._sharding()
+        manifest = {
+            'shards': shards, 'rows_per_shard': rows_per_shard, 'compression': compression,
+            'partitioning': 'crc32(MemberID) % shards' if shards is not None else 'rows_per_shard rows in file order',
+            'domains': {domain.domain: {'schema': domain.header, 'rows': sum(domain.rows.values()),
+                                        'files': domain.entries()} for domain in self.domains},
+        }
+        with open(self.manifest_file + '.part', 'w', encoding='utf-8') as out_fh:
+            json.dump(manifest, out_fh, indent=2)
+        os.replace(self.manifest_file + '.part', self.manifest_file)
+
+    def _sharding(self) -> tuple:
+        ''' the sharding recorded in shards.json
+        '''
+        return self.shards, self.rows_per_shard, 'gzip' if self.compress else None
+
+
+class _DomainShards:
+    ''' the shard files of one domain and the rows buffered for each
+    '''
+    def __init__(self, output_folder: str, file_name: str, header: list[str], compress: bool, recorded: dict):
+        self.output_folder = output_folder
+        self.domain = _domain_of(file_name)
+        self.header = list(header)
+        self.suffix = SHARD_SUFFIX + (GZIP_SUFFIX if compress else '')
+        self.rows = {}
+        self.bytes = {}
+        self.pending = defaultdict(list)
+        pattern = re.compile(re.escape(self.domain) + r'-(\d+)' + re.escape(self.suffix))
+        for name in os.listdir(output_folder):
+            match = pattern.fullmatch(name)
+            if match is None:
+                continue
+            shard, path = int(match.group(1)), os.path.join(output_folder, name)
+            size = os.path.getsize(path)
+            entry = recorded.get(name)
+            # a shard whose size no longer matches shards.json was truncated back to a checkpoint and is recounted
+            self.rows[shard] = entry['rows'] if entry is not None and entry['bytes'] == size else _count_rows(path, header)
+            self.bytes[shard] = size
+
+    def path(self, shard: int) -> str:
+        ''' the file of the given shard
+        '''
+        return os.path.join(self.output_folder, f'{self.domain}-{shard:05d}{self.suffix}')
+
+    def paths(self) -> list[str]:
+        ''' the files of every shard written so far
+        '''
+        return [self.path(shard) for shard in sorted(self.bytes)]
+
+    def sizes(self) -> dict[str, int]:
+        ''' the size on disk of each shard file
+        '''
+        return {self.path(shard): size for shard, size in sorted(self.bytes.items())}
+
+    def entries(self) -> list[dict]:
+        ''' the shards.json entry of each shard file
+        '''
+        return [{'file': os.path.basename(self.path(shard)), 'rows': self.rows[shard], 'bytes': size}
+                for shard, size in sorted(self.bytes.items())]
+
+    def next_shard(self, rows_per_shard: int) -> int:
+        ''' the shard the next document's rows go to when filling shards of rows_per_shard rows in order
+        '''
+        shard = max(self.rows, default=0)
+        return shard + 1 if self.rows.get(shard, 0) >= rows_per_shard else shard
+
+    def add(self, rows: list, shard: int):
+        ''' buffer the rows of one document for the given shard
+        '''
+        self.pending[shard].extend(rows)
+        self.rows[shard] = self.rows.get(shard, 0) + len(rows)
+
+    def flush(self, compress: bool, sync: bool):
+        ''' append the buffered rows of each shard to its file, writing the header first to a new file
+        '''
+        for shard, rows in self.pending.items():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if shard not in self.bytes:
+                writer.writerow(self.header)
+            writer.writerows(rows)
+            data = buffer.getvalue().encode('utf-8')
+            with open(self.path(shard), 'ab') as out_fh:
+                out_fh.write(gzip.compress(data, GZIP_LEVEL) if compress else data)
+                out_fh.flush()
+                if sync:
+                    os.fsync(out_fh.fileno())
+                self.bytes[shard] = out_fh.tell()
+        self.pending.clear()
+
+
+def shard_files_in(output_folder: str, domains: list[str] = ()) -> list[str]:
+    ''' Return the shard files in output_folder of the demographic, medication, and problem domains and the given
+        additional domains, compressed or not
+    '''
+    names = [_domain_of(name) for name, _ in SHARDED_DOMAINS] + list(domains)
+    pattern = re.compile('(' + '|'.join(re.escape(name) for name in names) + r')-\d+'
+                         + re.escape(SHARD_SUFFIX) + '(' + re.escape(GZIP_SUFFIX) + ')?')
+    return sorted(os.path.join(output_folder, name) for name in os.listdir(output_folder) if pattern.fullmatch(name))
+
+
+def _domain_of(file_name: str) -> str:
+    ''' the domain name of a domain csv file name, which prefixes the names of its shards
+    '''
+    return file_name[:-len(SHARD_SUFFIX)]
+
+
+def _count_rows(path: str, header: list[str]) -> int:
+    ''' count the rows of a shard file after checking its header
+    '''
+    opener = gzip.open if path.endswith(GZIP_SUFFIX) else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as fh:
+        reader = csv.reader(fh)
+        if next(reader, header) != header:
+            raise ValueError(f'{path} does not match expected schema')
+        return sum(1 for _ in reader)
+
+
+def initialize_output_file(filename: str, expected_header: list[str]):
+    ''' create the given file and initialize with a header row if it does not already exist
+        of verify that the file has the expected schema if it does exit.
+    '''
+    if os.path.exists(filename):
+        with open(filename, encoding='utf-8') as fh:
+            header = next(csv.reader(fh))
+            if header != expected_header:
+                raise ValueError(f'{filename} does not match expected schema')
+    else:
+        with open(filename, 'w', encoding='utf-8') as out_fh:
+            csv.writer(out_fh).writerow(expected_header)
+
+
+def open_output(output_format: str, output_folder: str, on_flush=None, upsert_members: bool = False, shards: int = None,
+                rows_per_shard: int = None, compress: bool = False, domains: list[str] = None) -> OutputSink:
+    ''' Open the sink of the given format over the standard output files in output_folder, sharded csv files if shards
+        or rows_per_shard is given, including the files or tables of the given additional domains
+    '''
+    if shards is not None or rows_per_shard is not None or compress:
+        if output_format != CSV_FORMAT or upsert_members:
+            raise ValueError('sharded output requires the csv output format')
+        if shards is None and rows_per_shard is None:
+            raise ValueError('compression requires sharded output, give shards or rows_per_shard')
+        return ShardedOutput(output_folder, shards, rows_per_shard, compress, on_flush=on_flush, domains=domains)
+    if output_format == SQLITE_FORMAT:
+        return SqliteOutput(os.path.join(output_folder, DATABASE_FILE), on_flush=on_flush, upsert_members=upsert_members,
+                            domains=domains)
+    if upsert_members:
+        raise ValueError('upsert_members requires the sqlite output format')
+    return CsvOutput(*output_files_in(output_folder), on_flush=on_flush,
+                     domain_files=domain_files_in(output_folder, domains or []))
+
+
+def add_output_arguments(parser: argparse.ArgumentParser, title: str = 'output options'):
+    ''' Add the options of a bulk run's output, given to open_output, and of its metrics, quarantine, and member index,
+        to the given command line parser as a group with the given title
+    '''
+    group = parser.add_argument_group(title)
+    group.add_argument('--output-format', choices=OUTPUT_FORMATS, default=CSV_FORMAT,
+                       help='write domain csv files (default) or load the rows into ccda.sqlite')
+    group.add_argument('--upsert-members', action='store_true',
+                       help='with sqlite output keep only the latest demographic row of each member')
+    sharding = group.add_mutually_exclusive_group()
+    sharding.add_argument('--shards', type=int, help='split the csv output into this many shards by MemberID hash')
+    sharding.add_argument('--shard-rows', type=int, help='split the csv output into shards of this many rows')
+    group.add_argument('--gzip', action='store_true', help='gzip compress the shard files')
+    group.add_argument('--domains', type=lambda names: names.split(','),
+                       help=f'comma separated additional domains to extract, from {",".join(ADDITIONAL_DOMAINS)}')
+    group.add_argument('--metrics', help='collect per document timings and write a summary to this json file')
+    group.add_argument('--tolerant', action='store_true',
+                       help='quarantine documents that fail and continue instead of stopping the run')
+    group.add_argument('--member-index', choices=['latest', 'changes'],
+                       help='keep the latest demographic row of each member in member_index.sqlite and write '
+                            'members_current.csv, with changes also recording the fields each document changed')
+
+
+def check_output_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    ''' Exit with a usage error from parser if the options added by add_output_arguments cannot be combined, rather
+        than failing in open_output once the run has started
+    '''
+    sharded = args.shards is not None or args.shard_rows is not None
+    if sharded and args.output_format != CSV_FORMAT:
+        parser.error('--shards and --shard-rows require --output-format csv')
+    if args.gzip and not sharded:
+        parser.error('--gzip compresses shard files, give --shards or --shard-rows')
+    if args.upsert_members and args.output_format != SQLITE_FORMAT:
+        parser.error('--upsert-members requires --output-format sqlite')
+    if args.domains and not set(args.domains) <= set(ADDITIONAL_DOMAINS):
+        parser.error(f'--domains must be chosen from {",".join(ADDITIONAL_DOMAINS)}')
+
+
+def restored_files_in(output_folder: str, output_format: str, sharded: bool, domains: list[str] = (),
+                      csv_files: list[str] = None) -> list[str]:
+    ''' Return the files a Manifest truncates before a run resumes into output_folder: its shard files when sharded,
+        otherwise csv_files, by default the standard csv files of output_folder, with those of the additional domains.
+        None are returned for sqlite output, which replaces the rows of replayed documents itself.
+    '''
+    if output_format != CSV_FORMAT:
+        return []
+    if sharded:
+        return shard_files_in(output_folder, domains)
+    if csv_files is None:
+        return output_files_in(output_folder, domains)
+    return list(csv_files) + list(domain_files_in(output_folder, domains).values())
+
+
+def output_files_in(output_folder: str, domains: list[str] = ()) -> list[str]:
+    ''' Return the members, medications, and problems csv files of output_folder, followed by the csv files of the
+        given additional domains
+    '''
+    return ([os.path.join(output_folder, name) for name in (DEMOGRAPHIC_FILE, MEDICATION_FILE, PROBLEM_FILE)]
+            + list(domain_files_in(output_folder, domains).values()))
+
+
+def domain_files_in(output_folder: str, domains: list[str]) -> dict[str, str]:
+    ''' Return the csv file of each of the given additional domains in output_folder, keyed by domain
+    '''
+    return {name: os.path.join(output_folder, f'{name}.csv') for name in domains}
+
+
+def _insert_statement(table: str, header: list[str]) -> str:
+    ''' insert statement for one row of the given table
+    '''
+    return f'INSERT INTO {table} VALUES ({", ".join("?" * len(header))})'
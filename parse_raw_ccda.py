@@ -6,20 +6,45 @@
     Parsing discards other common sections (e.g. Care Plan, Chief Complaint, Encounters, Functional Status, Immunizations,
     Declined Immunizations, Patient Instructions, Procedures, Results (Labs), Smoking Status, Vitals)
     Assumes one member per file.  Member file will not filter for duplications.
+    Given - as the source, the names of the source files are read from stdin, one per line, and all are parsed by this
+    one process, so a caller with many documents does not pay the interpreter start up and imports for each.
 '''
 
+import io
 import os
 import sys
-import csv
+import mmap
+import time
 import logging
-
-import xmltodict
+from typing import BinaryIO, Union
+from contextlib import contextmanager
+from collections import namedtuple
 
 from parsers import demographics
 from parsers import medications
 from parsers import problems
+from parsers.ccda_segment_codes import SEGMENT_MAP
+from parsers.streaming import parse_ccda_sections
+from parsers.sections import build_section_index
+from parsers.domains import domains_named, section_roots_of
+from outputs import CsvOutput, OutputSink
+from metrics import MetricsSink
+
+# only these parts of each document are materialized, everything else is skipped while streaming
+HEADER_ELEMENTS = demographics.DEMOGRAPHIC_ELEMENTS
+SECTION_ROOTS = SEGMENT_MAP['medications'] + SEGMENT_MAP['problems']
+# the source given on the command line to read source file names from stdin
+STDIN_SOURCE = '-'
+
+# a document as the parse functions take it: text, undecoded bytes or a read only mmap of them, or a binary file object
+DocumentSource = Union[str, bytes, mmap.mmap, BinaryIO]
 
-def parse_raw_ccda_file(source_file: str, members_file: str, medications_file: str, problems_file: str):
+# the rows extracted from one document: a DemographicRecord, a list of MedicationRecord, a list of ProblemRecord, and
+# the rows of any additional domains asked for by name, or None
+CcdaRecords = namedtuple('CcdaRecords', ['demographics', 'medications', 'problems', 'domains'], defaults=[None])
+
+def parse_raw_ccda_file(source_file: str, members_file: str = None, medications_file: str = None, problems_file: str = None,
+                        output: OutputSink = None, metrics: MetricsSink = None, domains: list[str] = None):
     ''' Parse a given ccda xml source file.  Produces a limited extract of member data, medication data, and problem data.
         Each of the output types will be appended to the corresponding given file as flat csv.  In the case of multipl medications
         or problems, a new entry line will be created for each.  Each data element will be keyed by the patient identifier.  Each
@@ -27,13 +52,17 @@ def parse_raw_ccda_file(source_file: str, members_file: str, medications_file: s
         Parsing discards other common sections (e.g. Care Plan, Chief Complaint, Encounters, Functional Status, Immunizations,
         Declined Immunizations, Patient Instructions, Procedures, Results (Labs), Smoking Status, Vitals)
         Assumes one member per file.  Member file will not filter for duplications.
+        Pass an open output to append to it instead of opening the three files for this document only.  The rows of
+        the additional domains named in domains are extracted in the same pass and written to output.
     '''
     logging.info('Start parsing %s', source_file)
-    with open(source_file, encoding='utf-8') as fh:
-        parse_raw_ccda_text(fh.read(), source_file, members_file, medications_file, problems_file)
+    with _mapped_file(source_file) as content:
+        parse_raw_ccda_text(content, source_file, members_file, medications_file, problems_file, output, metrics, domains)
 
 
-def parse_raw_ccda_text(source_content: str, source_name: str, members_file: str, medications_file: str, problems_file: str):
+def parse_raw_ccda_text(source_content: DocumentSource, source_name: str, members_file: str = None,
+                        medications_file: str = None, problems_file: str = None, output: OutputSink = None,
+                        metrics: MetricsSink = None, domains: list[str] = None):
     ''' Parse a given ccda xml source file.  Produces a limited extract of member data, medication data, and problem data.
         Each of the output types will be appended to the corresponding given file as flat csv.  In the case of multipl medications
         or problems, a new entry line will be created for each.  Each data element will be keyed by the patient identifier.  Each
@@ -41,47 +70,150 @@ def parse_raw_ccda_text(source_content: str, source_name: str, members_file: str
         Parsing discards other common sections (e.g. Care Plan, Chief Complaint, Encounters, Functional Status, Immunizations,
         Declined Immunizations, Patient Instructions, Procedures, Results (Labs), Smoking Status, Vitals)
         Assumes one member per file.  Member file will not filter for duplications.
+        Pass an open output to append to it instead of opening the three files for this document only.  The rows of
+        the additional domains named in domains are extracted in the same pass and written to output.
     '''
-    logging.info('Start parsing %s data', source_name)
-    member_id, document_id = _extract_info_from_filename(source_name)
-    ccda_dict = xmltodict.parse(source_content)
-    if len(ccda_dict) != 1:
-        raise ValueError(f'Multiple member information found in {source_name}')
-    demographic_info = demographics.extract_demographic_information_from(ccda_dict, member_id, document_id)
-    medication_list = medications.extract_medication_information_from(ccda_dict, member_id, document_id)
-    problem_list = problems.extract_problem_information_from(ccda_dict, member_id, document_id)
-    _initialize_output_file(members_file, demographics.DEMOGRAPHIC_HEADER)
-    _initialize_output_file(medications_file, medications.MEDICATION_HEADER)
-    _initialize_output_file(problems_file, problems.PROBLEM_HEADER)
-    with open(members_file, 'a', encoding='utf-8') as out_fh:
-        csv.writer(out_fh).writerow(demographic_info)
-    with open(medications_file, 'a', encoding='utf-8') as out_fh:
-        writer = csv.writer(out_fh)
-        for row in medication_list:
-            writer.writerow(row)
-    with open(problems_file, 'a', encoding='utf-8') as out_fh:
-        writer = csv.writer(out_fh)
-        for row in problem_list:
-            writer.writerow(row)
+    if output is None and domains:
+        raise ValueError('additional domains require an output')
+    rows = extract_raw_ccda_text(source_content, source_name, metrics, domains)
+    if output is None:
+        with CsvOutput(members_file, medications_file, problems_file) as single_output:
+            write_raw_ccda_rows(single_output, rows, source_name, metrics)
+    else:
+        write_raw_ccda_rows(output, rows, source_name, metrics)
     logging.info('Done parsing %s', source_name)
 
 
-def _initialize_output_file(filename: str, expected_header: list[str]):
-    ''' create the given file and initialize with a header row if it does not already exist
-        of verify that the file has the expected schema if it does exit.
+def parse_ccda(source: DocumentSource, source_name: str, metrics: MetricsSink = None,
+               domains: list[str] = None) -> CcdaRecords:
+    ''' Parse a c-cda document held in memory, as str or bytes, or read from a file-like object, and return its records
+        without touching the filesystem.  source_name follows the member_document_suffix.xml structure of the source
+        files and supplies the MemberID and SourceDocument of each record.  The records of the additional domains
+        named in domains are returned in records.domains, keyed by domain.
     '''
-    if os.path.exists(filename):
-        with open(filename, encoding='utf-8') as fh:
-            header = next(csv.reader(fh))
-            if header != expected_header:
-                raise ValueError(f'{filename} does not match expected schema')
-    else:
-        with open(filename, 'w', encoding='utf-8') as out_fh:
-            csv.writer(out_fh).writerow(expected_header)
+    if isinstance(source, io.TextIOBase):
+        source = source.read()
+    return extract_raw_ccda_text(source, source_name, metrics, domains)
+
+
+def parse_ccda_documents(documents, metrics: MetricsSink = None, domains: list[str] = None):
+    ''' Lazily parse each (source, source_name) pair of the given iterable as parse_ccda does, yielding the records of
+        one document at a time.  Nothing is read from documents until the next record is asked for.
+    '''
+    for source, source_name in documents:
+        yield parse_ccda(source, source_name, metrics, domains)
+
+
+def extract_raw_ccda_file(source_file: str, metrics: MetricsSink = None, domains: list[str] = None) -> CcdaRecords:
+    ''' Parse a given ccda xml source file and return the demographic row, medication rows, and problem rows
+        without writing anything.  Used by the bulk workers so that a single process owns the output files.
+    '''
+    logging.info('Start parsing %s', source_file)
+    with _mapped_file(source_file) as content:
+        return extract_raw_ccda_text(content, source_file, metrics, domains)
+
+
+def extract_raw_ccda_text(source_content: DocumentSource, source_name: str, metrics: MetricsSink = None,
+                          domains: list[str] = None) -> CcdaRecords:
+    ''' Parse a given ccda xml string, or bytes, mmap, or binary file-like object, and return the demographic row,
+        medication rows, and problem rows without writing anything.  Bytes are decoded by the xml parser itself, in the
+        encoding given by the xml declaration, so pass them undecoded.  If a metrics sink is given, the time spent in the
+        xml parse and in each extractor is recorded against source_name along with the document size and row counts,
+        or if parsing fails the time until it failed as failed_seconds.
+        The sections of the additional domains named in domains are kept by the same parse and their rows returned
+        keyed by domain.
+    '''
+    extra = domains_named(domains) if domains else []
+    section_roots = SECTION_ROOTS + section_roots_of(domains) if domains else SECTION_ROOTS
+    logging.info('Start parsing %s data', source_name)
+    # the stage is recorded on any exception so a tolerant run can report where the document failed
+    stage = 'name'
+    began = time.perf_counter()
+    try:
+        member_id, document_id = extract_info_from_filename(source_name)
+        stage = 'xml_parse'
+        start = time.perf_counter()
+        ccda_dict = parse_ccda_sections(source_content, HEADER_ELEMENTS, section_roots)
+        if len(ccda_dict) != 1:
+            raise ValueError(f'Multiple member information found in {source_name}')
+        sections = build_section_index(ccda_dict)
+        parsed = time.perf_counter()
+        stage = 'demographics'
+        demographic_info = demographics.extract_demographic_information_from(ccda_dict, member_id, document_id)
+        demographic_done = time.perf_counter()
+        stage = 'medications'
+        medication_list = medications.extract_medication_information_from(ccda_dict, member_id, document_id, sections)
+        medication_done = time.perf_counter()
+        stage = 'problems'
+        problem_list = problems.extract_problem_information_from(ccda_dict, member_id, document_id, sections)
+        problem_done = time.perf_counter()
+        domain_rows = {}
+        for domain in extra:
+            stage = domain.name
+            domain_rows[domain.name] = domain.extract(sections, member_id, document_id)
+    except Exception as oops:
+        oops.stage = stage
+        if metrics is not None:
+            # the time spent on a failing document, so it is summarized with the others and can rank among the slowest
+            metrics.record(source_name, 'failed_seconds', time.perf_counter() - began)
+        raise
+    if metrics is not None:
+        metrics.record_all(source_name, {
+            'document_bytes': source_content.tell() if isinstance(source_content, io.IOBase) else len(source_content),
+            'xml_parse_seconds': parsed - start,
+            'demographics_seconds': demographic_done - parsed,
+            'medications_seconds': medication_done - demographic_done,
+            'problems_seconds': problem_done - medication_done,
+            'medication_rows': len(medication_list),
+            'problem_rows': len(problem_list),
+        })
+        if extra:
+            # the additional domains share one timing, recorded only when they are asked for
+            metrics.record_all(source_name, {
+                'domains_seconds': time.perf_counter() - problem_done,
+                **{f'{name}_rows': len(rows) for name, rows in domain_rows.items()},
+            })
+    return CcdaRecords(demographic_info, medication_list, problem_list, domain_rows or None)
 
 
-def _extract_info_from_filename(file_name: str) -> tuple[str, str]:
-    ''' Extract the member_id and document_id values from the given filename
+def write_raw_ccda_rows(output: OutputSink, rows: CcdaRecords, source_name: str, metrics: MetricsSink = None):
+    ''' Write the rows extracted from one document to the given output.  If a metrics sink is given, the write time
+        is recorded and the document is marked finished.
+    '''
+    if metrics is None:
+        output.write(*rows)
+        return
+    start = time.perf_counter()
+    output.write(*rows)
+    metrics.record(source_name, 'write_seconds', time.perf_counter() - start)
+    metrics.end(source_name)
+
+
+@contextmanager
+def _mapped_file(source_file: str):
+    ''' Context giving the bytes of the given file as a read only mmap, so the parser reads the page cache directly
+        instead of a decoded copy of the document.  An empty file, which cannot be mapped, gives empty bytes.
+    '''
+    with open(source_file, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+
+def _file_names_in(lines):
+    ''' yield the file name on each non blank line
+    '''
+    for line in lines:
+        name = line.strip()
+        if name:
+            yield name
+
+
+def extract_info_from_filename(file_name: str) -> tuple[str, str]:
+    ''' Extract the member_id and document_id values from the given filename, raising ValueError unless it is a
+        MEMBERID_DOCUMENTID_suffix.xml name
     '''
     tokens = os.path.splitext(os.path.split(file_name)[-1])
     id_tokens = tokens[0].split('_')
@@ -90,16 +222,30 @@ def _extract_info_from_filename(file_name: str) -> tuple[str, str]:
     return id_tokens[0], id_tokens[1]
 
 
-if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        logging.warning('USAGE: %s xml_ccda_source_file members_file medications_file problems_file', sys.argv[0])
+# the former private name, for callers that still import it
+_extract_info_from_filename = extract_info_from_filename
+
+
+def main(argv: list[str] = None, prog: str = None):
+    ''' Parse from the command line, as this script or ccda.py parse.  A source of - reads the names of the source files
+        from stdin, one per line, and appends every document to the same three files in one process.
+    '''
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 4:
+        logging.warning('USAGE: %s xml_ccda_source_file members_file medications_file problems_file', prog or sys.argv[0])
         sys.exit(0)
 
-    SOURCE = sys.argv[1]
-    MEMBERS = sys.argv[2]
-    MEDICATIONS = sys.argv[3]
-    PROBLEMS = sys.argv[4]
-    if not os.path.exists(SOURCE):
-        raise ValueError(f'{SOURCE} does not exist')
+    source, members_file, medications_file, problems_file = argv
+    if source == STDIN_SOURCE:
+        with CsvOutput(members_file, medications_file, problems_file) as output:
+            for source_file in _file_names_in(sys.stdin):
+                parse_raw_ccda_file(source_file, output=output)
+        return
+    if not os.path.exists(source):
+        raise ValueError(f'{source} does not exist')
+
+    parse_raw_ccda_file(source, members_file, medications_file, problems_file)
 
-    parse_raw_ccda_file(SOURCE, MEMBERS, MEDICATIONS, PROBLEMS)
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,51 @@
 ''' Extract demographic information from the given ccda dictionary and return it as a flat row
 '''
 
-import datetime
 import logging
+from collections import namedtuple
 
 from parsers.ccda_segment_codes import SEGMENT_MAP
+from parsers.fields import FIRST, compile_plan
+from parsers.timestamps import hl7_date
 
 DEMOGRAPHIC_HEADER = ['MemberID', 'Effective', 'FirstName', 'LastName', 'DOB', 'Gender', 'MaritalStatus', 'Address', 'City',
                       'State', 'Zip', 'Country', 'Phone', 'Language', 'Race', 'Ethnicity', 'Religion',
                       'ProviderName', 'ProviderPhone', 'SourceDocument']
+DemographicRecord = namedtuple('DemographicRecord', DEMOGRAPHIC_HEADER)
 
-def extract_demographic_information_from(ccda_dict: dict, member_id: str, document_id: str) -> list[str]:
-    ''' Extract member information from the document and return as a flat list.
+# ClinicalDocument children read by the extractor
+DEMOGRAPHIC_ELEMENTS = ['templateId', 'effectiveTime', 'recordTarget']
+
+# column -> path within the ClinicalDocument record, see parsers/fields.py
+_PATIENT_ROLE = ('recordTarget', 'patientRole')
+_PATIENT = (*_PATIENT_ROLE, 'patient')
+DEMOGRAPHIC_FIELDS = {
+    'Effective': ('?effectiveTime', '?@value', hl7_date),
+    'FirstName': (*_PATIENT, 'name', FIRST, 'given', FIRST, lambda given: _given_name_from(given)),
+    'LastName': (*_PATIENT, 'name', FIRST, 'family'),
+    'DOB': (*_PATIENT, '?birthTime', '?@value', hl7_date),
+    'Gender': (*_PATIENT, 'administrativeGenderCode', '@code'),
+    'MaritalStatus': (*_PATIENT, '?maritalStatusCode', '?@code'),
+    'Race': (*_PATIENT, 'raceCode', '?@code'),
+    'Ethnicity': (*_PATIENT, 'ethnicGroupCode', '?@code'),
+    'Religion': (*_PATIENT, '?religiousAffiliationCode', '?@code'),
+    'Language': (*_PATIENT, '?languageCommunication', FIRST, '?languageCode', '?@code'),
+    'Address': (*_PATIENT_ROLE, 'addr', FIRST, 'streetAddressLine'),
+    'City': (*_PATIENT_ROLE, 'addr', FIRST, 'city'),
+    'State': (*_PATIENT_ROLE, 'addr', FIRST, 'state'),
+    'Zip': (*_PATIENT_ROLE, 'addr', FIRST, 'postalCode'),
+    'Country': (*_PATIENT_ROLE, 'addr', FIRST, '?country'),
+    'Phone': (*_PATIENT_ROLE, 'telecom', FIRST, '?@value'),
+    'ProviderName': (*_PATIENT_ROLE, '?providerOrganization', '?name'),
+    'ProviderPhone': (*_PATIENT_ROLE, '?providerOrganization', '?telecom', '?@value'),
+}
+_extract_demographic_fields = compile_plan(DEMOGRAPHIC_HEADER, DEMOGRAPHIC_FIELDS, ['MemberID', 'SourceDocument'],
+                                           DemographicRecord)
+MEMBER_ID_SLOT = DEMOGRAPHIC_HEADER.index('MemberID')
+SOURCE_DOCUMENT_SLOT = DEMOGRAPHIC_HEADER.index('SourceDocument')
+
+def extract_demographic_information_from(ccda_dict: dict, member_id: str, document_id: str) -> DemographicRecord:
+    ''' Extract member information from the document and return as a flat DemographicRecord.
         Ideally validated/populated against https://www.hl7.org/ccdasearch/templates/2.16.840.1.113883.10.20.22.1.1.html
     '''
     record = None
@@ -22,76 +56,16 @@ def extract_demographic_information_from(ccda_dict: dict, member_id: str, docume
     if not record:
         raise ValueError('Member information not found')
 
-    demo_list = [None] * len(DEMOGRAPHIC_HEADER)
-    demo_list[DEMOGRAPHIC_HEADER.index('MemberID')] = member_id
-    demo_list[DEMOGRAPHIC_HEADER.index('Effective')] = _get_effective_date_from(record)
-    pr = record['recordTarget']['patientRole']
-    patient = pr['patient']
-    name = patient['name']
-    if isinstance(name, list):
-        name = name[0]
-    first, last = _get_name(name)
-    demo_list[DEMOGRAPHIC_HEADER.index('FirstName')] = first
-    demo_list[DEMOGRAPHIC_HEADER.index('LastName')] = last
-    demo_list[DEMOGRAPHIC_HEADER.index('DOB')] = _get_birthdate_from(patient)
-    demo_list[DEMOGRAPHIC_HEADER.index('Gender')] = patient['administrativeGenderCode']['@code']
-    demo_list[DEMOGRAPHIC_HEADER.index('MaritalStatus')] = patient.get('maritalStatusCode', {}).get('@code')
-    demo_list[DEMOGRAPHIC_HEADER.index('Race')] = patient['raceCode'].get('@code')
-    demo_list[DEMOGRAPHIC_HEADER.index('Ethnicity')] = patient['ethnicGroupCode'].get('@code')
-    demo_list[DEMOGRAPHIC_HEADER.index('Religion')] = patient.get('religiousAffiliationCode', {}).get('@code')
-    language = patient.get('languageCommunication', {})
-    if isinstance(language, list):
-        language = language[0]
-    demo_list[DEMOGRAPHIC_HEADER.index('Language')] = language.get('languageCode', {}).get('@code')
-    addr = pr['addr']
-    if isinstance(addr, list):
-        addr = addr[0]
-    demo_list[DEMOGRAPHIC_HEADER.index('Address')] = addr['streetAddressLine']
-    demo_list[DEMOGRAPHIC_HEADER.index('City')] = addr['city']
-    demo_list[DEMOGRAPHIC_HEADER.index('State')] = addr['state']
-    demo_list[DEMOGRAPHIC_HEADER.index('Zip')] = addr['postalCode']
-    demo_list[DEMOGRAPHIC_HEADER.index('Country')] = addr.get('country')
-    telecom = pr['telecom']
-    if isinstance(telecom, list):
-        telecom = telecom[0]
-    demo_list[DEMOGRAPHIC_HEADER.index('Phone')] = telecom.get('@value')
-    provider = pr.get('providerOrganization', {})
-    demo_list[DEMOGRAPHIC_HEADER.index('ProviderName')] = provider.get('name')
-    demo_list[DEMOGRAPHIC_HEADER.index('ProviderPhone')] = provider.get('telecom', {}).get('@value')
-    demo_list[DEMOGRAPHIC_HEADER.index('SourceDocument')] = document_id
+    demo_list = _extract_demographic_fields(record, member_id, document_id)
     logging.info('Extracted member information for %s', member_id)
     return demo_list
 
 
-def _get_name(name: dict) -> tuple:
+def _given_name_from(given) -> str:
     ''' extract and return the given name from val.
         several varients to deal with
     '''
-    given = name['given']
-    if isinstance(given, list):
-        given = given[0]
     if not isinstance(given, str):
         given = given.get('#text')
-    return given, name['family']
+    return given
 
-
-def _get_birthdate_from(patient: dict) -> str:
-    ''' extract and return birthdate if it is an integer value
-        otherwise None
-    '''
-    try:
-        candidate = patient['birthTime']['@value'][:8]
-        return datetime.datetime.strptime(candidate, '%Y%m%d').date().isoformat()
-    except:
-        return None
-
-
-def _get_effective_date_from(record: dict) -> str:
-    ''' extract and return the effective date from the given record
-        otherwise None
-    '''
-    try:
-        candidate = record['effectiveTime']['@value'][:8]
-        return datetime.datetime.strptime(candidate, '%Y%m%d').date().isoformat()
-    except:
-        return None
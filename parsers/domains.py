@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+''' Declarative extraction of the c-cda domains beyond demographics.  Each domain declares its record type, the paths
+    from a section entry to the records that become its rows, and the column paths within a record (see
+    parsers/fields.py); a registry maps domain names to their declarations.  Any subset of domains is extracted from
+    the one streamed parse and section index of a document: the section roots of the chosen domains are added to the
+    streaming filter and each domain reads its own section from the index, so extracting a domain costs the compiled
+    field plan over its entries rather than another parse or body walk.  A domain's plan is compiled the first time it
+    extracts, so a run pays only for the domains it asks for.
+    medications and problems are not registered: every parse already extracts them with parsers/medications.py and
+    parsers/problems.py, so naming them as additional domains is rejected rather than writing their rows twice.  The
+    registered domains are written to their own output files or tables, named after the domain.
+'''
+
+import logging
+from functools import cached_property
+from collections import namedtuple
+
+from parsers.ccda_segment_codes import SEGMENT_MAP
+from parsers.fields import FIRST, compile_plan
+from parsers.timestamps import hl7_date
+
+class Domain:
+    ''' Declaration of one domain, whose rows are the given namedtuple record_type with the csv columns as fields.
+        entries lists the paths from a section entry to the records of the domain, each step a key as in a field path:
+        'key' required, '?key' optional, with a list at any step giving one record per element.  With entries None the
+        section itself is the one record, for narrative sections without coded entries.  A document without the
+        section has no rows of the domain.
+    '''
+    def __init__(self, name: str, record_type, fields: dict[str, tuple], entries: list[tuple] = None):
+        self.name = name
+        self.header = list(record_type._fields)
+        self.record_type = record_type
+        self.entries = entries
+        self.fields = fields
+
+    @cached_property
+    def extract_fields(self):
+        ''' the compiled field plan, taking a record, the member id, and the document id and returning its row
+        '''
+        return compile_plan(self.header, self.fields, ['MemberID', 'SourceDocument'], self.record_type)
+
+    @property
+    def section_roots(self) -> list[str]:
+        ''' the templateId roots of the sections of this domain
+        '''
+        return SEGMENT_MAP[self.name]
+
+    def extract(self, sections: dict, member_id: str, document_id: str) -> list:
+        ''' Return the rows of this domain from the given section index, one per record found in its section entries
+        '''
+        section = sections.get(self.name)
+        if section is None:
+            return []
+        if self.entries is None:
+            logging.info('Extracted %s information for %s', self.name, member_id)
+            return [self.extract_fields(section, member_id, document_id)]
+        entry_vals = section.get('entry')
+        if entry_vals is None:
+            logging.info('No %s entries found', self.name)
+            return []
+        rows = []
+        for path in self.entries:
+            for record in _records(entry_vals, path):
+                rows.append(self.extract_fields(record, member_id, document_id))
+        logging.info('Extracted %s information for %s', self.name, member_id)
+        return rows
+
+
+DOMAINS = {}
+# extracted from every document by the core extractors, never as additional domains
+CORE_DOMAINS = ('medications', 'problems')
+
+def register(domain: Domain) -> Domain:
+    ''' Add the given domain to the registry, replacing any domain of the same name
+    '''
+    if domain.name not in SEGMENT_MAP:
+        raise ValueError(f'{domain.name} is not a SEGMENT_MAP domain')
+    if domain.name in CORE_DOMAINS:
+        raise ValueError(f'{domain.name} is extracted from every document and cannot be registered')
+    DOMAINS[domain.name] = domain
+    return domain
+
+
+def domains_named(names: list[str]) -> list[Domain]:
+    ''' Return the registered domains with the given names, in order
+    '''
+    core = [name for name in names if name in CORE_DOMAINS]
+    if core:
+        raise ValueError(f'{", ".join(core)} are extracted from every document, not as additional domains')
+    unknown = [name for name in names if name not in DOMAINS]
+    if unknown:
+        raise ValueError(f'Unknown domains {", ".join(unknown)}, choose from {", ".join(DOMAINS)}')
+    return [DOMAINS[name] for name in names]
+
+
+def section_roots_of(names: list[str]) -> list[str]:
+    ''' Return the section templateId roots to keep while streaming a document for the given domains
+    '''
+    return [root for domain in domains_named(names) for root in domain.section_roots]
+
+
+def narrative(value) -> str:
+    ''' Return the text of a narrative block, the strings of all its elements joined by single spaces,
+        without markup or attributes.  Text mixed with child elements follows them, as the parse shapes it.
+    '''
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, list):
+        parts = [narrative(item) for item in value]
+    elif isinstance(value, dict):
+        parts = [narrative(child) for key, child in value.items() if not key.startswith('@') and child is not None]
+    else:
+        return ''
+    return ' '.join(part for part in parts if part)
+
+
+def _records(value, path: tuple):
+    ''' yield the records found by following path from value, expanding lists at every step
+    '''
+    if isinstance(value, list):
+        for item in value:
+            yield from _records(item, path)
+        return
+    if not path:
+        yield value
+        return
+    step = path[0]
+    if step.startswith('?'):
+        child = value.get(step[1:]) if isinstance(value, dict) else None
+        if child is None:
+            return
+    else:
+        child = value[step]
+    yield from _records(child, path[1:])
+
+
+# columns shared by coded records: the record code and when it applied
+_DATES = {
+    'Date': ('?effectiveTime', FIRST, '?@value', hl7_date),
+    'StartDate': ('?effectiveTime', FIRST, '?low', '?@value', hl7_date),
+    'EndDate': ('?effectiveTime', FIRST, '?high', '?@value', hl7_date),
+}
+_CODED = {
+    'Code': ('?code', '?@code'),
+    'CodeSystem': ('?code', '?@codeSystem'),
+    'CodeSystemName': ('?code', '?@codeSystemName'),
+    'Name': ('?code', '?@displayName'),
+}
+
+# allergy concern act -> allergy intolerance observation, 2.16.840.1.113883.10.20.22.4.7
+ALLERGY_HEADER = ['MemberID', 'StartDate', 'EndDate', 'Status', 'TypeCode', 'TypeCodeSystem', 'AllergenCode',
+                  'AllergenCodeSystem', 'AllergenCodeSystemName', 'AllergenName', 'SourceDocument']
+AllergyRecord = namedtuple('AllergyRecord', ALLERGY_HEADER)
+_ALLERGEN = ('?participant', FIRST, '?participantRole', '?playingEntity', '?code')
+register(Domain('allergies', AllergyRecord, {
+    'StartDate': _DATES['StartDate'],
+    'EndDate': _DATES['EndDate'],
+    'Status': ('?statusCode', '?@code'),
+    'TypeCode': ('?value', FIRST, '?@code'),
+    'TypeCodeSystem': ('?value', FIRST, '?@codeSystem'),
+    'AllergenCode': (*_ALLERGEN, '?@code'),
+    'AllergenCodeSystem': (*_ALLERGEN, '?@codeSystem'),
+    'AllergenCodeSystemName': (*_ALLERGEN, '?@codeSystemName'),
+    'AllergenName': (*_ALLERGEN, '?@displayName'),
+}, [('?act', '?entryRelationship', '?observation')]))
+
+# encounter activity, 2.16.840.1.113883.10.20.22.4.49
+ENCOUNTER_HEADER = ['MemberID', 'Date', 'StartDate', 'EndDate', 'Code', 'CodeSystem', 'CodeSystemName', 'Name',
+                    'SourceDocument']
+EncounterRecord = namedtuple('EncounterRecord', ENCOUNTER_HEADER)
+register(Domain('encounters', EncounterRecord, {**_DATES, **_CODED}, [('?encounter',)]))
+
+# immunization activity, 2.16.840.1.113883.10.20.22.4.52
+IMMUNIZATION_HEADER = ['MemberID', 'Date', 'Status', 'Refused', 'VaccineCode', 'VaccineCodeSystem', 'VaccineName',
+                       'LotNumber', 'RouteCode', 'RouteCodeSystem', 'DoseQuantityValue', 'DoseQuantityUnit',
+                       'SourceDocument']
+ImmunizationRecord = namedtuple('ImmunizationRecord', IMMUNIZATION_HEADER)
+_VACCINE = ('?consumable', '?manufacturedProduct', '?manufacturedMaterial')
+register(Domain('immunizations', ImmunizationRecord, {
+    'Date': _DATES['Date'],
+    'Status': ('?statusCode', '?@code'),
+    'Refused': ('?@negationInd',),
+    'VaccineCode': (*_VACCINE, '?code', '?@code'),
+    'VaccineCodeSystem': (*_VACCINE, '?code', '?@codeSystem'),
+    'VaccineName': (*_VACCINE, '?code', '?@displayName'),
+    'LotNumber': (*_VACCINE, '?lotNumberText'),
+    'RouteCode': ('?routeCode', '?@code'),
+    'RouteCodeSystem': ('?routeCode', '?@codeSystem'),
+    'DoseQuantityValue': ('?doseQuantity', '?@value'),
+    'DoseQuantityUnit': ('?doseQuantity', '?@unit'),
+}, [('?substanceAdministration',)]))
+
+# result and vital sign organizers -> observations, 2.16.840.1.113883.10.20.22.4.2 and .4.27
+RESULT_HEADER = ['MemberID', 'Date', 'Status', 'Code', 'CodeSystem', 'CodeSystemName', 'Name', 'Value', 'Unit',
+                 'ValueCode', 'ValueCodeSystem', 'InterpretationCode', 'SourceDocument']
+ResultRecord = namedtuple('ResultRecord', RESULT_HEADER)
+VitalRecord = namedtuple('VitalRecord', RESULT_HEADER)
+_MEASURED = {
+    'Date': _DATES['Date'],
+    'Status': ('?statusCode', '?@code'),
+    **_CODED,
+    'Value': ('?value', FIRST, '?@value'),
+    'Unit': ('?value', FIRST, '?@unit'),
+    'ValueCode': ('?value', FIRST, '?@code'),
+    'ValueCodeSystem': ('?value', FIRST, '?@codeSystem'),
+    'InterpretationCode': ('?interpretationCode', FIRST, '?@code'),
+}
+_OBSERVATIONS = [('?organizer', '?component', '?observation'), ('?observation',)]
+register(Domain('results', ResultRecord, _MEASURED, _OBSERVATIONS))
+register(Domain('vitals', VitalRecord, _MEASURED, _OBSERVATIONS))
+
+# procedure activity procedure, observation, and act, 2.16.840.1.113883.10.20.22.4.14, .4.13, and .4.12
+PROCEDURE_HEADER = ['MemberID', 'Date', 'StartDate', 'EndDate', 'Status', 'Code', 'CodeSystem', 'CodeSystemName', 'Name',
+                    'TargetSiteCode', 'TargetSiteCodeSystem', 'SourceDocument']
+ProcedureRecord = namedtuple('ProcedureRecord', PROCEDURE_HEADER)
+register(Domain('procedures', ProcedureRecord, {
+    **_DATES,
+    'Status': ('?statusCode', '?@code'),
+    **_CODED,
+    'TargetSiteCode': ('?targetSiteCode', FIRST, '?@code'),
+    'TargetSiteCodeSystem': ('?targetSiteCode', FIRST, '?@codeSystem'),
+}, [('?procedure',), ('?observation',), ('?act',)]))
+
+# social history and smoking status observations, 2.16.840.1.113883.10.20.22.4.38 and .4.78
+SOCIAL_HISTORY_HEADER = ['MemberID', 'Date', 'StartDate', 'EndDate', 'Code', 'CodeSystem', 'CodeSystemName', 'Name',
+                         'Value', 'Unit', 'ValueCode', 'ValueCodeSystem', 'ValueName', 'SourceDocument']
+SocialHistoryRecord = namedtuple('SocialHistoryRecord', SOCIAL_HISTORY_HEADER)
+register(Domain('social_history', SocialHistoryRecord, {
+    **_DATES,
+    **_CODED,
+    'Value': ('?value', FIRST, '?@value'),
+    'Unit': ('?value', FIRST, '?@unit'),
+    'ValueCode': ('?value', FIRST, '?@code'),
+    'ValueCodeSystem': ('?value', FIRST, '?@codeSystem'),
+    'ValueName': ('?value', FIRST, '?@displayName'),
+}, [('?observation',)]))
+
+# plan of treatment planned observation, act, encounter, procedure, medication, and supply,
+# 2.16.840.1.113883.10.20.22.4.39 through .4.44
+CARE_PLAN_HEADER = ['MemberID', 'Date', 'StartDate', 'EndDate', 'MoodCode', 'Status', 'Code', 'CodeSystem',
+                    'CodeSystemName', 'Name', 'SourceDocument']
+CarePlanRecord = namedtuple('CarePlanRecord', CARE_PLAN_HEADER)
+register(Domain('care_plan', CarePlanRecord, {
+    **_DATES,
+    'MoodCode': ('?@moodCode',),
+    'Status': ('?statusCode', '?@code'),
+    **_CODED,
+}, [('?observation',), ('?act',), ('?encounter',), ('?procedure',), ('?substanceAdministration',), ('?supply',)]))
+
+# chief complaint and reason for visit, narrative only
+CHIEF_COMPLAINT_HEADER = ['MemberID', 'Title', 'Text', 'SourceDocument']
+ChiefComplaintRecord = namedtuple('ChiefComplaintRecord', CHIEF_COMPLAINT_HEADER)
+register(Domain('chief_complaint', ChiefComplaintRecord, {
+    'Title': ('?title', narrative),
+    'Text': ('?text', narrative),
+}))
+
+# functional status organizers -> observations and functional status observations, 2.16.840.1.113883.10.20.22.4.66
+# and .4.67
+FunctionalStatusRecord = namedtuple('FunctionalStatusRecord', RESULT_HEADER)
+register(Domain('functional_statuses', FunctionalStatusRecord, _MEASURED, _OBSERVATIONS))
+
+# instruction acts, 2.16.840.1.113883.10.20.22.4.20
+INSTRUCTION_HEADER = ['MemberID', 'Status', 'Code', 'CodeSystem', 'CodeSystemName', 'Name', 'Text', 'SourceDocument']
+InstructionRecord = namedtuple('InstructionRecord', INSTRUCTION_HEADER)
+register(Domain('instructions', InstructionRecord, {
+    'Status': ('?statusCode', '?@code'),
+    **_CODED,
+    'Text': ('?text', narrative),
+}, [('?act',)]))
+
+# the domains written alongside the demographic, medication, and problem rows
+ADDITIONAL_DOMAINS = list(DOMAINS)
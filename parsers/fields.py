@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+''' Compile declarative column specifications into fast row extractors.  A domain declares each column as a path into
+    the xmltodict style record, e.g. ('consumable', 'manufacturedProduct', 'manufacturedMaterial', 'code', '?@code').
+    compile_plan resolves every column to its slot in the header once, at import, merges the paths into a tree so
+    a shared prefix is traversed once per record no matter how many columns read below it, and generates a single
+    function from the tree.
+    Path steps:
+        'key'   required child, raises like record['key'] when missing
+        '?key'  optional child, the column is left None when it is missing
+        FIRST   the first element when the value is a list, otherwise the value itself
+    A callable as the last element of a path is applied to the value found there.  Once any step yields None the
+    columns below it are left None.
+'''
+
+FIRST = object()
+
+def compile_plan(header: list[str], fields: dict[str, tuple], arguments: list[str] = (), row_type=list):
+    ''' Return a function that takes a record and returns a row with one value per header column, populated from the
+        given column -> path specification.  The columns named in arguments are filled from the extra positional
+        arguments of the function, in order, and the rest are left None.  With a namedtuple row_type the row is
+        returned as one, otherwise as a list.
+    '''
+    for column in [*fields, *arguments]:
+        if column not in header:
+            raise ValueError(f'{column} is not in the header')
+    root = _Node()
+    for column, path in fields.items():
+        transform = None
+        if path and callable(path[-1]):
+            path, transform = path[:-1], path[-1]
+        node = root
+        for step in path:
+            node = node.children.setdefault(step, _Node())
+        node.leaves.append((header.index(column), transform))
+
+    # the tree is emitted as one straight line function, a local per node and a nested if per step that can yield
+    # None, so a record costs the dictionary lookups themselves and no per step calls
+    namespace = {'_dict': dict, '_list': list, '_new': tuple.__new__, '_row_type': row_type}
+    parameters = ''.join(f', a{position}' for position in range(len(arguments)))
+    lines = [f'def extract(v0{parameters}):', f'    row = [None] * {len(header)}']
+    lines.extend(f'    row[{header.index(column)}] = a{position}' for position, column in enumerate(arguments))
+    _emit(root, 'v0', 1, lines, namespace, [0])
+    # the row always has len(header) values, so the namedtuple is built without the length check of _make
+    lines.append('    return row' if row_type is list else '    return _new(_row_type, row)')
+    exec(compile('\n'.join(lines), '<field plan>', 'exec'), namespace)
+    return namespace['extract']
+
+
+class _Node:
+    ''' path tree node: columns read at this point and the steps that continue from it
+    '''
+    def __init__(self):
+        self.leaves = []
+        self.children = {}
+
+
+def _emit(node: _Node, value: str, depth: int, lines: list[str], namespace: dict, counter: list[int]):
+    ''' append the statements that fill the columns of the given tree node from the named local
+    '''
+    indent = '    ' * depth
+    for slot, transform in node.leaves:
+        if transform is None:
+            lines.append(f'{indent}row[{slot}] = {value}')
+        else:
+            name = f'_t{len(namespace)}'
+            namespace[name] = transform
+            lines.append(f'{indent}row[{slot}] = {name}({value})')
+    for step, child in node.children.items():
+        counter[0] += 1
+        target = f'v{counter[0]}'
+        if step is FIRST:
+            lines.append(f'{indent}{target} = {value}[0] if isinstance({value}, _list) else {value}')
+        elif step.startswith('?'):
+            lines.append(f'{indent}{target} = {value}.get({step[1:]!r}) if isinstance({value}, _dict) else None')
+        else:
+            lines.append(f'{indent}{target} = {value}[{step!r}]')
+        lines.append(f'{indent}if {target} is not None:')
+        _emit(child, target, depth + 1, lines, namespace, counter)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+''' Build a per document index of structuredBody sections keyed by c-cda domain.  The body is walked once and each
+    section templateId root is looked up in a reverse map of SEGMENT_MAP, so every domain extractor can fetch its
+    section directly instead of re-scanning the body.
+'''
+
+from parsers.ccda_segment_codes import SEGMENT_MAP
+
+# domains whose codes identify the whole document rather than a body section
+DOCUMENT_DOMAINS = ('document', 'demographics')
+
+ROOT_TO_DOMAIN = {root: domain for domain, roots in SEGMENT_MAP.items() if domain not in DOCUMENT_DOMAINS for root in roots}
+
+def build_section_index(ccda_dict: dict) -> dict[str, dict]:
+    ''' Return a map of domain to the first structuredBody section whose templateId root belongs to that domain
+    '''
+    index = {}
+    component_list = ccda_dict['ClinicalDocument']['component']['structuredBody']['component']
+    if isinstance(component_list, dict):
+        component_list = [component_list]
+    for val in component_list:
+        section = val['section']
+        if 'templateId' not in section:
+            continue
+        if isinstance(section['templateId'], list):
+            ids = section['templateId']
+        elif isinstance(section['templateId'], dict):
+            ids = [section['templateId']]
+        else:
+            raise ValueError('Invalid templateId structure')
+        for id_val in ids:
+            domain = ROOT_TO_DOMAIN.get(id_val['@root'])
+            if domain is not None and domain not in index:
+                index[domain] = section
+    return index
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+''' Incremental c-cda reader.  Walks the xml with expat and only materializes the parts of the document that an
+    extractor asks for: the named children of ClinicalDocument (the header and recordTarget) and the structuredBody
+    sections whose templateId root is one of the requested segment codes.  Every other subtree is skipped as it is
+    read, so peak memory is bounded by the size of the kept sections rather than the whole document.
+    Kept subtrees are shaped exactly as xmltodict.parse would shape them (attributes prefixed with '@', text under
+    '#text', repeated children as lists), so the extractors in this package work unchanged.  The one difference is
+    that the kept structuredBody components are always returned as a list.
+'''
+
+import mmap
+from xml.parsers import expat
+
+ATTR_PREFIX = '@'
+TEXT_KEY = '#text'
+
+# direct section children that may precede the templateId list in a c-cda section; id is schema ordered after the
+# templateIds but some producers write it first
+SECTION_PREAMBLE = ('realmCode', 'typeId', 'templateId', 'id')
+
+def parse_ccda_sections(source, header_elements: list[str], section_roots: list[str]) -> dict:
+    ''' Parse the given c-cda source (str, bytes or another buffer such as an mmap, or a binary file-like object) and
+        return a dictionary holding the ClinicalDocument attributes, the requested header_elements, and the
+        structuredBody components whose section templateId root is in section_roots.  Buffers are parsed in place and
+        decoded by expat in the encoding of their xml declaration.
+    '''
+    handler = _SectionFilter(set(header_elements), set(section_roots))
+    encoding = None
+    if isinstance(source, str):
+        encoding = 'utf-8'
+        source = source.encode(encoding)
+    parser = expat.ParserCreate(encoding, None)
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.characters
+    # match xmltodict: leave entities unexpanded and ignore external references
+    parser.DefaultHandler = lambda x: None
+    parser.ExternalEntityRefHandler = lambda *x: 1
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        parser.Parse(source, True)
+    else:
+        parser.ParseFile(source)
+    return handler.document()
+
+
+class _SectionFilter:
+    ''' expat event handler that builds xmltodict style dictionaries for the kept subtrees only.
+        Depth 1 is ClinicalDocument, depth 2 its children, depth 4 the structuredBody components and depth 5 the
+        section within each component.
+    '''
+    def __init__(self, header_elements: set, section_roots: set):
+        self.header_elements = header_elements
+        self.section_roots = section_roots
+        self.depth = 0
+        self.skip_depth = None
+        self.root_name = None
+        self.root = None
+        self.components = None
+        # builder state for the subtree currently being captured
+        self.capture_depth = None
+        self.stack = []
+        self.item = None
+        self.data = []
+        # section selection state for the component currently being captured
+        self.undecided = False
+        self.matched = False
+
+    def document(self) -> dict:
+        ''' return the assembled document dictionary
+        '''
+        root = self.root
+        if self.components is not None:
+            root = _push(root, 'component', {'structuredBody': {'component': self.components}})
+        return {self.root_name: root}
+
+    def start_element(self, name: str, attrs: list):
+        self.depth += 1
+        if self.skip_depth is not None:
+            return
+        depth = self.depth
+        if self.capture_depth is not None:
+            if self.undecided and depth == self.capture_depth + 2:
+                self._select_section(name, attrs)
+                if self.skip_depth is not None:
+                    return
+            self.stack.append((self.item, self.data))
+            self.item = _attrs_to_dict(attrs)
+            self.data = []
+        elif depth == 1:
+            self.root_name = name
+            self.root = _attrs_to_dict(attrs)
+        elif depth == 2 and name in self.header_elements:
+            self._begin_capture(attrs)
+        elif depth == 2 and name == 'component':
+            pass
+        elif depth == 3 and name == 'structuredBody':
+            self.components = []
+        elif depth == 4 and name == 'component' and self.components is not None:
+            self._begin_capture(attrs)
+            self.undecided = True
+            self.matched = False
+        else:
+            self.skip_depth = depth
+
+    def end_element(self, name: str):
+        depth = self.depth
+        self.depth -= 1
+        if self.skip_depth is not None:
+            if depth == self.skip_depth:
+                self.skip_depth = None
+            return
+        if self.capture_depth is None:
+            return
+        value = self._finish_item()
+        if depth > self.capture_depth:
+            self.item, self.data = self.stack.pop()
+            self.item = _push(self.item, name, value)
+            return
+        self.capture_depth = None
+        if depth == 2:
+            self.root = _push(self.root, name, value)
+        elif self.matched:
+            self.components.append(value)
+        self.undecided = False
+
+    def characters(self, data: str):
+        if self.capture_depth is not None and self.skip_depth is None:
+            self.data.append(data)
+
+    def _begin_capture(self, attrs: list):
+        self.capture_depth = self.depth
+        self.stack = []
+        self.item = _attrs_to_dict(attrs)
+        self.data = []
+
+    def _select_section(self, name: str, attrs: list):
+        ''' called for each direct child of the section being captured until it is known whether the section is kept.
+            templateId children are checked against the requested roots; the first child past the preamble of
+            realmCode, typeId, templateId, and id settles the matter, and an unrequested section is dropped along
+            with its component.  A templateId that only follows the code or a later child is not seen.
+        '''
+        if name == 'templateId':
+            if dict(zip(attrs[0::2], attrs[1::2])).get('root') in self.section_roots:
+                self.matched = True
+            return
+        if name in SECTION_PREAMBLE:
+            return
+        self.undecided = False
+        if not self.matched:
+            self.skip_depth = self.capture_depth
+            self.capture_depth = None
+            self.stack = []
+            self.item = None
+            self.data = []
+
+    def _finish_item(self):
+        ''' return the value of the element being closed in xmltodict form
+        '''
+        data = ''.join(self.data).strip() or None if self.data else None
+        item = self.item
+        if item is None:
+            return data
+        if data:
+            item = _push(item, TEXT_KEY, data)
+        return item
+
+
+def _attrs_to_dict(attrs: list) -> dict:
+    ''' convert an expat ordered attribute list to an xmltodict attribute dictionary or None if empty
+    '''
+    if not attrs:
+        return None
+    return {ATTR_PREFIX + key: value for key, value in zip(attrs[0::2], attrs[1::2])}
+
+
+def _push(item: dict, key: str, value) -> dict:
+    ''' add value under key, turning repeated keys into a list, and return the (possibly new) item
+    '''
+    if item is None:
+        item = {}
+    if key in item:
+        existing = item[key]
+        if isinstance(existing, list):
+            existing.append(value)
+        else:
+            item[key] = [existing, value]
+    else:
+        item[key] = value
+    return item
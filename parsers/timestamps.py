@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+''' Parse HL7 v3 TS values, YYYY[MM[DD[HH[MM[SS[.S[S[S[S]]]]]]]]][+/-ZZzz], into ISO 8601 strings.  The date prefix
+    and the time after it are each matched once against their part of the TS pattern and range checked by hand instead
+    of through strptime, and malformed values return None without raising.  A date is kept whenever its own digits are
+    valid, so a time or offset that is not strict TS, e.g. a trailing Z or an hour of 24, costs the time, not the date.
+    Results are memoized in a bounded cache since the same dates repeat across the entries of a document and across
+    documents.  Every function returns a str at the precision the value was recorded with, e.g. '2019', '2019-03',
+    '2019-03-01' or '2019-03-01T10:30:00-05:00', or None.
+'''
+
+import re
+from functools import lru_cache
+
+CACHE_SIZE = 4096
+
+_DATE_PATTERN = re.compile(r'(\d{4})(\d\d)?(\d\d)?')
+_TIME_PATTERN = re.compile(r'(\d\d)(\d\d)?(\d\d)?(?:\.(\d{1,4}))?(?:([+-])(\d\d)(\d\d))?')
+_DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def hl7_date(value: str) -> str:
+    ''' Return the date part of the given TS value as YYYY, YYYY-MM or YYYY-MM-DD, otherwise None.  The date is the
+        one recorded in the value; a timezone offset is not applied, and a malformed time after the date is ignored.
+    '''
+    if not isinstance(value, str):
+        return None
+    return _date(value)
+
+
+def hl7_timestamp(value: str) -> str:
+    ''' Return the given TS value as an ISO 8601 string at its recorded precision, with the timezone offset if one
+        is given, otherwise None.  A time or offset that is not valid TS gives the date alone, as hl7_date does.
+    '''
+    if not isinstance(value, str):
+        return None
+    return _timestamp(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _date(value: str) -> str:
+    ''' memoized hl7_date
+    '''
+    fields = _date_fields(value)
+    if fields is None:
+        return None
+    year, month, day, _ = fields
+    if day is not None:
+        return f'{year}-{month}-{day}'
+    if month is not None:
+        return f'{year}-{month}'
+    return year
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _timestamp(value: str) -> str:
+    ''' memoized hl7_timestamp
+    '''
+    date = _date(value)
+    if date is None:
+        return None
+    rest = _date_fields(value)[3]
+    time = _time_fields(rest) if rest and len(date) == 10 else None
+    if time is None:
+        return date
+    hour, minute, second, fraction, sign, offset_hour, offset_minute = time
+    iso = f'{date}T{hour}:{minute or "00"}'
+    if second is not None:
+        iso += f':{second}'
+    if fraction is not None:
+        iso += f'.{fraction}'
+    if sign is not None:
+        iso += f'{sign}{offset_hour}:{offset_minute}'
+    return iso
+
+
+def _date_fields(value: str):
+    ''' match the date prefix of the given value and return its year, month, and day as strings, with the rest of
+        the value, or None if it does not start with a valid date
+    '''
+    value = value.strip()
+    match = _DATE_PATTERN.match(value)
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    if month is not None and not 1 <= int(month) <= 12:
+        return None
+    if day is not None and not 1 <= int(day) <= _days_in(int(year), int(month)):
+        return None
+    return year, month, day, value[match.end():]
+
+
+def _time_fields(rest: str):
+    ''' match the time after a date against the TS pattern and return its fields as strings, or None if it does not
+        match or any field is out of range
+    '''
+    match = _TIME_PATTERN.fullmatch(rest)
+    if match is None:
+        return None
+    fields = match.groups()
+    hour, minute, second, _, _, offset_hour, offset_minute = fields
+    if int(hour) > 23:
+        return None
+    if minute is not None and int(minute) > 59:
+        return None
+    if second is not None and int(second) > 59:
+        return None
+    if offset_hour is not None and (int(offset_hour) > 14 or int(offset_minute) > 59):
+        return None
+    return fields
+
+
+def _days_in(year: int, month: int) -> int:
+    ''' number of days in the given month
+    '''
+    if month == 2 and (year % 4 or (year % 100 == 0 and year % 400)):
+        return 28
+    return _DAYS_IN_MONTH[month]
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+''' Helpers for running document work on thread or process pools while keeping results in input order and
+    bounding how much work is in flight.
+'''
+
+from collections import deque
+
+def ordered_map(executor, fn, items, window: int):
+    ''' Submit fn(item) for each item to the given executor, keeping at most window calls pending, and yield the
+        results in item order.  Unlike executor.map the input is consumed lazily and completed results never pile up
+        beyond window, so memory stays bounded when the consumer is slower than the workers.  Pending calls that have
+        not started are cancelled if the consumer stops early or a result raises.
+    '''
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def staged_map(first_executor, first_fn, second_executor, second_fn, items, window: int):
+    ''' Run first_fn(item) on first_executor and hand each result to second_fn on second_executor as soon as it is
+        ready, yielding the second stage results in item order.  The stages overlap, so total time approaches the
+        slower of the two rather than their sum, and at most window items are in flight across both stages.
+    '''
+    def run_first(item):
+        return second_executor.submit(second_fn, first_fn(item))
+
+    for future in ordered_map(first_executor, run_first, items, window):
+        yield future.result()
@@ -3,91 +3,205 @@
     of each URL will be written to a file of the same name in the local folder or output_folder if given.
     If the process option is specified, the contents of each URL file will be parsed into demographic, medication,
     and problem domains.  Results will be appended to demographic_raw.csv, medicaion.csv, and problem.csv files in
-    the local folder or the output_folder if one is given.
+    the local folder or the output_folder if one is given.  Downloads run concurrently and, with --parsers, overlap the
+    parse; process_files.py -h lists the output, resume, and retry options.  requests and the xml parse are imported
+    by the option that uses them.
 '''
 
 import os
-import sys
+import argparse
 import logging
+from typing import TYPE_CHECKING
+from functools import partial
 
-import requests
+from downloader import (DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, DEFAULT_RETRY, RetryPolicy, read_urls_from, file_name_from,
+                        add_download_arguments, download_options)
+from outputs import (CSV_FORMAT, DEMOGRAPHIC_FILE, MEDICATION_FILE, PROBLEM_FILE, CsvOutput, add_output_arguments,
+                     check_output_arguments, open_output, restored_files_in, domain_files_in)
+from document_cache import DocumentCache
+from metrics import MetricsSink
 
-from parse_raw_ccda import parse_raw_ccda_text
+if TYPE_CHECKING:
+    from parse_raw_ccda import CcdaRecords
+    from member_index import MemberIndex
+    from quarantine import Quarantine
 
 CACHE_OPTION = 'cache'
 PROCESS_OPTION = 'process'
 
-DEMOGRAPHIC_FILE = 'demographic_raw.csv'
-MEDICATION_FILE = 'medication.csv'
-PROBLEM_FILE = 'problem.csv'
-
-def process_all_files_in(url_file: str, demographic_file: str, medication_file: str, problem_file) -> None:
+def process_all_files_in(url_file: str, demographic_file: str, medication_file: str, problem_file: str,
+                         concurrency: int = DEFAULT_CONCURRENCY, parsers: int = 1, cache: DocumentCache = None,
+                         metrics: MetricsSink = None, output_format: str = CSV_FORMAT, upsert_members: bool = False,
+                         quarantine: 'Quarantine' = None, timeout=DEFAULT_TIMEOUT, retry: RetryPolicy = DEFAULT_RETRY,
+                         shards: int = None, rows_per_shard: int = None, compress: bool = False,
+                         member_index: 'MemberIndex' = None, domains: list[str] = None) -> None:
     ''' Process the file represented by each signed url in the given file into domain specific CSVs in the current folder
-        or output folder if given
+        or output folder if given, or into the database in that folder with the sqlite output_format.
+        Downloads run concurrently; documents are parsed and appended in url order.
+        When parsers is greater than one, parsing runs on that many processes overlapped with the downloads.
+        Documents completed by an earlier run into the same folder are skipped.  If a cache is given, documents are read
+        from it when present and downloaded into it otherwise.  Per document measurements are recorded to metrics if given.
+        With a quarantine the run is tolerant: a document that fails to download or parse is recorded there, its cached
+        copy is moved into the quarantine folder, and the run continues with the next url.  timeout, seconds or a
+        (connect, read) pair, and retry apply to each download.  With shards or rows_per_shard the csv output is split
+        into shard files in the output folder instead, gzip compressed with compress.  With a member_index the
+        demographic row of each document written is applied to it.  The rows of the additional domains named in
+        domains are extracted in the same parse and written to their own csv files, shards, or tables.
     '''
-    with open(url_file, encoding='utf-8') as fh:
-        header = next(fh) #discard header
-        if header.startswith('http'):
-            raise ValueError(f'header not found in {url_file}')
-        for url in fh:
-            fname = os.path.split(url.split('?AWSAccessKeyId')[0])[-1]
-            logging.info(fname, url)
-
-            try:
-                response = requests.get(url, timeout=5)
-            except requests.exceptions.Timeout as oops:
-                logging.error('Download timeout for %s', url)
-                raise oops
-            if response.status_code == 200:
-                parse_raw_ccda_text(response.text, fname, demographic_file, medication_file, problem_file)
-            else:
-                raise RuntimeError(f'Download Failed {response.status_code} for {url}')
-
-
-def download_all_files_in(url_file: str, output_folder: str) -> None:
-    ''' Get the contents of all files from the AWS URLs in the given file.  The contents of each URL will be written to
-        a file of the same name in the local folder or output_folder if given.
+    from downloader import create_session
+    from parse_raw_ccda import write_raw_ccda_rows
+    from manifest import Manifest, MANIFEST_FILE
+    from member_index import IndexedOutput
+    from quarantine import DocumentFailure, DocumentFailed, isolated
+
+    urls = read_urls_from(url_file)
+    output_folder = os.path.dirname(demographic_file)
+    with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+        sharded = shards is not None or rows_per_shard is not None
+        manifest.restore(restored_files_in(output_folder, output_format, sharded, domains or [],
+                                           [demographic_file, medication_file, problem_file]))
+        urls = [url for url in urls if not manifest.is_complete(file_name_from(url))]
+        on_flush = manifest.checkpoint if member_index is None else member_index.checkpointed(manifest.checkpoint)
+        if output_format == CSV_FORMAT and not sharded and not compress:
+            output = CsvOutput(demographic_file, medication_file, problem_file, on_flush=on_flush,
+                               domain_files=domain_files_in(output_folder, domains or []))
+        else:
+            output = open_output(output_format, output_folder, on_flush, upsert_members, shards, rows_per_shard, compress,
+                                 domains)
+        with create_session(concurrency) as session, output:
+            if member_index is not None:
+                output = IndexedOutput(output, member_index)
+            documents = _parse_all(session, urls, concurrency, parsers, cache, metrics, quarantine is not None, timeout,
+                                   retry, domains)
+            for url in urls:
+                name = file_name_from(url)
+                cached_file = None if cache is None else cache.path_for(name)
+                # failures returned by the pipeline are raised here so the manifest and quarantine both see them
+                with isolated(quarantine, name, 'write', cached_file, metrics), manifest.track(name):
+                    rows = next(documents)
+                    if isinstance(rows, DocumentFailure):
+                        raise DocumentFailed(rows)
+                    write_raw_ccda_rows(output, rows, name, metrics)
+
+
+def download_all_files_in(url_file: str, output_folder: str, concurrency: int = DEFAULT_CONCURRENCY,
+                          max_cache_bytes: int = None, timeout=DEFAULT_TIMEOUT, retry: RetryPolicy = DEFAULT_RETRY) -> None:
+    ''' Get the contents of all files from the AWS URLs in the given file into output_folder, as the cache option does.
+        See downloader.download_all_files_in, which is imported only when this is called.
     '''
-    with open(url_file, encoding='utf-8') as fh:
-        header = next(fh) #discard header
-        if header.startswith('http'):
-            raise ValueError(f'header not found in {url_file}')
-        for url in fh:
-            output_file = os.path.join(output_folder, os.path.split(url.split('?AWSAccessKeyId')[0])[-1])
-            logging.info(output_file, url)
-
-            try:
-                response = requests.get(url, timeout=5)
-            except requests.exceptions.Timeout as oops:
-                logging.error('Download timeout for %s', url)
-                raise oops
-            if response.status_code == 200:
-                with open(output_file, 'wb') as out_fh:
-                    out_fh.write(response.content)
-            else:
-                raise RuntimeError(f'Download Failed {response.status_code} for {url}')
+    import downloader
+    downloader.download_all_files_in(url_file, output_folder, concurrency, max_cache_bytes, timeout, retry)
 
 
-if __name__ == '__main__':
-    USAGE = f'USAGE: {sys.argv[0]} url_file {CACHE_OPTION}|{PROCESS_OPTION} [output_folder]'
-    if len(sys.argv) not in (3, 4):
-        logging.warning(USAGE)
-        sys.exit(0)
-
-    URL_FILE = sys.argv[1]
-    if not os.path.exists(URL_FILE):
-        raise ValueError(f'{URL_FILE} does not exist')
-    OPTION = sys.argv[2].lower()
-    OUTPUT_FOLDER = '.'
-    if len(sys.argv) == 4:
-        OUTPUT_FOLDER = sys.argv[3]
-        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-    if OPTION == CACHE_OPTION:
-        download_all_files_in(URL_FILE, OUTPUT_FOLDER)
-    elif OPTION == PROCESS_OPTION:
-        process_all_files_in(URL_FILE, os.path.join(OUTPUT_FOLDER, DEMOGRAPHIC_FILE),
-                             os.path.join(OUTPUT_FOLDER, MEDICATION_FILE), os.path.join(OUTPUT_FOLDER, PROBLEM_FILE))
+def _parse_all(session, urls: list[str], concurrency: int, parsers: int, cache: DocumentCache = None,
+               metrics: MetricsSink = None, tolerant: bool = False, timeout=DEFAULT_TIMEOUT,
+               retry: RetryPolicy = DEFAULT_RETRY, domains: list[str] = None):
+    ''' yield the parsed rows of each url in order, with the rows of the additional domains named in domains.  With a
+        single parser the documents are parsed here as they arrive; otherwise fetch -> parse runs as a pipeline where
+        concurrency fetch threads hand each document to a pool of parsers processes as soon as it arrives, and the
+        bounded window keeps the number of downloaded but unwritten documents in check.  When tolerant a document that
+        fails yields its DocumentFailure instead of raising.
+    '''
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from downloader import fetch_content, fetch_all
+    from pipeline import staged_map
+    from quarantine import worker_task
+
+    def fetch(url):
+        if cache is None:
+            return fetch_content(session, url, timeout, metrics, retry), file_name_from(url)
+        return _fetch_cached(session, url, cache, metrics, timeout, retry), file_name_from(url)
+
+    fetch = worker_task(fetch, 'download', tolerant)
+    parse = partial(_parse_fetched, domains=domains)
+    if parsers <= 1:
+        parse = worker_task(parse, 'xml_parse', tolerant)
+        for fetched in fetch_all(urls, fetch, concurrency):
+            yield parse(fetched, metrics=metrics)
+        return
+
+    window = 2 * (concurrency + parsers)
+    parse = worker_task(parse, 'xml_parse', tolerant, metrics is not None)
+    with ThreadPoolExecutor(max_workers=concurrency) as fetch_pool, ProcessPoolExecutor(max_workers=parsers) as parse_pool:
+        for url, rows in zip(urls, staged_map(fetch_pool, fetch, parse_pool, parse, urls, window)):
+            if metrics is not None:
+                rows, values = rows
+                metrics.record_all(file_name_from(url), values)
+            yield rows
+
+
+def _fetch_cached(session, url: str, cache: DocumentCache, metrics: MetricsSink = None, timeout=DEFAULT_TIMEOUT,
+                  retry: RetryPolicy = DEFAULT_RETRY) -> bytes:
+    ''' return the content of the given url from the cache, downloading it into the cache first if needed
+    '''
+    from downloader import fetch_to_file
+
+    name = file_name_from(url)
+    path = cache.get(name)
+    if path is not None:
+        logging.info('Using cached %s', name)
+        with open(path, 'rb') as fh:
+            return fh.read()
+    sha256 = fetch_to_file(session, url, cache.path_for(name), timeout, metrics, retry)
+    with open(cache.path_for(name), 'rb') as fh:
+        content = fh.read()
+    cache.add(name, sha256)
+    return content
+
+
+def _parse_fetched(fetched: tuple[bytes, str], metrics: MetricsSink = None,
+                   domains: list[str] = None) -> 'CcdaRecords':
+    ''' parse a (content, file name) pair, in a parser process when pipelined
+    '''
+    from parse_raw_ccda import extract_raw_ccda_text
+
+    return extract_raw_ccda_text(*fetched, metrics, domains)
+
+
+def main(argv: list[str] = None, prog: str = None, option: str = None):
+    ''' Download and optionally parse from the command line, as this script or, with the option given, ccda.py process
+    '''
+    parser = argparse.ArgumentParser(prog=prog, description='Download and optionally parse the c-cda documents at the '
+                                                            'given signed urls')
+    parser.add_argument('url_file')
+    if option is None:
+        parser.add_argument('option', type=str.lower, choices=[CACHE_OPTION, PROCESS_OPTION])
     else:
-        logging.error('Invalid option %s', OPTION)
-        logging.error(USAGE)
+        parser.set_defaults(option=option)
+    parser.add_argument('output_folder', nargs='?', default='.')
+    add_download_arguments(parser)
+    parser.add_argument('--parsers', type=int, default=1,
+                        help='number of parsing processes for the process option (default 1, parse in this process)')
+    parser.add_argument('--cache-folder', help='document cache read before downloading for the process option')
+    add_output_arguments(parser, 'output options of the process option')
+    args = parser.parse_args(argv)
+    check_output_arguments(parser, args)
+
+    url_file = args.url_file
+    if not os.path.exists(url_file):
+        raise ValueError(f'{url_file} does not exist')
+    option = args.option
+    output_folder = args.output_folder
+    os.makedirs(output_folder, exist_ok=True)
+
+    max_cache_bytes, timeout, retry = download_options(args)
+
+    if option == CACHE_OPTION:
+        download_all_files_in(url_file, output_folder, args.concurrency, max_cache_bytes, timeout, retry)
+    elif option == PROCESS_OPTION:
+        from runs import run_sinks
+        cache = None if args.cache_folder is None else DocumentCache(args.cache_folder, max_cache_bytes)
+        try:
+            with run_sinks(args, output_folder) as sinks:
+                process_all_files_in(url_file, os.path.join(output_folder, DEMOGRAPHIC_FILE),
+                                     os.path.join(output_folder, MEDICATION_FILE),
+                                     os.path.join(output_folder, PROBLEM_FILE), args.concurrency, args.parsers, cache,
+                                     sinks.metrics, args.output_format, args.upsert_members, sinks.quarantine, timeout,
+                                     retry, args.shards, args.shard_rows, args.gzip, sinks.member_index, args.domains)
+        finally:
+            if cache is not None:
+                cache.close()
+
+
+if __name__ == '__main__':
+    main()
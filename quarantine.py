@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+''' Fault isolation for tolerant runs.  Instead of stopping the run at the first document that cannot be processed, a
+    tolerant run records the failure to a quarantine report, moves the offending input aside, and carries on with the
+    next document.  Each report entry holds the stage the document failed in (download, read, name, xml_parse,
+    demographics, medications, problems, write), the error, and a digest of the traceback so that documents failing
+    the same way can be grouped without reading every trace.
+    Failures inside worker processes or threads are returned as DocumentFailure values by guarded() rather than
+    raised, so one bad document does not end the ordered result stream the rest of the run is reading.
+'''
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import traceback
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import BrokenExecutor
+from collections import Counter, namedtuple
+
+from metrics import measured
+
+QUARANTINE_FOLDER = 'quarantine'
+REPORT_FILE = 'report.jsonl'
+SUMMARY_FILE = 'summary.json'
+
+_FRAME_PATTERN = re.compile(r'File "([^"]+)", line (\d+), in (\S+)')
+
+DocumentFailure = namedtuple('DocumentFailure', ['stage', 'error', 'reason', 'digest', 'trace'])
+
+class DocumentFailed(Exception):
+    ''' Raised in the parent for a DocumentFailure returned by a guarded worker, so the failure is recorded like one
+        raised in place
+    '''
+    def __init__(self, failure: DocumentFailure):
+        super().__init__(failure.reason)
+        self.failure = failure
+
+
+def failure_of(oops: Exception, stage: str) -> DocumentFailure:
+    ''' Return the DocumentFailure for the given exception.  The stage recorded on the exception where it was raised
+        is used if there is one, otherwise the given stage.
+    '''
+    if isinstance(oops, DocumentFailed):
+        return oops.failure
+    trace = ''.join(traceback.format_exception(type(oops), oops, oops.__traceback__))
+    return DocumentFailure(getattr(oops, 'stage', stage), type(oops).__name__, str(oops),
+                           traceback_digest(type(oops).__name__, trace), trace)
+
+
+def traceback_digest(error: str, trace: str) -> str:
+    ''' Return a short digest of the exception type and the file, line, and function of each frame in the given
+        formatted traceback.  Messages are left out so the same fault in different documents gives the same digest.
+    '''
+    frames = [(os.path.basename(file), line, function) for file, line, function in _FRAME_PATTERN.findall(trace)]
+    return hashlib.sha1(repr((error, frames)).encode('utf-8')).hexdigest()[:12]
+
+
+def guarded(fn, *args, stage: str, **kwargs):
+    ''' Call fn(*args, **kwargs) and return its result, or the DocumentFailure if it raises.  A DocumentFailure passed
+        as the first argument, from an earlier guarded stage, is returned unchanged without calling fn.
+    '''
+    if args and isinstance(args[0], DocumentFailure):
+        return args[0]
+    try:
+        return fn(*args, **kwargs)
+    except Exception as oops:
+        return failure_of(oops, stage)
+
+
+def worker_task(fn, stage: str, tolerant: bool = False, measure: bool = False):
+    ''' Return fn as run for one document by a worker: when tolerant a failure is returned as the DocumentFailure of
+        the given stage rather than raised, and with measure the result is paired with the metric values fn recorded,
+        as by metrics.measured
+    '''
+    task = fn if not tolerant else partial(guarded, fn, stage=stage)
+    return task if not measure else partial(measured, task)
+
+
+@contextmanager
+def isolated(quarantine, source_name: str, stage: str, source_file: str = None, metrics=None):
+    ''' Context that records an exception raised by its block, as failing in the given stage unless the exception
+        says otherwise, to the given Quarantine and suppresses it.  When quarantine is None the exception propagates
+        as usual, as does a broken worker pool, which ends the run rather than the document.  A metrics sink, if given,
+        ends the failed document so the values it recorded are summarized rather than left pending.
+    '''
+    try:
+        yield
+    except Exception as oops:
+        if metrics is not None:
+            metrics.end(source_name, failed=True)
+        if quarantine is None or isinstance(oops, BrokenExecutor):
+            raise
+        quarantine.add(source_name, oops, stage, source_file)
+    else:
+        if quarantine is not None:
+            quarantine.success()
+
+
+class Quarantine:
+    ''' Append only quarantine report in the quarantine folder of a run's output folder, with the inputs moved aside
+        into the same folder.
+    '''
+    def __init__(self, output_folder: str):
+        self.folder = os.path.join(output_folder, QUARANTINE_FOLDER)
+        os.makedirs(self.folder, exist_ok=True)
+        self.report = open(os.path.join(self.folder, REPORT_FILE), 'a', encoding='utf-8')
+        self.succeeded = 0
+        self.failures = Counter()
+        self.digests = Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        ''' Close the report
+        '''
+        self.report.close()
+
+    def success(self):
+        ''' Count a document that completed
+        '''
+        self.succeeded += 1
+
+    def add(self, source_name: str, failure, stage: str = None, source_file: str = None) -> DocumentFailure:
+        ''' Record the given failure, a DocumentFailure or the exception raised in the given stage, for the document
+            and move source_file, if given, into the quarantine folder
+        '''
+        if isinstance(failure, Exception):
+            failure = failure_of(failure, stage)
+        moved_to = None
+        if source_file is not None and os.path.exists(source_file):
+            moved_to = os.path.join(self.folder, os.path.basename(source_file))
+            os.replace(source_file, moved_to)
+        self.report.write(json.dumps({'source_name': source_name, 'stage': failure.stage, 'error': failure.error,
+                                      'reason': failure.reason, 'digest': failure.digest, 'moved_to': moved_to,
+                                      'time': time.time(), 'trace': failure.trace}) + '\n')
+        self.report.flush()
+        self.failures[failure.stage] += 1
+        self.digests[failure.digest] += 1
+        logging.warning('Quarantined %s, %s failed: %s: %s', source_name, failure.stage, failure.error, failure.reason)
+        return failure
+
+    def summary(self) -> dict:
+        ''' Return the number of documents that succeeded and failed, the failures by stage, and the most common
+            traceback digests
+        '''
+        return {'succeeded': self.succeeded, 'failed': sum(self.failures.values()), 'failed_by_stage': dict(self.failures),
+                'top_digests': dict(self.digests.most_common(10))}
+
+    def write_summary(self):
+        ''' Write the summary of this run next to the report and log it
+        '''
+        summary = self.summary()
+        with open(os.path.join(self.folder, SUMMARY_FILE), 'w', encoding='utf-8') as out_fh:
+            json.dump(summary, out_fh, indent=2)
+        logging.warning('%d documents succeeded, %d failed %s; see %s', summary['succeeded'], summary['failed'],
+                        summary['failed_by_stage'], os.path.join(self.folder, REPORT_FILE))
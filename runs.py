@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+''' The sinks of a bulk run besides its output, shared by bulk_parsing.py and process_files.py: the metrics that
+    --metrics summarizes, the quarantine of --tolerant, and the member index of --member-index, opened from the options
+    that outputs.add_output_arguments adds.  run_sinks opens those asked for and, when the run ends, writes
+    members_current.csv and member_changes.csv from the member index, if the run completed, and the metrics and
+    quarantine summaries, whether it completed or not.
+'''
+
+import os
+from contextlib import contextmanager
+from collections import namedtuple
+
+from metrics import RecordingMetrics
+from quarantine import Quarantine
+from member_index import MemberIndex, MEMBER_INDEX_FILE, CURRENT_MEMBERS_FILE, MEMBER_CHANGES_FILE
+
+# the sinks of one run, each None when its option was not given
+RunSinks = namedtuple('RunSinks', ['metrics', 'quarantine', 'member_index'])
+
+@contextmanager
+def run_sinks(args, output_folder: str) -> RunSinks:
+    ''' Context giving the RunSinks asked for by the parsed command line args of a run into output_folder
+    '''
+    metrics = RecordingMetrics() if args.metrics else None
+    quarantine = Quarantine(output_folder) if args.tolerant else None
+    member_index = None
+    try:
+        if args.member_index is not None:
+            member_index = MemberIndex(os.path.join(output_folder, MEMBER_INDEX_FILE),
+                                       track_changes=args.member_index == 'changes')
+        yield RunSinks(metrics, quarantine, member_index)
+        if member_index is not None:
+            member_index.write_current(os.path.join(output_folder, CURRENT_MEMBERS_FILE))
+            if member_index.track_changes:
+                member_index.write_changes(os.path.join(output_folder, MEMBER_CHANGES_FILE))
+    finally:
+        if member_index is not None:
+            member_index.close()
+        if metrics is not None:
+            metrics.write_summary(args.metrics)
+        if quarantine is not None:
+            quarantine.write_summary()
+            quarantine.close()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+''' Long running c-cda parsing service.  Documents POSTed over http are parsed on a pool of worker processes and their
+    demographic, medication, and problem rows are returned as json, so interpreter startup and imports are paid once
+    rather than per invocation.  The server is a small HTTP/1.1 implementation on asyncio streams with keep-alive and
+    no dependencies beyond the standard library.
+        POST /parse?source_name=M1_D1_masked.xml   body is the c-cda xml, returns one result
+        POST /parse/batch                          body is a json list of {"source_name": ..., "content": ...}, returns
+                                                   one result or error per document, in order
+        GET  /health                               liveness and current load
+        GET  /metrics                              request counters and the per document stage timing summary
+    At most max_concurrency documents are being parsed at once, counting every document of a batch; a request that
+    would go over the limit gets 503 until enough finish, and a batch of more than max_concurrency documents gets 413.
+'''
+
+import json
+import time
+import asyncio
+import argparse
+import logging
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from xml.parsers.expat import ExpatError
+
+from parse_raw_ccda import CcdaRecords, extract_raw_ccda_text, extract_info_from_filename
+from metrics import RecordingMetrics, measured
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_MAX_BODY_MB = 64
+KEEP_ALIVE_SECONDS = 30
+MAX_HEADER_LINES = 100
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class HttpError(Exception):
+    ''' An error to be returned to the client with the given status
+    '''
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ParseServer:
+    ''' Request handler for the parsing service.  Parsing runs on the given executor; every document's stage timings
+        are recorded to metrics.
+    '''
+    def __init__(self, executor, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_MB * 1024 * 1024):
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.max_body_bytes = max_body_bytes
+        self.metrics = RecordingMetrics()
+        self.started = time.time()
+        self.in_flight = 0
+        self.counters = {'requests': 0, 'documents': 0, 'rejected': 0, 'errors': 0}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ''' Serve requests from one connection until the client closes it, asks to, or stays idle too long
+        '''
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader, self.max_body_bytes), KEEP_ALIVE_SECONDS)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HttpError as oops:
+                    await _write_response(writer, oops.status, {'error': str(oops)}, False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload = await self.respond(method, target, body)
+                await _write_response(writer, status, payload, keep_alive)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method: str, target: str, body: bytes) -> tuple[int, object]:
+        ''' Return the status and json payload for the given request
+        '''
+        self.counters['requests'] += 1
+        url = urlsplit(target)
+        try:
+            if url.path == '/health':
+                _require(method, 'GET')
+                return 200, {'status': 'ok', 'uptime_seconds': time.time() - self.started, 'in_flight': self.in_flight,
+                             'max_concurrency': self.max_concurrency}
+            if url.path == '/metrics':
+                _require(method, 'GET')
+                return 200, {**self.counters, 'in_flight': self.in_flight, **self.metrics.summary()}
+            if url.path == '/parse':
+                _require(method, 'POST')
+                source_name = parse_qs(url.query).get('source_name', [None])[0]
+                return 200, await self._limited(self.parse(body, source_name))
+            if url.path == '/parse/batch':
+                _require(method, 'POST')
+                return 200, await self.parse_batch(body)
+            raise HttpError(404, f'{url.path} not found')
+        except HttpError as oops:
+            if oops.status == 503:
+                self.counters['rejected'] += 1
+            else:
+                self.counters['errors'] += 1
+            return oops.status, {'error': str(oops)}
+        except Exception as oops:
+            logging.exception('Failed to serve %s %s', method, target)
+            self.counters['errors'] += 1
+            return 500, {'error': repr(oops)}
+
+    async def parse(self, content, source_name: str) -> dict:
+        ''' Parse one document, the request body bytes as sent or the text of a batch entry, on the executor and return
+            its rows as json ready dictionaries
+        '''
+        if not source_name:
+            raise HttpError(400, 'source_name is required')
+        try:
+            extract_info_from_filename(source_name)
+        except ValueError as oops:
+            raise HttpError(400, str(oops)) from oops
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            records, values = await loop.run_in_executor(self.executor, partial(measured, extract_raw_ccda_text),
+                                                         content, source_name)
+        except (ValueError, KeyError, TypeError, ExpatError) as oops:
+            raise HttpError(422, f'{source_name}: {oops!r}') from oops
+        self.counters['documents'] += 1
+        self.metrics.record_all(source_name, values)
+        self.metrics.record(source_name, 'request_seconds', time.perf_counter() - start)
+        self.metrics.end(source_name)
+        return _records_json(source_name, records)
+
+    async def parse_batch(self, body: bytes) -> list[dict]:
+        ''' Parse each document of a json batch concurrently, returning a result or an error per document.  The batch
+            holds one concurrency slot per document while it is parsed.
+        '''
+        try:
+            documents = json.loads(body)
+            requests = [(document['content'], document['source_name']) for document in documents]
+            if not all(isinstance(content, str) for content, _ in requests):
+                raise TypeError('content must be a string')
+        except (ValueError, TypeError, KeyError) as oops:
+            raise HttpError(400, f'expected a json list of source_name and content objects: {oops!r}') from oops
+        if len(requests) > self.max_concurrency:
+            raise HttpError(413, f'a batch holds at most {self.max_concurrency} documents, not {len(requests)}')
+
+        # json content is already text, the worker parses it as utf-8 whatever its xml declaration says
+        async def parse_one(content, source_name):
+            try:
+                return await self.parse(content, source_name)
+            except HttpError as oops:
+                self.counters['errors'] += 1
+                return {'source_name': source_name, 'status': oops.status, 'error': str(oops)}
+            except Exception as oops:
+                logging.exception('Failed to parse %s', source_name)
+                self.counters['errors'] += 1
+                return {'source_name': source_name, 'status': 500, 'error': repr(oops)}
+
+        async def parse_all():
+            return await asyncio.gather(*(parse_one(content, source_name) for content, source_name in requests))
+        return await self._limited(parse_all(), len(requests))
+
+    async def _limited(self, work, documents: int = 1):
+        ''' await the given parse coroutine if the given number of documents fit below the concurrency limit, otherwise
+            reject it
+        '''
+        if self.in_flight + documents > self.max_concurrency:
+            work.close()
+            raise HttpError(503, f'{self.in_flight} documents already in flight')
+        self.in_flight += documents
+        try:
+            return await work
+        finally:
+            self.in_flight -= documents
+
+
+async def _read_request(reader: asyncio.StreamReader, max_body_bytes: int):
+    ''' read one request and return (method, target, headers, body), or None if the client closed the connection
+    '''
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError as oops:
+        raise HttpError(400, 'malformed request line') from oops
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(400, 'too many headers')
+    body = b''
+    if method == 'POST':
+        if 'content-length' not in headers:
+            raise HttpError(411, 'a Content-Length header is required')
+        try:
+            length = int(headers['content-length'])
+        except ValueError as oops:
+            raise HttpError(400, 'malformed Content-Length header') from oops
+        if length > max_body_bytes:
+            raise HttpError(413, f'request body is larger than {max_body_bytes} bytes')
+        body = await reader.readexactly(length)
+    return method, target, headers, body
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+    ''' write the given payload as a json response
+    '''
+    body = json.dumps(payload).encode('utf-8')
+    head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+def _require(method: str, expected: str):
+    ''' raise a 405 unless the request method is the expected one
+    '''
+    if method != expected:
+        raise HttpError(405, f'{method} is not allowed, use {expected}')
+
+
+def _records_json(source_name: str, records: CcdaRecords) -> dict:
+    ''' the json form of one document's records, each row keyed by its csv column
+    '''
+    return {
+        'source_name': source_name,
+        'demographics': records.demographics._asdict(),
+        'medications': [medication._asdict() for medication in records.medications],
+        'problems': [problem._asdict() for problem in records.problems],
+    }
+
+
+async def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS,
+                max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_body_bytes: int = DEFAULT_MAX_BODY_MB * 1024 * 1024):
+    ''' Run the parsing service until cancelled
+    '''
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        handler = ParseServer(executor, max_concurrency, max_body_bytes)
+        server = await asyncio.start_server(handler.handle_connection, host, port)
+        logging.warning('Serving c-cda parsing on http://%s:%d with %d workers', host, port, workers)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve c-cda parsing over http')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'number of parsing processes (default {DEFAULT_WORKERS})')
+    parser.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f'documents in flight before new requests are rejected (default {DEFAULT_MAX_CONCURRENCY})')
+    parser.add_argument('--max-body-mb', type=float, default=DEFAULT_MAX_BODY_MB,
+                        help=f'largest accepted request body (default {DEFAULT_MAX_BODY_MB})')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_concurrency, int(args.max_body_mb * 1024 * 1024)))
+    except KeyboardInterrupt:
+        pass
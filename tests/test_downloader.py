@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+''' Tests of downloader.fetch_to_file, which streams a document to disk, against a local http.server whose responses
+    are scripted per path.  Run from the repository root:
+        python -m pytest tests
+        python -m unittest discover tests
+'''
+
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from downloader import RetryPolicy, create_session, fetch_to_file
+
+DOCUMENT = b'<?xml version="1.0" encoding="UTF-8"?><ClinicalDocument xmlns="urn:hl7-org:v3"/>' * 100
+FAST_RETRY = RetryPolicy(3, 0.01, 0.05)
+
+# a scripted response: status, body, and, for a truncated response, the longer Content-Length it claims
+OK = (200, DOCUMENT, None)
+SLOW_DOWN = (503, b'<Error><Code>SlowDown</Code></Error>', None)
+NOT_FOUND = (404, b'<Error><Code>NoSuchKey</Code></Error>', None)
+TRUNCATED = (200, DOCUMENT[:1000], len(DOCUMENT))
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    ''' answers each GET with the next response scripted for its path, repeating the last one once they run out
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        with self.server.lock:
+            self.server.requests.append(path)
+            script = self.server.scripts[path]
+            status, body, length = script.pop(0) if len(script) > 1 else script[0]
+        self.send_response(status)
+        self.send_header('Content-Length', str(length or len(body)))
+        if length is not None:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        if length is not None:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class ScriptedServerTest(unittest.TestCase):
+    ''' test case serving the responses it scripts from a local server
+    '''
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _ScriptedHandler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.scripts = {}
+        self.server.requests = []
+        self.session = create_session(2)
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.session.close()
+        self.folder.cleanup()
+
+    def url(self, name: str, *responses, query: str = '') -> str:
+        ''' script the responses to the given document name and return its url
+        '''
+        self.server.scripts[f'/{name}'] = list(responses)
+        return f'http://127.0.0.1:{self.server.server_address[1]}/{name}{query}'
+
+
+class FetchToFileTest(ScriptedServerTest):
+    ''' fetch_to_file against a local server
+    '''
+    def test_fetch_to_file_writes_the_document_and_its_digest(self):
+        url = self.url('M1_D1_masked.xml', SLOW_DOWN, TRUNCATED, OK)
+        output_file = os.path.join(self.folder.name, 'M1_D1_masked.xml')
+        self.assertEqual(fetch_to_file(self.session, url, output_file, retry=FAST_RETRY),
+                         hashlib.sha256(DOCUMENT).hexdigest())
+        with open(output_file, 'rb') as fh:
+            self.assertEqual(fh.read(), DOCUMENT)
+        self.assertEqual(os.listdir(self.folder.name), ['M1_D1_masked.xml'])
+
+    def test_fetch_to_file_leaves_nothing_behind_when_it_fails(self):
+        for responses in [(TRUNCATED,), (SLOW_DOWN,), (NOT_FOUND,)]:
+            url = self.url('M1_D1_masked.xml', *responses)
+            with self.assertRaises(Exception):
+                fetch_to_file(self.session, url, os.path.join(self.folder.name, 'M1_D1_masked.xml'), retry=FAST_RETRY)
+            self.assertEqual(os.listdir(self.folder.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+''' Tests of resuming a bulk run from its manifest.sqlite: a run interrupted after writing rows it never checkpointed,
+    or stopped by a failing document, is resumed into the same folder and must leave the same csv files as a run
+    that was never interrupted.  Run from the repository root:
+        python -m pytest tests/test_manifest.py
+'''
+
+import os
+import filecmp
+import tempfile
+import unittest
+
+from benchmarks.synthetic_ccda import generate_ccda, generate_ccda_file_name
+from bulk_parsing import bulk_parse_folder, _documents_in
+from manifest import Manifest, MANIFEST_FILE
+from outputs import CsvOutput, output_files_in
+from parse_raw_ccda import parse_raw_ccda_file
+
+DOCUMENTS = 12
+BATCH_SIZE = 4
+
+class ResumeTest(unittest.TestCase):
+    ''' bulk_parse_folder resumed from the manifest of an interrupted run
+    '''
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.source = self.make_folder('source')
+        for seed in range(DOCUMENTS):
+            with open(os.path.join(self.source, generate_ccda_file_name(seed)), 'w', encoding='utf-8') as out_fh:
+                out_fh.write(generate_ccda(seed))
+        self.expected = self.make_folder('expected')
+        bulk_parse_folder(self.source, self.expected)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def make_folder(self, name: str) -> str:
+        path = os.path.join(self.folder.name, name)
+        os.makedirs(path)
+        return path
+
+    def assert_same_output(self, output_folder: str):
+        for expected, actual in zip(output_files_in(self.expected), output_files_in(output_folder)):
+            self.assertTrue(filecmp.cmp(expected, actual, shallow=False), os.path.basename(actual))
+
+    def test_rows_written_after_the_last_checkpoint_are_truncated(self):
+        output_folder = self.make_folder('interrupted')
+        source_files = _documents_in(self.source)[0]
+        # write 6 documents in batches of 4, then put the last 2 on disk without the checkpoint, as a crash would
+        with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+            manifest.restore(output_files_in(output_folder))
+            output = CsvOutput(*output_files_in(output_folder), batch_size=BATCH_SIZE, on_flush=manifest.checkpoint)
+            for source_file in source_files[:6]:
+                with manifest.track(source_file):
+                    parse_raw_ccda_file(source_file, output=output)
+            output.on_flush = None
+            output.flush()
+            for out_fh in output.handles:
+                out_fh.close()
+        with open(output_files_in(output_folder)[1], 'a', encoding='utf-8') as out_fh:
+            out_fh.write('M99,torn row')
+
+        with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+            self.assertEqual(sum(manifest.is_complete(source_file) for source_file in source_files), BATCH_SIZE)
+        bulk_parse_folder(self.source, output_folder)
+        self.assert_same_output(output_folder)
+        with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+            self.assertEqual(manifest.summary(), {'complete': DOCUMENTS})
+
+    def test_a_failed_document_is_retried(self):
+        output_folder = self.make_folder('failed')
+        failing = _documents_in(self.source)[0][DOCUMENTS // 2]
+        with open(failing, encoding='utf-8') as fh:
+            content = fh.read()
+        with open(failing, 'w', encoding='utf-8') as out_fh:
+            out_fh.write(content[:len(content) // 2])
+        with self.assertRaises(Exception):
+            bulk_parse_folder(self.source, output_folder)
+        with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+            self.assertEqual(manifest.summary(), {'complete': DOCUMENTS // 2, 'failed': 1})
+
+        with open(failing, 'w', encoding='utf-8') as out_fh:
+            out_fh.write(content)
+        bulk_parse_folder(self.source, output_folder)
+        self.assert_same_output(output_folder)
+
+    def test_a_completed_run_is_not_repeated(self):
+        bulk_parse_folder(self.source, self.expected)
+        output_folder = self.make_folder('twice')
+        bulk_parse_folder(self.source, output_folder)
+        self.assert_same_output(output_folder)
+
+    def test_files_created_after_the_last_checkpoint_are_removed(self):
+        output_folder = self.make_folder('created')
+        with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+            manifest.checkpoint({})
+        for name in output_files_in(output_folder):
+            with open(name, 'w', encoding='utf-8') as out_fh:
+                out_fh.write('stale')
+        bulk_parse_folder(self.source, output_folder)
+        self.assert_same_output(output_folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+''' Tests of the retries, status handling, and signed url expiry of downloader.fetch_content and fetch_to_file against
+    the scripted local http.server of test_downloader.py.  Run from the repository root:
+        python -m pytest tests
+        python -m unittest discover tests
+'''
+
+import os
+import time
+import unittest
+
+from downloader import RetryPolicy, NO_RETRY, DownloadFailed, UrlExpired, fetch_content, fetch_to_file, backoff_delay
+from test_downloader import ScriptedServerTest, DOCUMENT, FAST_RETRY, OK, SLOW_DOWN, NOT_FOUND, TRUNCATED
+
+class RetryTest(ScriptedServerTest):
+    ''' retries of fetch_content and fetch_to_file against a local server
+    '''
+    def test_fetch_content_retries_transient_statuses(self):
+        url = self.url('M1_D1_masked.xml', SLOW_DOWN, SLOW_DOWN, OK)
+        metrics = _Values()
+        self.assertEqual(fetch_content(self.session, url, metrics=metrics, retry=FAST_RETRY), DOCUMENT)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(metrics.values['M1_D1_masked.xml']['download_retries'], 2)
+
+    def test_fetch_content_fails_once_retries_are_exhausted(self):
+        url = self.url('M1_D1_masked.xml', SLOW_DOWN)
+        with self.assertRaises(DownloadFailed) as raised:
+            fetch_content(self.session, url, retry=RetryPolicy(2, 0.01, 0.05))
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_fetch_content_retries_truncated_bodies(self):
+        url = self.url('M1_D1_masked.xml', TRUNCATED, OK)
+        self.assertEqual(fetch_content(self.session, url, retry=FAST_RETRY), DOCUMENT)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_fetch_content_does_not_retry_not_found(self):
+        url = self.url('M1_D1_masked.xml', NOT_FOUND, OK)
+        with self.assertRaises(DownloadFailed) as raised:
+            fetch_content(self.session, url, retry=FAST_RETRY)
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_expired_signed_urls_are_not_requested(self):
+        expired = [f'?AWSAccessKeyId=KEY&Expires={int(time.time()) - 60}&Signature=SIG',
+                   '?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Date=20200101T000000Z&X-Amz-Expires=3600&X-Amz-Signature=SIG']
+        for query in expired:
+            url = self.url('M1_D1_masked.xml', OK, query=query)
+            with self.assertRaises(UrlExpired):
+                fetch_content(self.session, url, retry=FAST_RETRY)
+            with self.assertRaises(UrlExpired):
+                fetch_to_file(self.session, url, os.path.join(self.folder.name, 'M1_D1_masked.xml'), retry=FAST_RETRY)
+        self.assertEqual(self.server.requests, [])
+
+    def test_retries_stop_at_the_expiry_of_a_signed_url(self):
+        url = self.url('M1_D1_masked.xml', SLOW_DOWN, OK, query=f'?Expires={int(time.time()) + 2}')
+        with self.assertRaises(UrlExpired):
+            fetch_content(self.session, url, retry=RetryPolicy(3, 60, 60))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_no_retry_fails_on_the_first_transient_status(self):
+        url = self.url('M1_D1_masked.xml', SLOW_DOWN, OK)
+        with self.assertRaises(DownloadFailed):
+            fetch_content(self.session, url, retry=NO_RETRY)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class BackoffTest(unittest.TestCase):
+    ''' the jittered exponential backoff between retries
+    '''
+    def test_delay_is_bounded_by_the_attempt_and_max_backoff(self):
+        retry = RetryPolicy(10, 0.5, 4)
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(retry, attempt), min(4, 0.5 * 2 ** attempt))
+
+    def test_retry_after_is_honoured_up_to_max_backoff(self):
+        retry = RetryPolicy(10, 0.5, 4)
+        self.assertGreaterEqual(backoff_delay(retry, 0, retry_after=3), 3)
+        self.assertEqual(backoff_delay(retry, 0, retry_after=60), 4)
+
+
+class _Values:
+    ''' metrics sink keeping the values recorded for each document
+    '''
+    def __init__(self):
+        self.values = {}
+
+    def record_all(self, document: str, values: dict):
+        self.values.setdefault(document, {}).update(values)
+
+
+if __name__ == '__main__':
+    unittest.main()
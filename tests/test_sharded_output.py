@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+''' Tests of reopening the shard files of outputs.ShardedOutput: a sharded run interrupted after shards it never
+    checkpointed is resumed into the same folder, where shards truncated back to the checkpoint no longer match the
+    sizes in shards.json and have their rows recounted, and must leave the same shard contents and shards.json row
+    counts as a run that was never interrupted.  Run from the repository root:
+        python -m pytest tests/test_sharded_output.py
+'''
+
+import os
+import gzip
+import json
+import tempfile
+import unittest
+
+from benchmarks.synthetic_ccda import generate_ccda, generate_ccda_file_name
+from bulk_parsing import bulk_parse_folder, _documents_in
+from manifest import Manifest, MANIFEST_FILE
+from outputs import ShardedOutput, SHARD_MANIFEST_FILE, GZIP_SUFFIX, shard_files_in
+from parse_raw_ccda import parse_raw_ccda_file
+
+DOCUMENTS = 12
+BATCH_SIZE = 4
+ROWS_PER_SHARD = 5
+SHARDS = 3
+
+class ReopenTest(unittest.TestCase):
+    ''' ShardedOutput reopened by bulk_parse_folder over the shards of an interrupted run
+    '''
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.source = self.make_folder('source')
+        for seed in range(DOCUMENTS):
+            with open(os.path.join(self.source, generate_ccda_file_name(seed)), 'w', encoding='utf-8') as out_fh:
+                out_fh.write(generate_ccda(seed))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def make_folder(self, name: str) -> str:
+        path = os.path.join(self.folder.name, name)
+        os.makedirs(path)
+        return path
+
+    def interrupt(self, output_folder: str, documents: int, **sharding):
+        ''' write the given number of documents in batches of BATCH_SIZE, then flush the rest to the shards and
+            shards.json without the checkpoint, as a crash would
+        '''
+        with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+            output = ShardedOutput(output_folder, batch_size=BATCH_SIZE, on_flush=manifest.checkpoint, **sharding)
+            for source_file in _documents_in(self.source)[0][:documents]:
+                with manifest.track(source_file):
+                    parse_raw_ccda_file(source_file, output=output)
+            output.on_flush = None
+            output.flush()
+
+    def assert_same_shards(self, expected_folder: str, output_folder: str):
+        expected, actual = shard_files_in(expected_folder), shard_files_in(output_folder)
+        self.assertEqual([os.path.basename(name) for name in actual], [os.path.basename(name) for name in expected])
+        for expected_file, actual_file in zip(expected, actual):
+            self.assertEqual(_content(actual_file), _content(expected_file), os.path.basename(actual_file))
+        self.assertEqual(_recorded_rows(output_folder), _recorded_rows(expected_folder))
+
+    def test_truncated_shards_are_recounted(self):
+        for sharding in [{'rows_per_shard': ROWS_PER_SHARD}, {'shards': SHARDS}]:
+            for compress in [False, True]:
+                with self.subTest(**sharding, compress=compress):
+                    name = f'{"-".join(map(str, sharding.values()))}-{compress}'
+                    expected_folder = self.make_folder(f'expected-{name}')
+                    bulk_parse_folder(self.source, expected_folder, compress=compress, **sharding)
+
+                    output_folder = self.make_folder(f'interrupted-{name}')
+                    self.interrupt(output_folder, 6, compress=compress, **sharding)
+                    bulk_parse_folder(self.source, output_folder, compress=compress, **sharding)
+                    self.assert_same_shards(expected_folder, output_folder)
+                    with Manifest(os.path.join(output_folder, MANIFEST_FILE)) as manifest:
+                        self.assertEqual(manifest.summary(), {'complete': DOCUMENTS})
+
+    def test_shards_matching_shards_json_are_appended_to(self):
+        expected_folder = self.make_folder('expected')
+        bulk_parse_folder(self.source, expected_folder, rows_per_shard=ROWS_PER_SHARD, compress=True)
+
+        output_folder = self.make_folder('resumed')
+        self.interrupt(output_folder, BATCH_SIZE, rows_per_shard=ROWS_PER_SHARD, compress=True)
+        bulk_parse_folder(self.source, output_folder, rows_per_shard=ROWS_PER_SHARD, compress=True)
+        self.assert_same_shards(expected_folder, output_folder)
+
+    def test_recorded_rows_match_the_shard_files(self):
+        output_folder = self.make_folder('interrupted')
+        self.interrupt(output_folder, 6, rows_per_shard=ROWS_PER_SHARD)
+        bulk_parse_folder(self.source, output_folder, rows_per_shard=ROWS_PER_SHARD)
+        recorded = _recorded_rows(output_folder)
+        for shard_file in shard_files_in(output_folder):
+            self.assertEqual(recorded[os.path.basename(shard_file)], len(_content(shard_file).splitlines()) - 1)
+
+    def test_different_sharding_is_refused(self):
+        output_folder = self.make_folder('sharded')
+        bulk_parse_folder(self.source, output_folder, shards=SHARDS)
+        with self.assertRaises(ValueError):
+            ShardedOutput(output_folder, shards=SHARDS + 1)
+        with self.assertRaises(ValueError):
+            ShardedOutput(output_folder, shards=SHARDS, compress=True)
+
+
+def _content(shard_file: str) -> str:
+    ''' the decompressed text of a shard file
+    '''
+    opener = gzip.open if shard_file.endswith(GZIP_SUFFIX) else open
+    with opener(shard_file, 'rt', encoding='utf-8', newline='') as fh:
+        return fh.read()
+
+
+def _recorded_rows(output_folder: str) -> dict:
+    ''' the row count shards.json records for each shard file
+    '''
+    with open(os.path.join(output_folder, SHARD_MANIFEST_FILE), encoding='utf-8') as fh:
+        manifest = json.load(fh)
+    return {entry['file']: entry['rows'] for domain in manifest['domains'].values() for entry in domain['files']}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+''' Tests of parsers/streaming.py parse_ccda_sections against the dictionaries xmltodict.parse gives for the same
+    documents, written out by hand, for the kept header elements and sections.  Run from the repository root:
+        python -m pytest tests/test_streaming.py
+'''
+
+import io
+import mmap
+import tempfile
+import unittest
+
+from parsers.streaming import parse_ccda_sections
+
+MEDICATIONS = '2.16.840.1.113883.10.20.22.2.1.1'
+PROBLEMS = '2.16.840.1.113883.10.20.22.2.5.1'
+VITALS = '2.16.840.1.113883.10.20.22.2.4.1'
+HEADER = ['id', 'effectiveTime', 'recordTarget']
+
+def document(*sections: str, declaration: str = '<?xml version="1.0" encoding="UTF-8"?>') -> str:
+    ''' a c-cda document with the given section elements in its structuredBody
+    '''
+    components = ''.join(f'<component>{section}</component>' for section in sections)
+    return (f'{declaration}<ClinicalDocument xmlns="urn:hl7-org:v3" classCode="DOCCLIN">'
+            '<realmCode code="US"/><id root="2.16.840.1.113883.19" extension="D1"/><title>Summary</title>'
+            '<effectiveTime value="20190301103000-0500"/>'
+            '<recordTarget><patientRole><id extension="M1"/><patient><name><given>Ann</given><given>Marie</given>'
+            '<family>Lee</family></name><birthTime value="19800101"/></patient></patientRole></recordTarget>'
+            '<author><time value="20190301"/></author>'
+            f'<component><structuredBody>{components}</structuredBody></component></ClinicalDocument>')
+
+
+def section(root: str, body: str, preamble: str = '') -> str:
+    ''' a section with the given templateId root, preceded by preamble, and body
+    '''
+    return (f'<section>{preamble}<templateId root="{root}"/><templateId root="{root}" extension="2014-06-09"/>'
+            f'{body}</section>')
+
+
+def template_ids(root: str) -> list:
+    ''' the parsed templateIds of a section built by section
+    '''
+    return [{'@root': root}, {'@root': root, '@extension': '2014-06-09'}]
+
+
+RECORD_TARGET = {'patientRole': {'id': {'@extension': 'M1'},
+                                 'patient': {'name': {'given': ['Ann', 'Marie'], 'family': 'Lee'},
+                                             'birthTime': {'@value': '19800101'}}}}
+
+class ParseSectionsTest(unittest.TestCase):
+    ''' parse_ccda_sections
+    '''
+    def parse(self, source, roots=(MEDICATIONS, PROBLEMS)) -> dict:
+        return parse_ccda_sections(source, HEADER, list(roots))['ClinicalDocument']
+
+    def components(self, source, roots=(MEDICATIONS, PROBLEMS)) -> list:
+        return self.parse(source, roots)['component']['structuredBody']['component']
+
+    def test_header_elements_and_root_attributes(self):
+        parsed = self.parse(document())
+        self.assertEqual(parsed, {
+            '@xmlns': 'urn:hl7-org:v3', '@classCode': 'DOCCLIN',
+            'id': {'@root': '2.16.840.1.113883.19', '@extension': 'D1'},
+            'effectiveTime': {'@value': '20190301103000-0500'},
+            'recordTarget': RECORD_TARGET,
+            'component': {'structuredBody': {'component': []}},
+        })
+
+    def test_single_entries_are_dictionaries_and_repeated_entries_lists(self):
+        one = '<entry><act classCode="ACT"><id root="a1"/></act></entry>'
+        two = '<entry><act classCode="ACT"><id root="a1"/></act></entry><entry><act classCode="ACT"/></entry>'
+        components = self.components(document(section(MEDICATIONS, one), section(PROBLEMS, two)))
+        self.assertEqual(components, [
+            {'section': {'templateId': template_ids(MEDICATIONS),
+                         'entry': {'act': {'@classCode': 'ACT', 'id': {'@root': 'a1'}}}}},
+            {'section': {'templateId': template_ids(PROBLEMS),
+                         'entry': [{'act': {'@classCode': 'ACT', 'id': {'@root': 'a1'}}},
+                                   {'act': {'@classCode': 'ACT'}}]}},
+        ])
+
+    def test_a_single_kept_section_is_still_a_list_of_components(self):
+        components = self.components(document(section(MEDICATIONS, '<title>Medications</title>')))
+        self.assertEqual(components, [{'section': {'templateId': template_ids(MEDICATIONS), 'title': 'Medications'}}])
+
+    def test_attributes_text_and_empty_elements(self):
+        body = ('<code code="10160-0" codeSystem="2.16.840.1.113883.6.1">History of medication use</code>'
+                '<title>  Medications  </title><text/><entry><substanceAdministration moodCode="EVN"/></entry>')
+        parsed = self.components(document(section(MEDICATIONS, body)))[0]['section']
+        self.assertEqual(parsed['code'], {'@code': '10160-0', '@codeSystem': '2.16.840.1.113883.6.1',
+                                          '#text': 'History of medication use'})
+        self.assertEqual(parsed['title'], 'Medications')
+        self.assertIsNone(parsed['text'])
+        self.assertEqual(parsed['entry'], {'substanceAdministration': {'@moodCode': 'EVN'}})
+
+    def test_mixed_content(self):
+        body = ('<text>Take <content ID="m1">one tablet</content> daily with <content>food</content>.'
+                '<br/></text>')
+        parsed = self.components(document(section(MEDICATIONS, body)))[0]['section']
+        self.assertEqual(parsed['text'], {'content': [{'@ID': 'm1', '#text': 'one tablet'}, 'food'], 'br': None,
+                                          '#text': 'Take  daily with .'})
+
+    def test_unrequested_sections_and_header_elements_are_skipped(self):
+        source = document(section(VITALS, '<entry><organizer/></entry>'), section(MEDICATIONS, ''),
+                          '<section><title>No template</title></section>', section(PROBLEMS, ''))
+        parsed = self.parse(source)
+        self.assertNotIn('title', parsed)
+        self.assertNotIn('author', parsed)
+        self.assertNotIn('realmCode', parsed)
+        components = parsed['component']['structuredBody']['component']
+        self.assertEqual([component['section']['templateId'][0]['@root'] for component in components],
+                         [MEDICATIONS, PROBLEMS])
+        self.assertEqual(self.components(source, [VITALS]),
+                         [{'section': {'templateId': template_ids(VITALS), 'entry': {'organizer': None}}}])
+
+    def test_template_id_after_the_section_id(self):
+        preamble = '<realmCode code="US"/><typeId root="2.16.840.1.113883.1.3"/><id root="s1"/>'
+        components = self.components(document(section(MEDICATIONS, '<title>Medications</title>', preamble)))
+        self.assertEqual(components, [{'section': {'realmCode': {'@code': 'US'},
+                                                   'typeId': {'@root': '2.16.840.1.113883.1.3'},
+                                                   'id': {'@root': 's1'}, 'templateId': template_ids(MEDICATIONS),
+                                                   'title': 'Medications'}}])
+
+    def test_template_id_after_the_code_is_not_seen(self):
+        late = f'<section><code code="10160-0"/><templateId root="{MEDICATIONS}"/></section>'
+        self.assertEqual(self.components(document(late)), [])
+
+    def test_encodings(self):
+        body = '<title>Médicaments</title>'
+        expected = [{'section': {'templateId': template_ids(MEDICATIONS), 'title': 'Médicaments'}}]
+        for encoding in ['UTF-8', 'ISO-8859-1', 'UTF-16']:
+            source = document(section(MEDICATIONS, body),
+                              declaration=f'<?xml version="1.0" encoding="{encoding}"?>').encode(encoding)
+            self.assertEqual(self.components(source), expected, encoding)
+        self.assertEqual(self.components(document(section(MEDICATIONS, body))), expected)
+
+    def test_entities_in_text_and_attributes(self):
+        body = '<title>A &amp; B &lt;1&gt;</title><entry><act moodCode="&quot;EVN&quot;"/></entry>'
+        parsed = self.components(document(section(MEDICATIONS, body)))[0]['section']
+        self.assertEqual(parsed['title'], 'A & B <1>')
+        self.assertEqual(parsed['entry'], {'act': {'@moodCode': '"EVN"'}})
+
+    def test_sources(self):
+        text = document(section(MEDICATIONS, '<title>Medications</title>'))
+        expected = self.parse(text)
+        data = text.encode('utf-8')
+        self.assertEqual(self.parse(data), expected)
+        self.assertEqual(self.parse(io.BytesIO(data)), expected)
+        with tempfile.TemporaryFile() as fh:
+            fh.write(data)
+            fh.flush()
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.assertEqual(self.parse(mapped), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+''' Tests of the HL7 TS date and timestamp parsing of parsers/timestamps.py.  Run from the repository root:
+        python -m pytest tests
+'''
+
+import unittest
+
+from parsers.timestamps import hl7_date, hl7_timestamp
+
+class DateTest(unittest.TestCase):
+    ''' hl7_date
+    '''
+    def test_partial_precision_is_kept(self):
+        self.assertEqual(hl7_date('2019'), '2019')
+        self.assertEqual(hl7_date('201903'), '2019-03')
+        self.assertEqual(hl7_date('20190301'), '2019-03-01')
+
+    def test_time_and_offset_are_dropped(self):
+        self.assertEqual(hl7_date('20190301103000-0500'), '2019-03-01')
+        self.assertEqual(hl7_date('20190301103000.1234+0100'), '2019-03-01')
+
+    def test_malformed_time_keeps_the_date(self):
+        for value in ['20190301120000Z', '20190301120000.000-05:00', '20190301240000', '20190301T1200',
+                      '2019030112000', '20190301120060', '20190301103000-1500']:
+            self.assertEqual(hl7_date(value), '2019-03-01', value)
+
+    def test_malformed_dates_give_none(self):
+        for value in ['', 'abc', '19', '201913', '20190230', '20190229', '20190001', None, 20190301]:
+            self.assertIsNone(hl7_date(value), value)
+
+    def test_leap_days(self):
+        self.assertEqual(hl7_date('20200229'), '2020-02-29')
+        self.assertEqual(hl7_date('20000229'), '2000-02-29')
+        self.assertIsNone(hl7_date('19000229'))
+
+    def test_surrounding_whitespace_is_ignored(self):
+        self.assertEqual(hl7_date(' 20190301 '), '2019-03-01')
+
+
+class TimestampTest(unittest.TestCase):
+    ''' hl7_timestamp
+    '''
+    def test_recorded_precision_is_kept(self):
+        self.assertEqual(hl7_timestamp('2019'), '2019')
+        self.assertEqual(hl7_timestamp('20190301'), '2019-03-01')
+        self.assertEqual(hl7_timestamp('2019030110'), '2019-03-01T10:00')
+        self.assertEqual(hl7_timestamp('201903011030'), '2019-03-01T10:30')
+        self.assertEqual(hl7_timestamp('20190301103015'), '2019-03-01T10:30:15')
+        self.assertEqual(hl7_timestamp('20190301103015.25'), '2019-03-01T10:30:15.25')
+
+    def test_timezone_offsets_are_kept(self):
+        self.assertEqual(hl7_timestamp('20190301103000-0500'), '2019-03-01T10:30:00-05:00')
+        self.assertEqual(hl7_timestamp('201903011030+0130'), '2019-03-01T10:30+01:30')
+
+    def test_malformed_time_or_offset_gives_the_date(self):
+        for value in ['20190301120000Z', '20190301120000.000-05:00', '20190301240000', '20190301T1200',
+                      '2019030112000', '20190301120060', '20190301103000-1500']:
+            self.assertEqual(hl7_timestamp(value), '2019-03-01', value)
+
+    def test_malformed_dates_give_none(self):
+        for value in ['', 'abc', '20190230103000', None]:
+            self.assertIsNone(hl7_timestamp(value), value)
+
+
+if __name__ == '__main__':
+    unittest.main()